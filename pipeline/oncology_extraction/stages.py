@@ -0,0 +1,203 @@
+"""
+Stage functions for the oncology extraction pipeline (see pipeline.json).
+
+Each stage reads the output folders of its upstream stages from `inputs` and
+writes its own outputs into `output_dir`. Outputs must be deterministic for the
+same inputs (e.g. sorted by document ID) so that downstream caches stay valid
+when an upstream stage re-runs without changes.
+"""
+
+import json
+import os
+
+from bioext import codec_utils
+
+
+def _read_documents(folder):
+    yield from codec_utils.codec.iter_jsonl(os.path.join(folder, "documents.jsonl"))
+
+
+def _write_jsonl(path, records):
+    codec_utils.codec.write_jsonl(records, path)
+
+
+def query_documents(inputs, output_dir, index_name, query, content_field):
+    """Export documents matching the query from the source index"""
+    from bioext.elastic_utils import ElasticsearchSession
+
+    es_session = ElasticsearchSession()
+    # only the content field is fetched and kept per hit
+    hits = es_session.iter_hits(index_name, query, fields=[content_field])
+    documents = [
+        {"id": hit.id, "text": hit.source[content_field]}
+        for hit in hits
+        if content_field in hit.source
+    ]
+    documents.sort(key=lambda doc: doc["id"])
+    _write_jsonl(os.path.join(output_dir, "documents.jsonl"), documents)
+    print(f"Exported {len(documents)} documents")
+
+
+def preprocess_documents(inputs, output_dir, preprocess=None, dedup_threshold=0.9):
+    """
+    Strip boilerplate, normalise and segment letters, then drop near-duplicates,
+    recording which document each duplicates
+    """
+    from bioext.dedup_utils import MinHashLSH
+    from bioext.preprocess_utils import preprocess_documents as clean_documents
+
+    documents = ((doc["id"], doc["text"]) for doc in _read_documents(inputs["query"]))
+    results = {r.doc_id: r for r in clean_documents(documents, preprocess)}
+
+    unique, duplicate_of = [], {}
+    cleaned = ((doc_id, r.text) for doc_id, r in results.items())
+    for doc_id, _, original in MinHashLSH(threshold=dedup_threshold).deduplicate(
+        cleaned
+    ):
+        if original is None:
+            # offsets map extracted spans back to the exported letter
+            unique.append(results[doc_id].to_dict())
+        else:
+            duplicate_of[doc_id] = original
+
+    _write_jsonl(
+        os.path.join(output_dir, "documents.jsonl"),
+        ({"id": r.pop("doc_id"), **r} for r in unique),
+    )
+    with open(os.path.join(output_dir, "duplicates.json"), "w") as f:
+        json.dump(duplicate_of, f, indent=2, sort_keys=True)
+    chars_in = sum(r.original_length for r in results.values())
+    chars_out = sum(len(r.text) for r in results.values())
+    print(
+        f"Kept {len(unique)} documents, dropped {len(duplicate_of)} near-duplicates; "
+        f"preprocessing removed {1 - chars_out / max(chars_in, 1):.1%} of characters"
+    )
+
+
+def extract(
+    inputs,
+    output_dir,
+    url,
+    prompt_name,
+    prompt_version=None,
+    max_request_tokens=8192,
+    max_output_tokens=2048,
+    max_inflight_tokens=65536,
+    max_workers=16,
+):
+    """Send letters to the extraction endpoint and merge chunked outputs"""
+    import requests
+
+    from bioext.extraction_utils import RequestPlanner
+    from bioext.prompt_utils import PromptRegistry
+
+    prompt = PromptRegistry().get(prompt_name, prompt_version)
+    planner = RequestPlanner(
+        prompt.system_prompt,
+        max_request_tokens=max_request_tokens,
+        max_output_tokens=max_output_tokens,
+        max_inflight_tokens=max_inflight_tokens,
+    )
+    http = requests.Session()
+    # {doc_id: error}; one failing letter must not discard the whole stage
+    failures = {}
+
+    def send_request(req):
+        body = prompt.encode_payload(
+            req.text, temperature=0.0, max_tokens=planner.max_output_tokens
+        )
+        try:
+            response = http.post(
+                url, headers={"Content-Type": "application/json"}, data=body
+            )
+            response.raise_for_status()
+            content = codec_utils.loads(response.content)
+            return content["choices"][0]["message"]["content"]
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            failures[req.doc_id] = f"chunk {req.chunk_index}: {e}"
+            return None
+
+    letters = {doc["id"]: doc["text"] for doc in _read_documents(inputs["preprocess"])}
+    results = planner.run(
+        planner.plan(letters), send_request, max_workers=max_workers, schema=prompt.schema
+    )
+    # a letter with a failed chunk would only be partly extracted
+    for doc_id in failures:
+        results[doc_id] = None
+
+    # near-duplicates share the result of the letter they duplicate
+    with open(os.path.join(inputs["preprocess"], "duplicates.json")) as f:
+        for doc_id, original in json.load(f).items():
+            results[doc_id] = results.get(original)
+
+    _write_jsonl(
+        os.path.join(output_dir, "extractions.jsonl"),
+        ({"id": doc_id, "extraction": results[doc_id]} for doc_id in sorted(results)),
+    )
+    with open(os.path.join(output_dir, "provenance.json"), "w") as f:
+        json.dump(prompt.provenance(), f, indent=2)
+    with open(os.path.join(output_dir, "failures.json"), "w") as f:
+        json.dump(failures, f, indent=2, sort_keys=True)
+    n_unparsed = sum(result is None for result in results.values())
+    print(
+        f"Extracted {len(results)} documents, "
+        f"{n_unparsed} without a JSON extraction ({len(failures)} failed requests; "
+        "re-run with -f extract to retry them)"
+    )
+
+
+def _read_extractions(folder):
+    """
+    (id, extraction dict or None) pairs, provenance metadata and the number of
+    documents without an extraction
+    """
+    with open(os.path.join(folder, "provenance.json")) as f:
+        metadata = json.load(f)
+    results = [
+        (r["id"], r["extraction"])
+        for r in codec_utils.codec.iter_jsonl(os.path.join(folder, "extractions.jsonl"))
+    ]
+    n_unparsed = sum(extraction is None for _, extraction in results)
+    if n_unparsed:
+        print(
+            f"{n_unparsed}/{len(results)} documents have no JSON extraction and are "
+            "staged with metadata only"
+        )
+    return results, metadata, n_unparsed
+
+
+def stage_outputs(inputs, output_dir, index_name):
+    """Upsert extraction outputs into the Elasticsearch output index"""
+    from bioext.elastic_utils import ElasticsearchSession
+    from bioext.prompt_utils import PromptRegistry
+    from bioext.sink_utils import ExtractionSink
+
+    results, metadata, n_unparsed = _read_extractions(inputs["extract"])
+    prompt = PromptRegistry().get(metadata["prompt_name"], metadata["prompt_version"])
+    sink = ExtractionSink(
+        es_session=ElasticsearchSession(), index_name=index_name, schema=prompt.schema
+    )
+    n_staged = sink.write(results, metadata=metadata)
+
+    # the index lives outside the cache; record what was staged
+    with open(os.path.join(output_dir, "staged.json"), "w") as f:
+        json.dump(
+            {"index_name": index_name, "n_staged": n_staged, "n_unparsed": n_unparsed},
+            f,
+            indent=2,
+        )
+
+
+def tabulate(inputs, output_dir, n_partitions=16):
+    """Flatten extraction outputs into partitioned Parquet tables"""
+    from bioext.prompt_utils import PromptRegistry
+    from bioext.sink_utils import ExtractionSink
+
+    results, metadata, _ = _read_extractions(inputs["extract"])
+    prompt = PromptRegistry().get(metadata["prompt_name"], metadata["prompt_version"])
+    sink = ExtractionSink(
+        parquet_dir=os.path.join(output_dir, "tables"),
+        schema=prompt.schema,
+        n_partitions=n_partitions,
+    )
+    sink.write(results, metadata=metadata)
@@ -0,0 +1,124 @@
+"""
+Compare CPU training throughput and peak memory for fixed max_length padding against
+dynamic padding with length-grouped batches.
+
+Each configuration runs in its own subprocess so that peak RSS is measured
+independently. Seeds, data slice and step count are fixed, so runs are reproducible.
+
+    python bench_padding.py --steps 20 --model_name prajjwal1/bert-tiny
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+from transformers import (
+    DataCollatorWithPadding,
+    Trainer,
+    TrainingArguments,
+    default_data_collator,
+    set_seed,
+)
+
+from train import load_and_prepare_data, prepare_model_and_tokenizer, tokenize_function
+
+MODES = {
+    # current setup before dynamic padding
+    "fixed": {"padding": "max_length", "group_by_length": False},
+    "dynamic": {"padding": False, "group_by_length": False},
+    "dynamic_grouped": {"padding": False, "group_by_length": True},
+}
+
+
+def run_mode(mode, model_name, steps, batch_size, max_length):
+    set_seed(42)
+
+    train_dataset, _ = load_and_prepare_data()
+    model, tokenizer = prepare_model_and_tokenizer(model_name)
+
+    cfg = MODES[mode]
+    train_tokenized = train_dataset.map(
+        lambda x: tokenize_function(
+            x, tokenizer, padding=cfg["padding"], max_length=max_length
+        ),
+        batched=True,
+        remove_columns=["text"],
+    )
+
+    collator = (
+        default_data_collator
+        if cfg["padding"] == "max_length"
+        else DataCollatorWithPadding(tokenizer)
+    )
+    args = TrainingArguments(
+        output_dir=f"./bench_results/{mode}",
+        max_steps=steps,
+        per_device_train_batch_size=batch_size,
+        group_by_length=cfg["group_by_length"],
+        use_cpu=True,
+        save_strategy="no",
+        report_to=[],
+        seed=42,
+        data_seed=42,
+    )
+    trainer = Trainer(
+        model=model,
+        args=args,
+        train_dataset=train_tokenized,
+        data_collator=collator,
+    )
+    metrics = trainer.train().metrics
+
+    return {
+        "mode": mode,
+        "samples_per_s": metrics["train_samples_per_second"],
+        "train_runtime_s": metrics["train_runtime"],
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name", default="bert-base-uncased")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--max_length", type=int, default=512)
+    parser.add_argument("--mode", choices=list(MODES), default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        result = run_mode(
+            args.mode, args.model_name, args.steps, args.batch_size, args.max_length
+        )
+        print("RESULT " + json.dumps(result))
+        return
+
+    results = []
+    for mode in MODES:
+        print(f"Running {mode}...")
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode]
+            + ["--model_name", args.model_name, "--steps", str(args.steps)]
+            + ["--batch_size", str(args.batch_size)]
+            + ["--max_length", str(args.max_length)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        line = next(l for l in output.splitlines() if l.startswith("RESULT "))
+        results.append(json.loads(line[len("RESULT ") :]))
+
+    baseline = results[0]["samples_per_s"]
+    print(f"{'mode':<18}{'samples/s':>12}{'speedup':>10}{'peak RSS MB':>14}")
+    for r in results:
+        print(
+            f"{r['mode']:<18}{r['samples_per_s']:>12.2f}"
+            f"{r['samples_per_s'] / baseline:>9.2f}x{r['peak_rss_mb']:>14.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
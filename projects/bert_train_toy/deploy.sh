@@ -5,4 +5,11 @@ export MLFLOW_S3_ENDPOINT_URL=http://localhost:9000
 export MLFLOW_S3_IGNORE_TLS=true
 export AWS_DEFAULT_REGION=minio
 
-mlflow models serve -m "s3://mlflow-artifacts/1/f460f9114c314b1d812d0ec48fea9728/artifacts/bert_model" -p 8080
\ No newline at end of file
+MODEL_URI="s3://mlflow-artifacts/1/f460f9114c314b1d812d0ec48fea9728/artifacts/bert_model"
+
+# ./deploy.sh batched -> micro-batching CPU server from bioext
+if [ "$1" == "batched" ]; then
+    python -m bioext.serving_utils -m "$MODEL_URI" -p 8081 --max_batch_size 32 --max_wait_ms 10
+else
+    mlflow models serve -m "$MODEL_URI" -p 8080
+fi
@@ -0,0 +1,74 @@
+"""
+Load test an MLflow-format scoring endpoint with concurrent single-text requests and
+report p50/p99 latency and requests/s.
+
+Run once against `mlflow models serve` and once against the micro-batching server
+(see deploy.sh) to compare, e.g.:
+
+    python loadtest.py --url http://localhost:8080/invocations -n 500 -c 32
+    python loadtest.py --url http://localhost:8081/invocations -n 500 -c 32
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SNIPPETS = [
+    "BRCA1 pathogenic variant detected.",
+    "No pathogenic variants identified in BRCA1 or BRCA2.",
+    "BRCA2 variant of uncertain significance c.7397T>C, not actionable at present. "
+    "Family history of breast and ovarian cancer in maternal relatives.",
+    "Referred to clinical genetics following diagnosis of triple negative breast "
+    "cancer at age 38. Germline testing of BRCA1, BRCA2, PALB2 requested; results "
+    "to follow. Patient counselled regarding implications for relatives.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080/invocations")
+    parser.add_argument("-n", "--n_requests", type=int, default=500)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    texts = [random.choice(SNIPPETS) for _ in range(args.n_requests)]
+    session = requests.Session()
+    session.mount(
+        "http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    )
+
+    def send(text):
+        start = time.perf_counter()
+        response = session.post(
+            args.url,
+            data=json.dumps({"inputs": [text]}),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    # warm up
+    send(texts[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(send, texts))
+    wall = time.perf_counter() - start
+
+    p99_idx = min(len(latencies) - 1, int(0.99 * len(latencies)))
+    print(f"URL: {args.url}")
+    print(f"Requests: {args.n_requests}, concurrency: {args.concurrency}")
+    print(f"p50 latency: {1000 * statistics.median(latencies):.1f} ms")
+    print(f"p99 latency: {1000 * latencies[p99_idx]:.1f} ms")
+    print(f"Throughput: {args.n_requests / wall:.1f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
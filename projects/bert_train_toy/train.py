@@ -1,3 +1,5 @@
+import argparse
+
 import mlflow
 import numpy as np
 from datasets import load_dataset
@@ -6,15 +8,20 @@ from sklearn.metrics import accuracy_score
 from transformers import (
     AutoModelForSequenceClassification,
     AutoTokenizer,
+    DataCollatorWithPadding,
     Trainer,
     TrainingArguments,
 )
 
+from bioext.tracking_utils import AsyncTracker, trainer_callback
+from bioext.training_utils import tokenize_dataset
+
 
 def load_and_prepare_data():
     dataset = load_dataset("imdb", split="train[:1000]")
     # print(dataset.to_pandas().head())
-    dataset_dict = dataset.train_test_split(test_size=0.2)
+    # fixed seed keeps split fingerprints stable, so tokenization can be cached
+    dataset_dict = dataset.train_test_split(test_size=0.2, seed=42)
     return dataset_dict["train"], dataset_dict["test"]
 
 
@@ -27,12 +34,13 @@ def prepare_model_and_tokenizer(model_name="bert-base-uncased"):
     return model, tokenizer
 
 
-def tokenize_function(examples, tokenizer):
+def tokenize_function(examples, tokenizer, padding=False, max_length=512):
+    # no padding here: batches are padded to their longest member by the collator
     return tokenizer(
         examples["text"],
-        padding="max_length",
+        padding=padding,
         truncation=True,
-        max_length=512,
+        max_length=max_length,
     )
 
 
@@ -42,15 +50,18 @@ def compute_metrics(eval_pred):
     return {"accuracy": accuracy_score(labels, predictions)}
 
 
-def train_model(model, tokenizer, train_dataset, eval_dataset):
-    train_tokenized = train_dataset.map(
-        lambda x: tokenize_function(x, tokenizer),
-        batched=True,
+def train_model(
+    model, tokenizer, train_dataset, eval_dataset, max_length=512, tracker=None
+):
+    # tokenized splits are cached on disk and reused across runs and sweeps
+    train_tokenized, train_cached = tokenize_dataset(
+        train_dataset, tokenizer, max_length=max_length
     )
-    eval_tokenized = eval_dataset.map(
-        lambda x: tokenize_function(x, tokenizer),
-        batched=True,
+    eval_tokenized, eval_cached = tokenize_dataset(
+        eval_dataset, tokenizer, max_length=max_length
     )
+    if tracker is not None:
+        tracker.set_tag("tokenization_cache_hit", train_cached and eval_cached)
 
     training_args = TrainingArguments(
         output_dir="./results",
@@ -60,6 +71,10 @@ def train_model(model, tokenizer, train_dataset, eval_dataset):
         eval_strategy="epoch",
         save_strategy="epoch",
         load_best_model_at_end=True,
+        # batch examples of similar length together to minimise padding
+        group_by_length=True,
+        # per-step metrics go through the non-blocking tracker instead
+        report_to="none",
     )
 
     trainer = Trainer(
@@ -67,7 +82,9 @@ def train_model(model, tokenizer, train_dataset, eval_dataset):
         args=training_args,
         train_dataset=train_tokenized,
         eval_dataset=eval_tokenized,
+        data_collator=DataCollatorWithPadding(tokenizer),
         compute_metrics=compute_metrics,
+        callbacks=[trainer_callback(tracker)] if tracker is not None else None,
     )
 
     trainer.train()
@@ -75,7 +92,7 @@ def train_model(model, tokenizer, train_dataset, eval_dataset):
     return trainer, train_tokenized
 
 
-def main():
+def main(export_variants=False):
     experiment_name = "bert-binary-classification"
     mlflow.set_tracking_uri("http://localhost:5001")
     # mlflow.create_experiment(experiment_name)
@@ -86,8 +103,8 @@ def main():
     train_dataset, eval_dataset = load_and_prepare_data()
     print("Loaded and prepared data")
 
-    # start mlflow run
-    with mlflow.start_run() as run:
+    # start mlflow run; the tracker flushes and finishes uploads before it ends
+    with mlflow.start_run() as run, AsyncTracker(run.info.run_id) as tracker:
         # load model
         model, tokenizer = prepare_model_and_tokenizer()
         print("Prepared model and tokenizer")
@@ -99,6 +116,7 @@ def main():
             tokenizer,
             train_dataset,
             eval_dataset,
+            tracker=tracker,
         )
 
         # sample input for model signature
@@ -111,14 +129,15 @@ def main():
             return_tensors="pt",
         )
 
-        # log model to mlflow
+        # save model locally and upload to mlflow in the background
         print("Log training params")
-        mlflow.transformers.log_model(
+        tracker.log_model(
+            mlflow.transformers.save_model,
+            "bert_model",
             transformers_model={
                 "model": model,
                 "tokenizer": tokenizer,
             },
-            artifact_path="bert_model",
             task="text-classification",
             signature=infer_signature(sample_input, np.array([[0.1, 0.9]])),
         )
@@ -126,8 +145,31 @@ def main():
         # log metrics to mlflow
         print("Evaluation metrics")
         metrics = trainer.evaluate()
-        mlflow.log_metrics(metrics)
+        tracker.log_metrics(metrics)
+
+        # optional int8 / ONNX variants, checked against eval accuracy and benchmarked
+        if export_variants:
+            # onnx/onnxruntime are only needed for this step
+            from bioext.export_utils import export_and_benchmark
+
+            print("Export and benchmark model variants")
+            export_and_benchmark(
+                model,
+                tokenizer,
+                eval_dataset["text"],
+                eval_dataset["label"],
+                tolerance=0.01,
+                tracker=tracker,
+            )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--export_variants",
+        action="store_true",
+        help="Also log int8-quantized and ONNX variants with a CPU benchmark",
+    )
+    args = parser.parse_args()
+
+    main(export_variants=args.export_variants)
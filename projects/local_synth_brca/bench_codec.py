@@ -0,0 +1,134 @@
+"""
+Benchmark JSON encoding/decoding and hit records on synthetic Elasticsearch hits.
+Compares each installed JSON backend with the standard library, the per-file
+export of `bulk_retrieve_documents` before (json.dump with indent=2) and after,
+and the memory held by a batch of raw hit dicts versus compact Hit records.
+
+    python bench_codec.py --n_docs 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from synthetic_letters import synthetic_letter
+
+from bioext.codec_utils import BACKENDS, Hit, JsonCodec
+
+
+def synthetic_hit(rng, i):
+    return {
+        "_index": "synth_brca_reports",
+        "_id": f"doc{i:08d}",
+        "_score": 1.0,
+        "_source": {
+            "text": synthetic_letter(rng),
+            "patient_id": rng.randint(10**9, 10**10 - 1),
+            "document_type": rng.choice(["clinic_letter", "mdt_outcome", "report"]),
+            "created": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "author": {"name": "Dr A Jones", "role": "Consultant"},
+        },
+    }
+
+
+def available_codecs():
+    codecs = {}
+    for name in BACKENDS:
+        try:
+            codecs[name] = JsonCodec(name)
+        except ImportError:
+            print(f"{name} not installed, skipping")
+    return codecs
+
+
+def bench_roundtrip(codecs, hits):
+    encoded = [json.dumps(hit).encode("utf-8") for hit in hits]
+    timings = {}
+    for name, codec in codecs.items():
+        start = time.perf_counter()
+        for hit in hits:
+            codec.dumps(hit)
+        encode_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in encoded:
+            codec.loads(data)
+        timings[name] = (encode_s, time.perf_counter() - start)
+
+    baseline = sum(timings["json"])
+    for name, (encode_s, decode_s) in timings.items():
+        print(
+            f"{name:>8}: encode {len(hits) / encode_s:,.0f} hits/s, "
+            f"decode {len(hits) / decode_s:,.0f} hits/s "
+            f"({baseline / (encode_s + decode_s):.1f}x stdlib)"
+        )
+
+
+def bench_export(codec, hits):
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        for hit in hits:
+            with open(os.path.join(folder, f"{hit['_id']}.json"), "w") as f:
+                json.dump(hit, f, indent=2)
+        for hit in hits:
+            with open(os.path.join(folder, f"{hit['_id']}.json")) as f:
+                json.load(f)
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for hit in hits:
+            codec.dump(hit, os.path.join(folder, f"{hit['_id']}.json"))
+        for hit in hits:
+            codec.load(os.path.join(folder, f"{hit['_id']}.json"))
+        after = time.perf_counter() - start
+    print(
+        f"Per-file export + reload: {len(hits) / before:,.0f} -> "
+        f"{len(hits) / after:,.0f} docs/s ({before / after:.1f}x)"
+    )
+
+
+def held_memory(codec, encoded, to_record):
+    tracemalloc.start()
+    records = [to_record(codec.loads(data)) for data in encoded]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def bench_memory(codec, hits):
+    encoded = [codec.dumps(hit) for hit in hits]
+    raw = held_memory(codec, encoded, lambda hit: hit)
+    for label, to_record in [
+        ("Hit, all fields", Hit.from_es),
+        ("Hit, text only", lambda hit: Hit.from_es(hit, fields=["text"])),
+    ]:
+        size = held_memory(codec, encoded, to_record)
+        print(
+            f"Memory for {len(hits):,} hits: raw dicts {raw / 2**20:.1f} MB, "
+            f"{label} {size / 2**20:.1f} MB ({1 - size / raw:.0%} less)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_docs", type=int, default=100_000)
+    parser.add_argument("--n_files", type=int, default=10_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    hits = [synthetic_hit(rng, i) for i in range(args.n_docs)]
+    codecs = available_codecs()
+    fastest = next(iter(codecs.values()))
+    print(f"Default backend: {fastest.backend}")
+
+    bench_roundtrip(codecs, hits)
+    bench_export(fastest, hits[: args.n_files])
+    bench_memory(fastest, hits)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark the MinHash/LSH near-duplicate index on synthetic clinic letters.
+
+A fraction of letters are "copied forward" from an earlier letter with small
+edits, as happens in real clinic correspondence. Reports signing, insert and
+query throughput, peak memory, and precision/recall against the known copies.
+
+    python bench_dedup.py --n_docs 1000000
+"""
+
+import argparse
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from synthetic_letters import synthetic_letter
+
+from bioext.dedup_utils import MinHashLSH
+
+
+def copy_forward(rng, text):
+    """
+    Copy a letter with a few words changed and a short update appended
+    """
+    words = text.split()
+    for _ in range(rng.randint(1, 2)):
+        words[rng.randrange(len(words))] = rng.choice(["today", "reviewed", "stable"])
+    return " ".join(words) + f" Seen again on {rng.randint(1, 28)}/11/2024."
+
+
+def generate(n_docs, duplicate_rate, seed=0):
+    """
+    Yield (doc_id, text, source_id) where source_id is the copied letter, if any
+    """
+    rng = random.Random(seed)
+    recent = []
+    for i in range(n_docs):
+        if recent and rng.random() < duplicate_rate:
+            source_id, source_text = rng.choice(recent)
+            yield f"doc{i}", copy_forward(rng, source_text), source_id
+        else:
+            text = synthetic_letter(rng)
+            recent.append((f"doc{i}", text))
+            recent = recent[-1000:]
+            yield f"doc{i}", text, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_docs", type=int, default=1_000_000)
+    parser.add_argument("--duplicate_rate", type=float, default=0.2)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--num_perm", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=5000)
+    args = parser.parse_args()
+
+    docs = list(generate(args.n_docs, args.duplicate_rate))
+    copied = {doc_id for doc_id, _, source in docs if source}
+    print(f"Generated {len(docs)} letters, {len(copied)} copied forward")
+
+    index = MinHashLSH(threshold=args.threshold, num_perm=args.num_perm)
+    print(f"LSH bands x rows: {index.bands} x {index.rows}")
+
+    start = time.perf_counter()
+    sig = index.signatures([text for _, text, _ in docs[: args.batch_size]])
+    sign_s = time.perf_counter() - start
+    print(f"Signing: {len(sig) / sign_s:,.0f} docs/s")
+
+    start = time.perf_counter()
+    flagged = set()
+    stream = ((doc_id, text) for doc_id, text, _ in docs)
+    for doc_id, _, duplicate_of in index.deduplicate(stream, args.batch_size):
+        if duplicate_of is not None:
+            flagged.add(doc_id)
+    dedup_s = time.perf_counter() - start
+    print(
+        f"Deduplicate (sign + query + insert): {len(docs) / dedup_s:,.0f} docs/s "
+        f"({dedup_s:.1f}s), {len(index)} unique documents indexed"
+    )
+
+    start = time.perf_counter()
+    sample = [text for _, text, _ in docs[: args.batch_size]]
+    index.query(texts=sample)
+    query_s = time.perf_counter() - start
+    print(f"Query against full index: {len(sample) / query_s:,.0f} docs/s")
+
+    path = tempfile.mkdtemp(prefix="bioext_dedup_")
+    try:
+        start = time.perf_counter()
+        index.save(path)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        MinHashLSH(threshold=args.threshold, num_perm=args.num_perm, path=path)
+        print(f"Save: {save_s:.1f}s, load: {time.perf_counter() - start:.1f}s")
+    finally:
+        shutil.rmtree(path)
+
+    true_positives = len(flagged & copied)
+    print(f"Precision: {true_positives / max(len(flagged), 1):.4f}")
+    print(f"Recall: {true_positives / max(len(copied), 1):.4f}")
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak RSS: {peak_mb:,.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 import argparse
 import json
+import os
 
 from dotenv import load_dotenv
-from tqdm import tqdm
 
-from bioext.doccano_utils import DoccanoSession, load_from_file, stream_labelled_docs
-from bioext.elastic_utils import ElasticsearchSession
+# bioext modules, mlflow and the Elasticsearch/Doccano clients are imported inside
+# the subcommands that use them, so `--help` and single-client jobs start quickly
 
 
 def parse_CLI_args():  # -> argparse.Namespace:
@@ -60,6 +60,13 @@ def parse_CLI_args():  # -> argparse.Namespace:
         default=1000,
         help="Number of samples to load",
     )
+    parser_ESDoc.add_argument(
+        "-s",
+        "--strategy",
+        choices=["random", "uncertainty", "stratified"],
+        default=None,
+        help="How to choose documents; defaults to the Sampling config, else random",
+    )
     parser_ESDoc.set_defaults(subcommand="ES2Doc")
 
     # Parsing command line args for Doc_load subcommand
@@ -76,12 +83,119 @@ def parse_CLI_args():  # -> argparse.Namespace:
     parser_Ds = subparsers.add_parser("Doc_stream", help="help")
     parser_Ds.set_defaults(subcommand="Doc_stream")
 
+    # Parsing command line args for Filter subcommand
+    parser_F = subparsers.add_parser(
+        "Filter", help="Refine exported documents locally with keyword/regex rules"
+    )
+    parser_F.add_argument(
+        "input_dir",
+        help="Folder of documents exported by ES_query",
+    )
+    parser_F.add_argument(
+        "-o",
+        "--output",
+        default="data/filter_matches.jsonl",
+        help="JSON lines file to write selected documents and match spans into",
+    )
+    parser_F.add_argument(
+        "-j",
+        "--n_jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (defaults to number of CPUs)",
+    )
+    parser_F.set_defaults(subcommand="Filter")
+
+    # Parsing command line args for Triage_train subcommand
+    parser_Tt = subparsers.add_parser(
+        "Triage_train", help="Train streaming triage classifier on Doccano labels"
+    )
+    parser_Tt.set_defaults(subcommand="Triage_train")
+
+    # Parsing command line args for Triage_score subcommand
+    parser_Ts = subparsers.add_parser(
+        "Triage_score", help="Score ES documents and write predictions back to ES"
+    )
+    parser_Ts.add_argument(
+        "model_uri",
+        help="MLflow URI of a trained triage model, e.g. runs:/<run_id>/triage_model",
+    )
+    parser_Ts.set_defaults(subcommand="Triage_score")
+
+    # Parsing command line args for Embed subcommand
+    parser_E = subparsers.add_parser(
+        "Embed", help="Embed exported documents into the local semantic index"
+    )
+    parser_E.add_argument(
+        "input_dir",
+        help="Folder of documents exported by ES_query",
+    )
+    parser_E.set_defaults(subcommand="Embed")
+
+    # Parsing command line args for Search subcommand
+    parser_S = subparsers.add_parser(
+        "Search", help="Find documents similar to a query or an example letter"
+    )
+    parser_S.add_argument(
+        "query",
+        help="Natural-language query, or path to a text file with an example letter",
+    )
+    parser_S.add_argument(
+        "-k",
+        "--top_k",
+        type=int,
+        default=10,
+        help="Number of documents to return",
+    )
+    parser_S.set_defaults(subcommand="Search")
+
+    # Parsing command line args for Queue_init subcommand
+    parser_Qi = subparsers.add_parser(
+        "Queue_init", help="Split a bulk job into work units in the shared queue"
+    )
+    parser_Qi.add_argument("job", help="Name of the job, e.g. export_2024_11")
+    parser_Qi.add_argument(
+        "kind",
+        choices=["es_export", "triage_score"],
+        help="What each unit does with its Elasticsearch slice",
+    )
+    parser_Qi.add_argument(
+        "-o",
+        "--output_dir",
+        default="data/breast_brca_status",
+        help="Folder to export documents into (es_export)",
+    )
+    parser_Qi.add_argument(
+        "-m",
+        "--model_uri",
+        default=None,
+        help="MLflow URI of the triage model (triage_score)",
+    )
+    parser_Qi.set_defaults(subcommand="Queue_init")
+
+    # Parsing command line args for Queue_work subcommand
+    parser_Qw = subparsers.add_parser(
+        "Queue_work", help="Process units of a queued job until none are left"
+    )
+    parser_Qw.add_argument("job", help="Name of the job")
+    parser_Qw.set_defaults(subcommand="Queue_work")
+
+    # Parsing command line args for Queue_status subcommand
+    parser_Qs = subparsers.add_parser(
+        "Queue_status", help="Show progress of a queued job"
+    )
+    parser_Qs.add_argument("job", help="Name of the job")
+    parser_Qs.set_defaults(subcommand="Queue_status")
+
     args = parser.parse_args()
     return args
 
 
 def load_es_from_file(es_session, es_load_cfg, data_file_path):
     """Load synthetic documents into Elasticsearch"""
+    from tqdm import tqdm
+
+    from bioext import codec_utils
 
     print("Creating index...")
     es_session.create_index(
@@ -92,8 +206,7 @@ def load_es_from_file(es_session, es_load_cfg, data_file_path):
 
     # load and parse json
     try:
-        with open(data_file_path, "r") as file:
-            documents = json.load(file)
+        documents = codec_utils.load(data_file_path)
     except Exception as e:
         print(f"Failed to load samples: {e}")
         return
@@ -112,13 +225,18 @@ def load_es_from_file(es_session, es_load_cfg, data_file_path):
     return successes
 
 
-def es2doc(config, sample_size=100):
+def es2doc(config, sample_size=100, strategy=None):
     """
     1. Create a new Doccano project
     2. Query ElasticSearch for matching documents
-    3. Load random sample into Doccano
-    4. outputs project variables as a dict after generating timestamp
+    3. Choose a random sample, or the documents the triage model is least sure
+       about (strategy "uncertainty" or "stratified", see the Sampling config)
+    4. Drop near-duplicates of documents already sent for annotation (if configured)
+    5. Load the sample into Doccano
     """
+    from bioext.dedup_utils import MinHashLSH
+    from bioext.doccano_utils import DoccanoSession
+    from bioext.elastic_utils import ElasticsearchSession
 
     # connect to Elastic and Doccano
     es_session = ElasticsearchSession()
@@ -131,35 +249,75 @@ def es2doc(config, sample_size=100):
     es_query_config = config["ElasticSearch"]["retrieve"]["breast_brca_query"]
     doc_load_cfg = config["Doccano"]["load"]
 
-    # get random document IDs from Elastic using query
-    print(f"Getting {sample_size} random document IDs using query...")
-    random_ids = es_session.get_random_doc_ids(
-        index_name=es_query_config["index_name"],
-        size=int(sample_size),
-        query=es_query_config["query"],
-    )
+    sampling_cfg = config.get("Sampling", {})
+    strategy = strategy or sampling_cfg.get("strategy", "random")
+    content_field = es_query_config["content_field"]
+
+    if strategy == "random":
+        # get random document IDs from Elastic using query
+        print(f"Getting {sample_size} random document IDs using query...")
+        random_ids = es_session.get_random_doc_ids(
+            index_name=es_query_config["index_name"],
+            size=int(sample_size),
+            query=es_query_config["query"],
+        )
+        uncertainty = {}
+        sampler = None
+    else:
+        from bioext.sampling_utils import UncertaintySampler, select_for_annotation
+
+        # scores are cached per model version, so only new documents are scored
+        sampler = UncertaintySampler.from_mlflow(
+            sampling_cfg["model_uri"],
+            sampling_cfg["cache_path"],
+            batch_size=sampling_cfg.get("batch_size", 1000),
+            measure=sampling_cfg.get("measure", "margin"),
+        )
+        print(f"Selecting {sample_size} documents by {strategy} sampling...")
+        selected = select_for_annotation(
+            es_session,
+            es_query_config["index_name"],
+            es_query_config["query"],
+            content_field,
+            int(sample_size),
+            sampler,
+            strategy=strategy,
+            explore_fraction=sampling_cfg.get("explore_fraction", 0.1),
+        )
+        random_ids = [doc_id for doc_id, _ in selected]
+        uncertainty = dict(selected)
+
+    # uploads and dropped near-duplicates are recorded so later uncertainty rounds
+    # leave them out of the candidate pool
+    if sampler is not None:
+        selection_cache, model_version = sampler.cache, sampler.model_version
+    elif sampling_cfg.get("cache_path"):
+        from bioext.sampling_utils import ScoreCache
+
+        selection_cache, model_version = ScoreCache(sampling_cfg["cache_path"]), None
+    else:
+        selection_cache = None
 
     # Load documents into Doccano
     # Create project and create labels
     project = doc_session.create_or_update_project(**doc_load_cfg)
     print(f"Using project: {project.name}, with ID {project.id}")
 
-    # Loading documents
-    print(f"Loading {len(random_ids)} documents into Doccano...")
+    # Retrieving documents
+    print(f"Retrieving {len(random_ids)} documents...")
     successful_loads = 0
     failed_loads = 0
+    duplicates = 0
+    dropped = []
 
-    content_field = es_query_config["content_field"]
-
+    documents = []
     for doc_id in random_ids:
         try:
             doc = es_session.get_document_by_id(
                 index_name=es_query_config["index_name"], doc_id=doc_id
             )
             if doc and content_field in doc["_source"]:
-                text = doc["_source"][content_field]
-                doc_session.load_document(text, metadata={"source_id": doc_id})
-                successful_loads += 1
+                documents.append((doc_id, doc["_source"][content_field]))
             else:
                 failed_loads += 1
                 print(f"Document {doc_id} failed to load...")
@@ -167,8 +325,237 @@ def es2doc(config, sample_size=100):
             failed_loads += 1
             print(f"Document {doc_id} failed to be retrieved: {e}")
 
+    # the index persists across runs, so copied-forward letters are not sent to
+    # annotators again in later batches
+    dedup_cfg = config.get("Dedup")
+    if dedup_cfg:
+        dedup_index = MinHashLSH(
+            threshold=dedup_cfg.get("threshold", 0.8),
+            num_perm=dedup_cfg.get("num_perm", 128),
+            path=dedup_cfg["index_path"],
+        )
+        unique = []
+        # documents are only added to the index once they are in Doccano
+        for doc_id, text, duplicate_of in dedup_index.deduplicate(
+            documents, insert=False
+        ):
+            if duplicate_of is None:
+                unique.append((doc_id, text))
+            else:
+                duplicates += 1
+                dropped.append((doc_id, uncertainty.get(doc_id)))
+                print(f"Document {doc_id} is a near-duplicate of {duplicate_of}")
+        documents = unique
+
+    # Loading documents
+    print(f"Loading {len(documents)} documents into Doccano...")
+    loaded, loaded_texts = [], []
+    for doc_id, text in documents:
+        metadata = {"source_id": doc_id, "sampling": strategy}
+        if doc_id in uncertainty:
+            metadata["uncertainty"] = round(uncertainty[doc_id], 4)
+        try:
+            doc_session.load_document(text, metadata=metadata)
+            successful_loads += 1
+            loaded.append((doc_id, uncertainty.get(doc_id)))
+            loaded_texts.append(text)
+        except Exception as e:
+            failed_loads += 1
+            print(f"Document {doc_id} failed to load: {e}")
+
+    if dedup_cfg and loaded:
+        dedup_index.insert([doc_id for doc_id, _ in loaded], texts=loaded_texts)
+        dedup_index.save()
+    if selection_cache is not None:
+        selection_cache.mark_selected(loaded, strategy, model_version)
+        selection_cache.mark_selected(dropped, "duplicate", model_version)
+    if sampler is not None:
+        print(
+            f"Scores: {sampler.stats['cached']} from cache, "
+            f"{sampler.stats['scored']} newly computed"
+        )
+
     print(f"Success: {successful_loads}")
     print(f"Failed: {failed_loads}")
+    print(f"Near-duplicates skipped: {duplicates}")
+
+
+def triage_train(config):
+    """
+    Train a hashed-feature linear classifier on labelled Doccano examples, streamed
+    in chunks, and log it to MLflow
+    """
+    import mlflow
+
+    from bioext.doccano_utils import DoccanoSession
+    from bioext.linear_utils import StreamingTextClassifier, stream_labelled_chunks
+
+    triage_cfg = config["Triage"]
+    doc_session = DoccanoSession()
+    print(f"Connected to Doccano as user: {doc_session.username}")
+
+    chunks = stream_labelled_chunks(
+        doc_session,
+        project_id=config["Doccano"]["retrieve"]["PROJECT_ID"],
+        chunk_size=triage_cfg["chunk_size"],
+    )
+    classifier = StreamingTextClassifier(
+        classes=config["Doccano"]["load"]["labels"],
+        model=triage_cfg["model"],
+        n_features=triage_cfg["n_features"],
+    )
+
+    mlflow.set_experiment(triage_cfg["experiment_name"])
+    with mlflow.start_run() as run:
+        summary = classifier.fit_stream(chunks)
+        classifier.log_to_mlflow(summary)
+    classifier.close()
+
+    print(f"Trained on {summary['n_train_documents']} documents")
+    print(f"MLflow run ID: {run.info.run_id}")
+
+
+def triage_score(config, model_uri, slice_id=None, n_slices=None):
+    """
+    Score all documents matching the query (or one slice of them) and write
+    predictions back to ES
+    """
+    from bioext.elastic_utils import ElasticsearchSession
+    from bioext.linear_utils import (
+        StreamingTextClassifier,
+        stream_es_chunks,
+        write_predictions,
+    )
+
+    triage_cfg = config["Triage"]
+    es_query_cfg = config["ElasticSearch"]["retrieve"]["breast_brca_query"]
+    es_session = ElasticsearchSession()
+
+    classifier = StreamingTextClassifier.from_mlflow(model_uri)
+    chunks = stream_es_chunks(
+        es_session,
+        index_name=es_query_cfg["index_name"],
+        query=es_query_cfg["query"],
+        content_field=es_query_cfg["content_field"],
+        chunk_size=triage_cfg["chunk_size"],
+        slice_id=slice_id,
+        n_slices=n_slices,
+    )
+    updated = write_predictions(
+        es_session,
+        es_query_cfg["index_name"],
+        classifier.score_stream(chunks),
+        model_version=model_uri,
+    )
+    classifier.close()
+    print(f"Wrote predictions to {updated} documents")
+    return updated
+
+
+def export_slice(config, output_dir, slice_id=None, n_slices=None):
+    """Export documents matching the query (or one slice of them) to files"""
+    from bioext.elastic_utils import ElasticsearchSession
+
+    es_query_cfg = config["ElasticSearch"]["retrieve"]["breast_brca_query"]
+    es_session = ElasticsearchSession()
+    es_session.bulk_retrieve_documents(
+        es_query_cfg["index_name"],
+        es_query_cfg["query"],
+        save_to_file=output_dir,
+        slice_id=slice_id,
+        n_slices=n_slices,
+    )
+
+
+def load_queue(config):
+    from bioext.queue_utils import WorkQueue
+
+    queue_cfg = config["Queue"]
+    return WorkQueue(
+        queue_cfg["path"],
+        lease_seconds=queue_cfg.get("lease_seconds", 600),
+        max_attempts=queue_cfg.get("max_attempts", 3),
+    )
+
+
+def queue_init(config, job, kind, output_dir=None, model_uri=None):
+    """
+    Partition a job into sliced-scroll work units. Workers on any node sharing
+    the queue file can then process it with Queue_work.
+    """
+    from bioext.queue_utils import slice_units
+
+    if kind == "es_export":
+        payload = {"output_dir": output_dir}
+    elif kind == "triage_score":
+        payload = {"model_uri": model_uri}
+    else:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    queue = load_queue(config)
+    units = slice_units(config["Queue"]["n_slices"], kind=kind, **payload)
+    added = queue.add_units(job, units)
+    print(f"Added {added} units to job {job}: {queue.status(job)}")
+
+
+def queue_work(config, job):
+    """Claim and process units of a job until none are left"""
+    from bioext.queue_utils import run_worker
+
+    def process(payload):
+        if payload["kind"] == "es_export":
+            export_slice(
+                config, payload["output_dir"], payload["slice_id"], payload["n_slices"]
+            )
+            return None
+        updated = triage_score(
+            config, payload["model_uri"], payload["slice_id"], payload["n_slices"]
+        )
+        return {"updated": updated}
+
+    run_worker(load_queue(config), job, process)
+
+
+def load_embedding(config):
+    """Load the sentence encoder and its embedding index from config"""
+    from bioext.embedding_utils import EmbeddingIndex, SentenceEncoder
+
+    embedding_cfg = config["Embedding"]
+    encoder = SentenceEncoder(
+        model_name=embedding_cfg["model_name"],
+        max_length=embedding_cfg.get("max_length", 256),
+        batch_size=embedding_cfg.get("batch_size", 32),
+    )
+    index = EmbeddingIndex(
+        embedding_cfg["index_path"], dim=encoder.dim, model_name=encoder.model_name
+    )
+    return encoder, index
+
+
+def embed(config, input_dir):
+    """Embed exported documents that are not yet in the semantic index"""
+    from bioext.embedding_utils import embed_documents
+    from bioext.filter_utils import iter_exported_docs
+
+    es_query_cfg = config["ElasticSearch"]["retrieve"]["breast_brca_query"]
+    encoder, index = load_embedding(config)
+    print(f"Index holds {len(index)} documents")
+    n_new = embed_documents(
+        iter_exported_docs(input_dir, es_query_cfg["content_field"]), encoder, index
+    )
+    print(f"Embedded {n_new} new documents, index holds {len(index)}")
+
+
+def search(config, query, top_k=10):
+    """Print the documents most similar to a query or example letter"""
+    from bioext.embedding_utils import search_texts
+
+    if os.path.isfile(query):
+        with open(query) as f:
+            query = f.read()
+    encoder, index = load_embedding(config)
+    for doc_id, score in search_texts(encoder, index, [query], k=top_k)[0]:
+        print(f"{score:.3f}  {doc_id}")
 
 
 if __name__ == "__main__":
@@ -187,6 +574,8 @@ if __name__ == "__main__":
     if args.subcommand.startswith("ES"):
         # Initialise a connection to ES server with env credentials
         # connect and log on to ElasticSearch
+        from bioext.elastic_utils import ElasticsearchSession
+
         print("Connecting to ElasticSearch")
         es_session = ElasticsearchSession()
 
@@ -206,9 +595,15 @@ if __name__ == "__main__":
             )
 
         elif args.subcommand == "ES2Doc":
-            es2doc(app_config, args.sample_size)
+            es2doc(app_config, args.sample_size, args.strategy)
 
     elif args.subcommand.startswith("Doc"):
+        from bioext.doccano_utils import (
+            DoccanoSession,
+            load_from_file,
+            stream_labelled_docs,
+        )
+
         # Initialise connection to Doccano
         doc_session = DoccanoSession()
 
@@ -221,3 +616,42 @@ if __name__ == "__main__":
             stream_labelled_docs(doc_session, doc_stream_cfg)
 
             print("Labelled data streaming complete")
+
+    elif args.subcommand == "Filter":
+        from bioext.filter_utils import iter_exported_docs, run_filter
+
+        es_query_cfg = app_config["ElasticSearch"]["retrieve"]["breast_brca_query"]
+        summary = run_filter(
+            iter_exported_docs(args.input_dir, es_query_cfg["content_field"]),
+            app_config["Filter"],
+            output_file=args.output,
+            n_jobs=args.n_jobs,
+        )
+        print(f"Selected {summary['selected']}/{summary['documents']} documents")
+        for rule, count in summary["match_counts"].items():
+            print(
+                f"  {rule}: {count} matches in {summary['document_counts'][rule]} docs"
+            )
+
+    elif args.subcommand.startswith("Triage"):
+        if args.subcommand == "Triage_train":
+            triage_train(app_config)
+
+        elif args.subcommand == "Triage_score":
+            triage_score(app_config, args.model_uri)
+
+    elif args.subcommand == "Embed":
+        embed(app_config, args.input_dir)
+
+    elif args.subcommand == "Search":
+        search(app_config, args.query, args.top_k)
+
+    elif args.subcommand.startswith("Queue"):
+        if args.subcommand == "Queue_init":
+            queue_init(app_config, args.job, args.kind, args.output_dir, args.model_uri)
+
+        elif args.subcommand == "Queue_work":
+            queue_work(app_config, args.job)
+
+        elif args.subcommand == "Queue_status":
+            print(load_queue(app_config).status(args.job))
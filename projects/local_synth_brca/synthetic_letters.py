@@ -0,0 +1,61 @@
+"""
+Synthetic clinic letters shared by the benchmarks. Standard library only, so
+benchmarks importing it do not pull in numpy or other heavy dependencies.
+"""
+
+GENES = ["BRCA1", "BRCA2", "PALB2", "CHEK2", "ATM", "TP53", "RAD51C", "RAD51D"]
+RESULTS = [
+    "a pathogenic variant",
+    "a likely pathogenic variant",
+    "a variant of uncertain significance",
+    "no pathogenic variant",
+]
+SENTENCES = [
+    "I reviewed her in the {clinic} clinic on {date} with her {relative}.",
+    "Testing of {gene} identified {result} ({variant}).",
+    "Her {relative} was diagnosed with {cancer} cancer aged {age}.",
+    "She reports {symptom} over the last {n} weeks.",
+    "Her Manchester score is {n} and her lifetime risk is estimated at {pct}%.",
+    "We discussed {plan} and she would like time to consider this.",
+    "Plan: {plan}.",
+    "She is currently taking {drug} {n}mg daily.",
+    "Examination of both breasts and axillae was {exam}.",
+    "Imaging on {date} showed {imaging}.",
+    "She has {n} children and {n} siblings, all well.",
+    "Please arrange {plan} and let us know the outcome.",
+]
+WORDS = {
+    "clinic": ["genetics", "family history", "breast", "oncology", "surgical"],
+    "relative": ["mother", "sister", "daughter", "aunt", "grandmother", "partner"],
+    "gene": GENES,
+    "result": RESULTS,
+    "cancer": ["breast", "ovarian", "pancreatic", "prostate", "bowel"],
+    "symptom": ["mastalgia", "a palpable lump", "nipple discharge", "fatigue"],
+    "plan": [
+        "annual MRI breast surveillance",
+        "risk-reducing mastectomy",
+        "risk-reducing salpingo-oophorectomy",
+        "cascade testing for first-degree relatives",
+        "repeat mammography in 12 months",
+        "referral to the family history clinic",
+    ],
+    "drug": ["tamoxifen", "anastrozole", "letrozole", "metformin"],
+    "exam": ["unremarkable", "notable for a 2cm mobile lump", "limited by pain"],
+    "imaging": ["no suspicious features", "a 14mm spiculated mass", "benign cysts"],
+}
+
+
+def synthetic_letter(rng):
+    def fill(template):
+        values = {key: rng.choice(options) for key, options in WORDS.items()}
+        values.update(
+            date=f"{rng.randint(1, 28)}/{rng.randint(1, 12)}/{rng.randint(2015, 2024)}",
+            variant=f"c.{rng.randint(100, 9999)}{rng.choice('ACGT')}>T",
+            age=rng.randint(25, 80),
+            n=rng.randint(1, 9),
+            pct=rng.randint(10, 80),
+        )
+        return template.format(**values)
+
+    body = " ".join(fill(t) for t in rng.sample(SENTENCES, rng.randint(6, 11)))
+    return f"Dear Dr {rng.choice(['Smith', 'Jones', 'Patel', 'Okafor'])}, {body}"
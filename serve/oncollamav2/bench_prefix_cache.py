@@ -0,0 +1,160 @@
+"""
+Benchmark time to first token (TTFT) and throughput for extraction requests that
+share a byte-identical system prompt prefix, against requests whose prompts differ
+slightly (as happens when each script pastes its own copy of the prompt).
+
+By default a local OpenAI-compatible stand-in server is started that models vLLM
+automatic prefix caching: prompts are hashed in 16-token blocks, and only blocks not
+already cached are charged prefill time. Pass --url to benchmark a real endpoint
+(e.g. the oncollamav2 vLLM container, started with --enable-prefix-caching).
+
+    python bench_prefix_cache.py -n 64 -c 8
+    python bench_prefix_cache.py --url http://localhost:9991/v1/chat/completions
+"""
+
+import argparse
+import hashlib
+import json
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bioext.prompt_utils import PromptRegistry
+
+BLOCK_CHARS = 64  # ~16 tokens per KV cache block
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Minimal /v1/chat/completions server with simulated prefix caching
+    """
+
+    prefill_s_per_block = 0.0005
+    decode_s_per_token = 0.002
+    output_tokens = 32
+    cache = set()
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "".join(m["content"] for m in body["messages"])
+
+        # chained block hashes, as in vLLM automatic prefix caching
+        uncached, parent = 0, b""
+        for i in range(0, len(prompt), BLOCK_CHARS):
+            parent = hashlib.sha1(parent + prompt[i : i + BLOCK_CHARS].encode()).digest()
+            with self.lock:
+                if parent not in self.cache:
+                    self.cache.add(parent)
+                    uncached += 1
+        time.sleep(uncached * self.prefill_s_per_block)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for _ in range(body.get("max_tokens") or self.output_tokens):
+            chunk = {"choices": [{"delta": {"content": "x"}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.decode_s_per_token)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+
+def timed_request(url, body):
+    """
+    Stream a single request, returning (time to first token, total time)
+    """
+    start = time.perf_counter()
+    ttft = None
+    with requests.post(
+        url,
+        data=body,
+        headers={"Content-Type": "application/json"},
+        stream=True,
+    ) as response:
+        for line in response.iter_lines():
+            if line.startswith(b"data:") and ttft is None:
+                ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+
+def run_scenario(url, bodies, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda b: timed_request(url, b), bodies))
+    wall = time.perf_counter() - start
+
+    ttfts = sorted(t for t, _ in timings)
+    return {
+        "ttft_p50_ms": 1000 * statistics.median(ttfts),
+        "ttft_p99_ms": 1000 * ttfts[min(len(ttfts) - 1, int(0.99 * len(ttfts)))],
+        "requests_per_s": len(bodies) / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="OpenAI-compatible endpoint")
+    parser.add_argument("-n", "--n_requests", type=int, default=64)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--max_tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_stand_in()
+        print(f"Started stand-in server at {url}")
+
+    prompt = PromptRegistry().get("oncology_extraction")
+    letters = [f"Clinic letter {i}: {uuid.uuid4()}" for i in range(args.n_requests)]
+    params = {"temperature": 0.0, "max_tokens": args.max_tokens, "stream": True}
+
+    # shared prefix: every request starts with the registry prompt
+    shared = [prompt.encode_payload(letter, **params) for letter in letters]
+
+    # divergent prefix: a per-script header line breaks the prefix at the first block
+    divergent = []
+    for i, letter in enumerate(letters):
+        payload = prompt.build_payload(letter, **params)
+        payload["messages"][0]["content"] = (
+            f"# script revision {i}\n" + payload["messages"][0]["content"]
+        )
+        divergent.append(json.dumps(payload).encode("utf-8"))
+
+    # warm up the shared prefix once, as in a long-running server
+    timed_request(url, shared[0])
+
+    results = {
+        "divergent_prefix": run_scenario(url, divergent, args.concurrency),
+        "shared_prefix": run_scenario(url, shared, args.concurrency),
+    }
+
+    print(f"Prompt: {prompt.name} v{prompt.version} ({prompt.short_hash})")
+    print(f"{'scenario':<20}{'TTFT p50 ms':>14}{'TTFT p99 ms':>14}{'req/s':>10}")
+    for name, r in results.items():
+        print(
+            f"{name:<20}{r['ttft_p50_ms']:>14.1f}{r['ttft_p99_ms']:>14.1f}"
+            f"{r['requests_per_s']:>10.2f}"
+        )
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
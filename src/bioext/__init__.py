@@ -0,0 +1,71 @@
+"""
+Helper functions for bio-ext pipelines.
+
+Submodules are imported on first attribute access, so `import bioext` does not
+pull in Elasticsearch, Doccano, MLflow or model libraries. `bioext.ElasticsearchSession`
+imports only the Elasticsearch client stack, `bioext.DoccanoSession` only the Doccano
+one, and so on.
+"""
+
+import importlib
+
+_SUBMODULES = {
+    "codec_utils",
+    "dedup_utils",
+    "doccano_utils",
+    "elastic_utils",
+    "embedding_utils",
+    "export_utils",
+    "extraction_utils",
+    "filter_utils",
+    "linear_utils",
+    "parallel_utils",
+    "pipeline_utils",
+    "preprocess_utils",
+    "prompt_utils",
+    "queue_utils",
+    "sampling_utils",
+    "serving_utils",
+    "sink_utils",
+    "tracking_utils",
+    "training_utils",
+    "tuning_utils",
+}
+
+# commonly used names, re-exported lazily from their submodules
+_EXPORTS = {
+    "AsyncTracker": "tracking_utils",
+    "DoccanoSession": "doccano_utils",
+    "ElasticsearchSession": "elastic_utils",
+    "EmbeddingIndex": "embedding_utils",
+    "ExtractionSink": "sink_utils",
+    "HyperparameterSearch": "tuning_utils",
+    "MinHashLSH": "dedup_utils",
+    "MultiPatternMatcher": "filter_utils",
+    "Pipeline": "pipeline_utils",
+    "PromptRegistry": "prompt_utils",
+    "RequestPlanner": "extraction_utils",
+    "StreamingTextClassifier": "linear_utils",
+    "TextPreprocessor": "preprocess_utils",
+    "UncertaintySampler": "sampling_utils",
+    "WorkQueue": "queue_utils",
+}
+
+__all__ = sorted(_SUBMODULES | set(_EXPORTS))
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        value = importlib.import_module(f"{__name__}.{name}")
+    elif name in _EXPORTS:
+        module = importlib.import_module(f"{__name__}.{_EXPORTS[name]}")
+        value = getattr(module, name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # cache so later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,194 @@
+import json
+import os
+from typing import Iterable, Optional
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+
+class JsonCodec:
+    def __init__(self, backend: Optional[str] = None) -> None:
+        """
+        JSON encoder/decoder using the fastest installed library: orjson, then
+        msgspec, falling back to the standard library. Set BIOEXT_JSON_BACKEND
+        to force one.
+
+        All backends encode to compact UTF-8 bytes with non-ASCII characters
+        kept as is, and decode each other's output to equal values. The bytes
+        are not always identical: float formatting differs (orjson writes
+        0.00001 and 1e20 where the standard library writes 1e-05 and 1e+20),
+        orjson writes NaN/Infinity as null, and orjson also serialises
+        datetimes and numpy values, which the other backends reject.
+
+        Args:
+            backend: "orjson", "msgspec" or "json"; defaults to the first one
+                installed.
+        """
+        backend = backend or os.getenv("BIOEXT_JSON_BACKEND")
+        candidates = [backend] if backend else BACKENDS
+        for name in candidates:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown JSON backend: {name}")
+            try:
+                getattr(self, f"_setup_{name}")()
+            except ImportError:
+                if backend:
+                    raise
+                continue
+            self.backend = name
+            break
+
+    def _setup_orjson(self):
+        import orjson
+
+        def dumps(obj, indent=False, sort_keys=False):
+            option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            if sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, option=option)
+
+        self._dumps = dumps
+        self._loads = orjson.loads
+
+    def _setup_msgspec(self):
+        import msgspec
+
+        encoder = msgspec.json.Encoder()
+        sorted_encoder = msgspec.json.Encoder(order="sorted")
+        decoder = msgspec.json.Decoder()
+
+        def dumps(obj, indent=False, sort_keys=False):
+            data = (sorted_encoder if sort_keys else encoder).encode(obj)
+            return msgspec.json.format(data, indent=2) if indent else data
+
+        def loads(data):
+            try:
+                return decoder.decode(data)
+            except msgspec.DecodeError as e:
+                # callers only need to catch ValueError, as with the other backends
+                raise ValueError(str(e)) from e
+
+        self._dumps = dumps
+        self._loads = loads
+
+    def _setup_json(self):
+        def dumps(obj, indent=False, sort_keys=False):
+            return json.dumps(
+                obj,
+                ensure_ascii=False,
+                indent=2 if indent else None,
+                separators=None if indent else (",", ":"),
+                sort_keys=sort_keys,
+            ).encode("utf-8")
+
+        self._dumps = dumps
+        self._loads = json.loads
+
+    def dumps(self, obj, indent: bool = False, sort_keys: bool = False) -> bytes:
+        return self._dumps(obj, indent=indent, sort_keys=sort_keys)
+
+    def loads(self, data):
+        """
+        Decode JSON from bytes or str. Raises ValueError on invalid JSON.
+        """
+        return self._loads(data)
+
+    def dump(self, obj, path: str, indent: bool = False):
+        with open(path, "wb") as f:
+            f.write(self._dumps(obj, indent=indent))
+
+    def load(self, path: str):
+        with open(path, "rb") as f:
+            return self._loads(f.read())
+
+    def write_jsonl(self, records: Iterable, path: str) -> int:
+        n_records = 0
+        with open(path, "wb") as f:
+            for record in records:
+                f.write(self._dumps(record) + b"\n")
+                n_records += 1
+        return n_records
+
+    def iter_jsonl(self, path: str):
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield self._loads(line)
+
+
+# shared codec, used through the module-level functions below
+codec = JsonCodec()
+
+
+def dumps(obj, indent: bool = False, sort_keys: bool = False) -> bytes:
+    return codec.dumps(obj, indent=indent, sort_keys=sort_keys)
+
+
+def loads(data):
+    return codec.loads(data)
+
+
+def dump(obj, path: str, indent: bool = False):
+    codec.dump(obj, path, indent=indent)
+
+
+def load(path: str):
+    return codec.load(path)
+
+
+class Hit:
+    __slots__ = ("id", "source", "index", "score")
+
+    def __init__(
+        self,
+        id: str,
+        source: Optional[dict] = None,
+        index: Optional[str] = None,
+        score: Optional[float] = None,
+    ) -> None:
+        """
+        Compact record of an Elasticsearch hit: document ID, source fields and
+        metadata (index, score). Uses __slots__, so a large batch of hits costs
+        far less memory than the raw response dicts, especially when only the
+        needed source fields are kept.
+
+        Supports hit["_id"], hit["_source"], hit["_index"] and hit["_score"], so
+        it can stand in for a raw hit in existing code.
+        """
+        self.id = id
+        self.source = source if source is not None else {}
+        self.index = index
+        self.score = score
+
+    @classmethod
+    def from_es(cls, hit: dict, fields: Optional[Iterable[str]] = None):
+        """
+        Build from a raw hit, keeping only `fields` of its source if given
+        """
+        source = hit.get("_source")
+        if source is not None and fields is not None:
+            source = {k: source[k] for k in fields if k in source}
+        return cls(hit["_id"], source, hit.get("_index"), hit.get("_score"))
+
+    def to_es(self) -> dict:
+        return {
+            "_index": self.index,
+            "_id": self.id,
+            "_score": self.score,
+            "_source": self.source,
+        }
+
+    _KEYS = {"_id": "id", "_source": "source", "_index": "index", "_score": "score"}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._KEYS[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, self._KEYS[key]) if key in self._KEYS else default
+
+    def __repr__(self):
+        return f"Hit(id={self.id!r}, index={self.index!r}, fields={list(self.source)})"
@@ -0,0 +1,371 @@
+import json
+import os
+import re
+from typing import Iterable, Optional
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _optimal_bands(num_perm, threshold, false_negative_weight=0.5):
+    """
+    Choose bands and rows (bands x rows <= num_perm) minimising the weighted
+    probability mass of false positives below the threshold and false negatives
+    above it, integrated over the LSH S-curve 1 - (1 - s^rows)^bands
+    """
+    s = np.linspace(0, 1, 1001)
+    below = s < threshold
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            candidate = 1 - (1 - s**rows) ** bands
+            # mean over an even grid is proportional to the integral
+            false_positive = np.where(below, candidate, 0).mean()
+            false_negative = np.where(below, 0, 1 - candidate).mean()
+            error = (
+                1 - false_negative_weight
+            ) * false_positive + false_negative_weight * false_negative
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def _expand_ranges(lo, hi):
+    """
+    Concatenate arange(lo[i], hi[i]) for all i, with the index i of each element
+    """
+    counts = hi - lo
+    owner = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(lo, counts) + offsets
+
+
+class MinHashLSH:
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 42,
+        path: Optional[str] = None,
+    ) -> None:
+        """
+        Near-duplicate index over documents using MinHash signatures and LSH banding.
+
+        Documents are normalised (lowercase, collapsed whitespace), split into
+        character shingles, and signed in vectorized batches with numpy. Signatures
+        are banded into an LSH index; candidate pairs are verified by signature
+        agreement, an unbiased estimate of shingle Jaccard similarity.
+
+        If `path` holds a saved index it is loaded. `save` only appends the
+        signatures added since the last save, so the index can be updated
+        incrementally as new documents arrive.
+
+        Args:
+            threshold: Jaccard similarity at or above which documents are duplicates.
+            num_perm: Number of hash functions in each signature.
+            shingle_size: Bytes per shingle (1 to 8).
+            seed: Seed for the hash functions; fixed so saved indexes stay valid.
+            path: Folder to load from (if it exists) and save to.
+        """
+        if not 1 <= shingle_size <= 8:
+            raise ValueError("shingle_size must be between 1 and 8")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.path = path
+        self.bands, self.rows = _optimal_bands(num_perm, threshold)
+
+        rng = np.random.default_rng(seed)
+        # shingles are hashed to 32 bits, then permuted with (a * x + b) mod 2^32
+        self._a = rng.integers(0, 2**32, num_perm, dtype=np.uint64).astype(np.uint32)
+        self._a |= np.uint32(1)
+        self._b = rng.integers(0, 2**32, num_perm, dtype=np.uint64).astype(np.uint32)
+        self._band_mix = rng.integers(1, 2**63, self.rows, dtype=np.uint64)
+        self._band_mix |= np.uint64(1)
+
+        self.doc_ids = []
+        self._id_index = {}
+        # growable signature buffer; rows [:len(self)] are in use
+        self._sig = np.empty((0, num_perm), dtype=np.uint32)
+        self._parts = []
+        self._n_saved = 0
+        # LSM-style band index: a large sorted main segment plus a small delta
+        self._main = None
+        self._delta = None
+
+        if path and os.path.exists(os.path.join(path, "meta.json")):
+            self._load()
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._id_index
+
+    @property
+    def signature_matrix(self) -> np.ndarray:
+        return self._sig[: len(self)]
+
+    # ---- signing ----
+
+    def signatures(self, texts: list[str]) -> np.ndarray:
+        """
+        MinHash signatures for a batch of texts, as an (n, num_perm) uint32 array
+        """
+        if not texts:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+        k = self.shingle_size
+        encoded = [
+            _WHITESPACE.sub(" ", t.lower()).strip().encode("utf-8") for t in texts
+        ]
+        # pad short texts so every document has at least one shingle
+        encoded = [e.ljust(k) for e in encoded]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64)
+        buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        # pack each k-byte shingle into a uint64
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, k)
+        shingles = np.zeros(len(windows), dtype=np.uint64)
+        for j in range(k):
+            shingles |= windows[:, j].astype(np.uint64) << np.uint64(8 * j)
+
+        # keep only windows that lie entirely within one document
+        doc_ends = np.cumsum(lengths)
+        positions = np.arange(len(windows))
+        owner = np.searchsorted(doc_ends, positions, side="right")
+        shingles = shingles[positions + k <= doc_ends[owner]]
+        offsets = np.concatenate(([0], np.cumsum(lengths - k + 1)[:-1]))
+
+        # multiplicative hash down to 32 bits
+        mixed = ((shingles * _GOLDEN) >> np.uint64(32)).astype(np.uint32)
+        sig = np.empty((self.num_perm, len(texts)), dtype=np.uint32)
+        hashed = np.empty_like(mixed)
+        for i in range(self.num_perm):
+            # one contiguous pass per permutation is far faster than a 2D block
+            np.multiply(mixed, self._a[i], out=hashed)
+            hashed += self._b[i]
+            sig[i] = np.minimum.reduceat(hashed, offsets)
+        return np.ascontiguousarray(sig.T)
+
+    def _band_hashes(self, sig: np.ndarray) -> np.ndarray:
+        """
+        (n, bands) uint64 hash of the rows in each band
+        """
+        # bands x rows may be less than num_perm; the remaining columns are only
+        # used to verify candidates
+        banded = sig[:, : self.bands * self.rows].astype(np.uint64)
+        banded = banded.reshape(len(sig), self.bands, self.rows)
+        return (banded * self._band_mix).sum(axis=2, dtype=np.uint64)
+
+    # ---- index ----
+
+    def _build_segment(self, start, band_hashes):
+        order = np.argsort(band_hashes, axis=0, kind="stable")
+        return {
+            "start": start,
+            "raw": band_hashes,
+            "hashes": np.take_along_axis(band_hashes, order, axis=0),
+            "order": order + start,
+        }
+
+    def _append(self, sig):
+        n, needed = len(self), len(self) + len(sig)
+        if needed > len(self._sig):
+            capacity = max(needed, 2 * len(self._sig))
+            grown = np.empty((capacity, self.num_perm), dtype=np.uint32)
+            grown[:n] = self._sig[:n]
+            self._sig = grown
+        self._sig[n:needed] = sig
+
+    def insert(self, doc_ids: list, texts=None, signatures=None):
+        """
+        Add documents to the index, from texts or precomputed signatures
+        """
+        sig = signatures if signatures is not None else self.signatures(texts)
+        start = len(self)
+        self._append(sig)
+        for i, doc_id in enumerate(doc_ids):
+            self._id_index[doc_id] = start + i
+        self.doc_ids.extend(doc_ids)
+
+        band_hashes = self._band_hashes(sig)
+        if self._delta is not None:
+            band_hashes = np.concatenate([self._delta["raw"], band_hashes])
+            start = self._delta["start"]
+
+        main_size = 0 if self._main is None else len(self._main["raw"])
+        if len(band_hashes) > max(10_000, main_size // 10):
+            # merge delta into the main segment
+            self._main = self._build_segment(
+                0, self._band_hashes(self.signature_matrix)
+            )
+            self._delta = None
+        else:
+            self._delta = self._build_segment(start, band_hashes)
+
+    def _candidate_pairs(self, band_hashes):
+        """
+        (query row, index position) pairs that share at least one band
+        """
+        queries, positions = [], []
+        for seg in (self._main, self._delta):
+            if seg is None:
+                continue
+            for band in range(self.bands):
+                column = seg["hashes"][:, band]
+                lo = np.searchsorted(column, band_hashes[:, band], side="left")
+                hi = np.searchsorted(column, band_hashes[:, band], side="right")
+                owner, sorted_idx = _expand_ranges(lo, hi)
+                queries.append(owner)
+                positions.append(seg["order"][sorted_idx, band])
+
+        if not queries:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        # documents matching in several bands are verified once
+        n = len(self)
+        keys = np.unique(np.concatenate(queries) * n + np.concatenate(positions))
+        return keys // n, keys % n
+
+    def query(self, texts=None, signatures=None, block=256) -> list[list[tuple]]:
+        """
+        For each query, return [(doc_id, estimated Jaccard), ...] of indexed
+        documents at or above the threshold, most similar first
+        """
+        sig = signatures if signatures is not None else self.signatures(texts)
+        results = [[] for _ in range(len(sig))]
+        if not len(self):
+            return results
+
+        band_hashes = self._band_hashes(sig)
+        # small query blocks bound the memory used by candidate verification
+        for lo in range(0, len(sig), block):
+            q_idx, doc_idx = self._candidate_pairs(band_hashes[lo : lo + block])
+            q_idx += lo
+            similarity = (self._sig[doc_idx] == sig[q_idx]).mean(axis=1)
+            keep = similarity >= self.threshold
+            for q, d, s in zip(q_idx[keep], doc_idx[keep], similarity[keep]):
+                results[q].append((self.doc_ids[d], float(s)))
+        for hits in results:
+            hits.sort(key=lambda h: -h[1])
+        return results
+
+    def deduplicate(self, documents: Iterable, batch_size: int = 1000, insert=True):
+        """
+        Check a stream of (doc_id, text) against the index and against earlier
+        documents in the stream.
+
+        Yields (doc_id, text, duplicate_of) where duplicate_of is None for new
+        documents, or the ID of the most similar earlier document. IDs already in
+        the index are reported as duplicates of themselves. New documents are
+        inserted if `insert` is True; callers can drop duplicates or use
+        duplicate_of as a cluster key.
+        """
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield from self._deduplicate_batch(batch, insert)
+                batch = []
+        if batch:
+            yield from self._deduplicate_batch(batch, insert)
+
+    def _deduplicate_batch(self, batch, insert):
+        doc_ids = [doc_id for doc_id, _ in batch]
+        sig = self.signatures([text for _, text in batch])
+        existing = self.query(signatures=sig)
+        band_hashes = self._band_hashes(sig)
+
+        # within-batch duplicates are checked against earlier kept documents
+        buckets = {}
+        kept = []
+        for i, (doc_id, text) in enumerate(batch):
+            if doc_id in self._id_index:
+                duplicate_of = doc_id
+            elif existing[i]:
+                duplicate_of = existing[i][0][0]
+            else:
+                duplicate_of = None
+                candidates = {
+                    j
+                    for band, h in enumerate(band_hashes[i])
+                    for j in buckets.get((band, h), ())
+                }
+                if candidates:
+                    cand = np.fromiter(candidates, dtype=np.int64)
+                    similarity = (sig[cand] == sig[i]).mean(axis=1)
+                    if similarity.max() >= self.threshold:
+                        duplicate_of = doc_ids[cand[similarity.argmax()]]
+
+            if duplicate_of is None:
+                kept.append(i)
+                for band, h in enumerate(band_hashes[i]):
+                    buckets.setdefault((band, h), []).append(i)
+            yield doc_id, text, duplicate_of
+
+        if insert and kept:
+            self.insert([doc_ids[i] for i in kept], signatures=sig[kept])
+
+    # ---- persistence ----
+
+    def save(self, path: Optional[str] = None):
+        """
+        Append signatures and IDs added since the last save as a new part
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path given to save the index to")
+        os.makedirs(path, exist_ok=True)
+
+        if len(self) > self._n_saved:
+            part = f"part-{len(self._parts):05d}"
+            np.save(
+                os.path.join(path, f"{part}.npy"), self._sig[self._n_saved : len(self)]
+            )
+            with open(os.path.join(path, f"{part}.ids"), "w") as f:
+                f.write("".join(f"{d}\n" for d in self.doc_ids[self._n_saved :]))
+            self._parts.append(part)
+            self._n_saved = len(self)
+
+        # meta is written last and lists the complete parts, so an interrupted
+        # save leaves the previous state loadable
+        meta = {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "shingle_size": self.shingle_size,
+            "seed": self.seed,
+            "n_documents": len(self),
+            "parts": self._parts,
+        }
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+    def _load(self):
+        with open(os.path.join(self.path, "meta.json")) as f:
+            meta = json.load(f)
+        for key in ("num_perm", "shingle_size", "seed"):
+            if meta[key] != getattr(self, key):
+                raise ValueError(
+                    f"Index at {self.path} was built with {key}={meta[key]}"
+                )
+
+        doc_ids, sigs = [], []
+        for part in meta["parts"]:
+            with open(os.path.join(self.path, f"{part}.ids")) as f:
+                doc_ids.extend(line.rstrip("\n") for line in f)
+            sigs.append(np.load(os.path.join(self.path, f"{part}.npy")))
+
+        self.doc_ids = doc_ids
+        self._id_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        self._sig = np.concatenate(sigs) if sigs else self._sig
+        self._parts = list(meta["parts"])
+        self._n_saved = len(doc_ids)
+        if doc_ids:
+            self._main = self._build_segment(0, self._band_hashes(self._sig))
+        print(f"Loaded near-duplicate index with {len(doc_ids)} documents")
@@ -1,10 +1,12 @@
-import json
 import os
 from datetime import datetime
 
 import yaml
 from doccano_client import DoccanoClient
 
+from bioext import codec_utils
+from bioext.codec_utils import Hit
+
 
 class DoccanoSession:
     def __init__(self, server=None):
@@ -184,15 +186,16 @@ def load_from_file(doc_session, data_file_path, doc_load_cfg):
     # doc_session.update_project()
     print(f"Using project: {project.name}, with ID {project.id}")
 
-    # load json from data file
-    for file in os.listdir(data_file_path):
-        with open(os.path.join(data_file_path, file), "r") as file:
-            data = json.load(file)
-            # load json to doccano - TODO: avoid uploading duplicates
-            doc_session.load_document(
-                data["_source"]["text"], metadata={"source_id": data["_id"]}
-            )
-    print(f"Uploaded {len(os.listdir(data_file_path))} examples")
+    # load json from data file, keeping only the text of each hit
+    n_uploaded = 0
+    for file_name in os.listdir(data_file_path):
+        hit = Hit.from_es(
+            codec_utils.load(os.path.join(data_file_path, file_name)), fields=["text"]
+        )
+        # load json to doccano - TODO: avoid uploading duplicates
+        doc_session.load_document(hit.source["text"], metadata={"source_id": hit.id})
+        n_uploaded += 1
+    print(f"Uploaded {n_uploaded} examples")
 
 
 def stream_labelled_docs(doc_session, doc_stream_cfg):
@@ -1,12 +1,28 @@
-import json
 import os
 import random
-from typing import Optional, Literal
+from typing import Iterable, Optional, Literal
 
 import requests
 from elastic_transport import RequestsHttpNode
 from elasticsearch import Elasticsearch, helpers
 
+from bioext import codec_utils
+from bioext.codec_utils import Hit
+
+
+def _serializer_kwargs():
+    """
+    Use the client's orjson serializer for request and response bodies when
+    orjson is installed (elasticsearch>=8.12)
+    """
+    if codec_utils.codec.backend != "orjson":
+        return {}
+    try:
+        from elasticsearch.serializer import OrjsonSerializer
+    except ImportError:
+        return {}
+    return {"serializer": OrjsonSerializer()}
+
 
 # thanks @LAdams for implementing required http proxy
 class GsttProxyNode(RequestsHttpNode):
@@ -63,6 +79,7 @@ class ElasticsearchSession:
                 node_class=self.proxy_node,
                 verify_certs=False,
                 ssl_show_warn=False,
+                **_serializer_kwargs(),
             )
 
         elif conn_mode == "HTTP":
@@ -83,6 +100,7 @@ class ElasticsearchSession:
                 ),
                 verify_certs=False,
                 ssl_show_warn=False,
+                **_serializer_kwargs(),
             )
 
         else:
@@ -125,9 +143,7 @@ class ElasticsearchSession:
         """
         # load json from data file
         try:
-            with open(data_file_path, "r") as file:
-                data = json.load(file)
-                yield from data
+            yield from codec_utils.load(data_file_path)
         except Exception as e:
             print(f"Failed to load samples: {str(e)}")
 
@@ -138,7 +154,10 @@ class ElasticsearchSession:
 
         def doc_generator():
             for doc in documents:
-                yield doc
+                if isinstance(doc, Hit):
+                    yield {"_id": doc.id, "_source": doc.source}
+                else:
+                    yield doc
 
         successes = 0
         for ok, action in helpers.streaming_bulk(
@@ -152,15 +171,92 @@ class ElasticsearchSession:
 
         return successes
 
+    def bulk_upsert_documents(
+        self, index_name, documents, id_field, chunk_size=500, progress_callback=None
+    ):
+        """
+        Bulk index documents using a field of each document as the Elasticsearch _id,
+        so re-running a load replaces documents instead of duplicating them. Hit
+        records are indexed under their own ID.
+        """
+
+        def action_generator():
+            for doc in documents:
+                if isinstance(doc, Hit):
+                    doc_id, source = doc.id, doc.source
+                else:
+                    doc_id, source = doc[id_field], doc
+                yield {
+                    "_op_type": "index",
+                    "_index": index_name,
+                    "_id": doc_id,
+                    "_source": source,
+                }
+
+        successes = 0
+        for ok, action in helpers.streaming_bulk(
+            client=self.es,
+            actions=action_generator(),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        ):
+            successes += ok
+            if not ok:
+                print(f"Failed to index document: {action}")
+            if progress_callback:
+                progress_callback(1)
+
+        return successes
+
+    def bulk_update_documents(self, index_name, updates, chunk_size=500):
+        """
+        Partially update existing documents, given an iterable of (doc_id, fields)
+        """
+
+        def action_generator():
+            for doc_id, fields in updates:
+                yield {
+                    "_op_type": "update",
+                    "_index": index_name,
+                    "_id": doc_id,
+                    "doc": fields,
+                }
+
+        successes = 0
+        for ok, action in helpers.streaming_bulk(
+            client=self.es,
+            actions=action_generator(),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        ):
+            successes += ok
+            if not ok:
+                print(f"Failed to update document: {action}")
+
+        return successes
+
     def bulk_retrieve_documents(
-        self, index_name, query, scroll="2m", save_to_file=None
+        self,
+        index_name,
+        query,
+        scroll="2m",
+        save_to_file=None,
+        slice_id=None,
+        n_slices=None,
     ):
         """
-        Retrieve documents from Elasticsearch using scroll API
+        Retrieve documents from Elasticsearch using scroll API. With `slice_id` and
+        `n_slices`, only one slice of a sliced scroll is retrieved, so that slices
+        can be exported in parallel. Saved hits are written as compact JSON, one
+        file per document.
         """
+        body = {"query": query}
+        if n_slices is not None and n_slices > 1:
+            body["slice"] = {"id": slice_id, "max": n_slices}
+
         docs = helpers.scan(
             client=self.es,
-            query={"query": query},
+            query=body,
             scroll=scroll,
             index=index_name,
         )
@@ -172,8 +268,7 @@ class ElasticsearchSession:
             for hit in docs:
                 doc_id = hit["_id"]
                 file_path = os.path.join(save_to_file, f"{doc_id}.json")
-                with open(file_path, "w") as f:
-                    json.dump(hit, f, indent=2)
+                codec_utils.dump(hit, file_path)
                 processed_count += 1
                 if processed_count % 1000 == 0:
                     print(f"Up to {processed_count} docs...")
@@ -181,6 +276,50 @@ class ElasticsearchSession:
 
         return docs
 
+    def iter_hits(
+        self,
+        index_name,
+        query=None,
+        fields: Optional[Iterable[str]] = None,
+        scroll="2m",
+        size=1000,
+        slice_id=None,
+        n_slices=None,
+    ):
+        """
+        Stream matching documents as compact Hit records. Only `fields` of each
+        source are fetched (`fields=[]` fetches IDs only), which cuts transfer,
+        decoding and memory when the full documents are not needed.
+        """
+        body = {"query": query or {"match_all": {}}}
+        if n_slices is not None and n_slices > 1:
+            body["slice"] = {"id": slice_id, "max": n_slices}
+        source = False if fields is not None and not fields else fields
+        if source is not None:
+            body["_source"] = source
+
+        for hit in helpers.scan(
+            client=self.es, query=body, scroll=scroll, index=index_name, size=size
+        ):
+            yield Hit.from_es(hit)
+
+    def knn_search(
+        self, index_name, field, query_vector, k=10, num_candidates=100, query=None
+    ):
+        """
+        Approximate nearest-neighbour search over a dense_vector field, optionally
+        restricted by a filter query
+        """
+        knn = {
+            "field": field,
+            "query_vector": list(query_vector),
+            "k": k,
+            "num_candidates": max(num_candidates, k),
+        }
+        if query is not None:
+            knn["filter"] = query
+        return self.es.search(index=index_name, knn=knn, size=k)["hits"]["hits"]
+
     def get_random_doc_ids(self, index_name, size, query=None):
         """
         Get a random subset of document IDs from a given document index
@@ -189,18 +328,25 @@ class ElasticsearchSession:
         if query is None:
             query = {"match_all": {}}
 
-        # return all document IDs first!
+        # return all document IDs first, without their sources
         all_ids = [
-            doc["_id"]
-            for doc in self.bulk_retrieve_documents(
-                index_name=index_name,
-                query=query,
-            )
+            hit.id for hit in self.iter_hits(index_name, query=query, fields=[])
         ]
 
         # random sample
         return random.sample(all_ids, min(size, len(all_ids)))
 
+    def get_documents_by_ids(self, index_name, doc_ids, fields=None):
+        """
+        Retrieve many documents in one request as Hit records, optionally with only
+        some source fields. Missing documents are left out.
+        """
+        if not doc_ids:
+            return []
+        params = {} if fields is None else {"_source": list(fields)}
+        response = self.es.mget(index=index_name, ids=list(doc_ids), **params)
+        return [Hit.from_es(doc) for doc in response["docs"] if doc.get("found")]
+
     def get_document_by_id(self, index_name, doc_id):
         """
         Retrieve single document based on its ID
@@ -0,0 +1,420 @@
+import json
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+class SentenceEncoder:
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        max_length: int = 256,
+        batch_size: int = 32,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        """
+        CPU sentence embeddings from a transformers encoder, mean-pooled over
+        tokens and L2-normalised so that dot products are cosine similarities.
+
+        Texts are sorted by length before batching, so each batch is padded only
+        to its own longest text. Text beyond `max_length` tokens is truncated.
+
+        Args:
+            model_name: Hugging Face model name or local path.
+            max_length: Truncation length in tokens.
+            batch_size: Texts per forward pass.
+            num_threads: torch intra-op threads.
+        """
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.dim = self.model.config.hidden_size
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        (n, dim) float32 array of normalised embeddings, in input order
+        """
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for lo in range(0, len(texts), self.batch_size):
+            idx = order[lo : lo + self.batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in idx],
+                padding="longest",
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt",
+            )
+            with self.torch.inference_mode():
+                hidden = self.model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            pooled = self.torch.nn.functional.normalize(pooled, dim=-1)
+            embeddings[idx] = pooled.float().numpy()
+        return embeddings
+
+
+def _kmeans(vectors, n_clusters, n_iter=20, seed=42, block=65536):
+    """
+    Spherical k-means on normalised vectors, returning normalised centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        labels = _nearest(vectors, centroids, block)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # re-seed empty clusters from random points
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), empty.sum())]
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-12)
+    return centroids.astype(np.float32)
+
+
+def _nearest(vectors, centroids, block=65536):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for lo in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[lo : lo + block], dtype=np.float32)
+        labels[lo : lo + block] = (chunk @ centroids.T).argmax(axis=1)
+    return labels
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _write_at(path, offset, data):
+    """
+    Write bytes at an offset, truncating whatever followed it
+    """
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+        f.write(data if isinstance(data, bytes) else data.tobytes())
+
+
+class EmbeddingIndex:
+    def __init__(
+        self,
+        path: str,
+        dim: Optional[int] = None,
+        model_name: Optional[str] = None,
+        min_train_size: int = 10000,
+    ) -> None:
+        """
+        On-disk embedding index for semantic document retrieval.
+
+        Embeddings are stored as a float16 matrix in a single append-only file
+        that is memory-mapped for search, so the index does not need to fit in
+        RAM. Once it holds `min_train_size` documents, an inverted-file (IVF)
+        index is trained with k-means: each document is assigned to its nearest
+        centroid, and a search only scores documents in the `n_probe` lists
+        closest to the query. Smaller indexes are searched exactly. The lists
+        are retrained when the index has grown fourfold since the last training.
+
+        Args:
+            path: Folder holding the index; loaded if it exists.
+            dim: Embedding dimension, required for a new index.
+            model_name: Encoder that produced the embeddings; a mismatch with a
+                saved index raises an error.
+            min_train_size: Number of documents before an IVF index is built.
+        """
+        self.path = path
+        self.min_train_size = min_train_size
+        self.doc_ids = []
+        self._id_index = {}
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._n_trained = 0
+        self._lists = None
+        self._ids_bytes = 0
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if model_name and meta["model_name"] != model_name:
+                raise ValueError(
+                    f"Index at {path} was built with {meta['model_name']}, "
+                    f"not {model_name}"
+                )
+            self.dim = meta["dim"]
+            self.model_name = meta["model_name"]
+            self._load(meta)
+        elif dim is None:
+            raise ValueError("Argument dim is required to create a new index")
+        else:
+            self.dim = dim
+            self.model_name = model_name
+            os.makedirs(path, exist_ok=True)
+        self._matrix = self._open_matrix()
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._id_index
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        (n, dim) float16 memory-mapped embeddings, in the order of `doc_ids`
+        """
+        return self._matrix
+
+    @property
+    def _matrix_path(self):
+        return os.path.join(self.path, "embeddings.f16")
+
+    @property
+    def _ids_path(self):
+        return os.path.join(self.path, "ids.txt")
+
+    def _open_matrix(self):
+        if not len(self):
+            return np.empty((0, self.dim), dtype=np.float16)
+        return np.memmap(
+            self._matrix_path, dtype=np.float16, mode="r", shape=(len(self), self.dim)
+        )
+
+    def _load(self, meta):
+        n = meta["n_documents"]
+        with open(self._ids_path, "rb") as f:
+            # anything written after the last complete add is ignored
+            ids = f.read(meta["ids_bytes"]).decode("utf-8")
+        self.doc_ids = ids.splitlines()
+        self._ids_bytes = meta["ids_bytes"]
+        self._id_index = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        if meta.get("n_trained"):
+            self.centroids = np.load(os.path.join(self.path, "centroids.npy"))
+            assignments = np.load(os.path.join(self.path, "assignments.npy"))
+            self.assignments = assignments[:n]
+            self._n_trained = meta["n_trained"]
+
+    def missing(self, doc_ids: Iterable) -> list:
+        """
+        IDs not yet in the index, i.e. the documents that still need embedding
+        """
+        return [doc_id for doc_id in doc_ids if doc_id not in self._id_index]
+
+    def add(self, doc_ids: list, embeddings: np.ndarray):
+        """
+        Append embeddings for new documents and persist them. IDs already in the
+        index are skipped.
+        """
+        keep = [i for i, doc_id in enumerate(doc_ids) if doc_id not in self._id_index]
+        if not keep:
+            return 0
+        # drop duplicates within the batch, keeping the first
+        seen = {}
+        for i in keep:
+            seen.setdefault(doc_ids[i], i)
+        keep = list(seen.values())
+        vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+        new_ids = [doc_ids[i] for i in keep]
+
+        # overwrite anything left by an interrupted add
+        offset = len(self) * self.dim * 2
+        _write_at(self._matrix_path, offset, vectors.astype(np.float16))
+        encoded_ids = "".join(f"{doc_id}\n" for doc_id in new_ids).encode("utf-8")
+        _write_at(self._ids_path, self._ids_bytes, encoded_ids)
+        self._ids_bytes += len(encoded_ids)
+
+        start = len(self)
+        for i, doc_id in enumerate(new_ids):
+            self._id_index[doc_id] = start + i
+        self.doc_ids.extend(new_ids)
+        self._matrix = self._open_matrix()
+
+        if self.centroids is not None:
+            self.assignments = np.concatenate(
+                [self.assignments, _nearest(vectors, self.centroids)]
+            )
+            self._lists = None
+        if len(self) >= self.min_train_size and len(self) >= 4 * self._n_trained:
+            self.train()
+        self._save_meta()
+        return len(new_ids)
+
+    def train(self, n_lists: Optional[int] = None, sample_size: int = 256):
+        """
+        Build the IVF lists with k-means over a sample of the stored embeddings
+        """
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(self))))
+        rng = np.random.default_rng(42)
+        sample = rng.choice(len(self), min(len(self), n_lists * sample_size), False)
+        vectors = np.asarray(self._matrix[np.sort(sample)], dtype=np.float32)
+        print(f"Training IVF index with {n_lists} lists on {len(sample)} documents...")
+        self.centroids = _kmeans(vectors, n_lists)
+        self.assignments = _nearest(self._matrix, self.centroids)
+        self._n_trained = len(self)
+        self._lists = None
+
+    def _save_meta(self):
+        if self.centroids is not None:
+            np.save(os.path.join(self.path, "centroids.npy"), self.centroids)
+            np.save(os.path.join(self.path, "assignments.npy"), self.assignments)
+        meta = {
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "dtype": "float16",
+            "n_documents": len(self),
+            "ids_bytes": self._ids_bytes,
+            "n_trained": self._n_trained,
+        }
+        # meta is replaced last, so an interrupted add leaves the previous state
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(
+            self.assignments[order], np.arange(len(self.centroids) + 1)
+        )
+        self._lists = (order, bounds)
+
+    def search(
+        self, query_vectors: np.ndarray, k: int = 10, n_probe: int = 8
+    ) -> list[list[tuple]]:
+        """
+        Top-k (doc_id, cosine similarity) for each query embedding
+        """
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        if self.centroids is None:
+            return self._search_exact(queries, k)
+
+        if self._lists is None:
+            self._build_lists()
+        order, bounds = self._lists
+        results = []
+        for query in queries:
+            probes = _top_k(self.centroids @ query, n_probe)
+            candidates = np.sort(
+                np.concatenate([order[bounds[p] : bounds[p + 1]] for p in probes])
+            )
+            scores = np.asarray(self._matrix[candidates], dtype=np.float32) @ query
+            top = _top_k(scores, k)
+            results.append(
+                [(self.doc_ids[candidates[i]], float(scores[i])) for i in top]
+            )
+        return results
+
+    def _search_exact(self, queries, k, block=65536):
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        for lo in range(0, len(self), block):
+            chunk = np.asarray(self._matrix[lo : lo + block], dtype=np.float32)
+            scores = queries @ chunk.T
+            k_chunk = min(k, len(chunk))
+            top = np.argpartition(-scores, k_chunk - 1, axis=1)[:, :k_chunk]
+            # merge this block's top-k with the running top-k
+            scores = np.concatenate(
+                [best_scores, np.take_along_axis(scores, top, axis=1)], axis=1
+            )
+            idx = np.concatenate([best_idx, top + lo], axis=1)
+            keep = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_idx = np.take_along_axis(idx, keep, axis=1)
+        return [
+            [(self.doc_ids[i], float(s)) for i, s in zip(row_idx, row_scores)]
+            for row_idx, row_scores in zip(best_idx, best_scores)
+        ]
+
+
+def embed_documents(
+    documents: Iterable,
+    encoder: SentenceEncoder,
+    index: EmbeddingIndex,
+    batch_size: int = 256,
+) -> int:
+    """
+    Embed (doc_id, text) pairs that are not already in the index.
+
+    Documents are added in batches, so an interrupted run keeps the embeddings
+    computed so far and a re-run only embeds what is missing.
+
+    Returns:
+        Number of newly embedded documents.
+    """
+    n_new = 0
+    batch = []
+
+    def flush():
+        nonlocal n_new
+        doc_ids, texts = zip(*batch)
+        n_new += index.add(list(doc_ids), encoder.encode(list(texts)))
+        print(f"Embedded {n_new} new documents...")
+
+    for doc_id, text in documents:
+        if doc_id in index:
+            continue
+        batch.append((doc_id, text))
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return n_new
+
+
+def search_texts(
+    encoder: SentenceEncoder,
+    index: EmbeddingIndex,
+    queries: list[str],
+    k: int = 10,
+    n_probe: int = 8,
+) -> list[list[tuple]]:
+    """
+    Top-k (doc_id, similarity) for natural-language queries or example letters
+    """
+    return index.search(encoder.encode(queries), k=k, n_probe=n_probe)
+
+
+def dense_vector_mappings(dim: int, field: str = "embedding") -> dict:
+    """
+    Mapping properties for an Elasticsearch dense_vector field, for use with
+    `ElasticsearchSession.create_index` when vectors are searched in Elasticsearch
+    instead of locally
+    """
+    return {
+        "properties": {
+            "source_id": {"type": "keyword"},
+            field: {
+                "type": "dense_vector",
+                "dims": dim,
+                "index": True,
+                "similarity": "cosine",
+            },
+        }
+    }
+
+
+def push_to_elasticsearch(
+    es_session, index_name: str, index: EmbeddingIndex, field: str = "embedding"
+) -> int:
+    """
+    Upsert stored embeddings into an Elasticsearch index created with
+    `dense_vector_mappings`, one document per source document ID
+    """
+    documents = (
+        {"source_id": doc_id, field: np.asarray(vector, dtype=np.float32).tolist()}
+        for doc_id, vector in zip(index.doc_ids, index.embeddings)
+    )
+    return es_session.bulk_upsert_documents(index_name, documents, "source_id")
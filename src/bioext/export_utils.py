@@ -0,0 +1,313 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Optional
+
+import mlflow
+import mlflow.pyfunc
+import numpy as np
+import torch
+
+
+class TorchVariant:
+    def __init__(self, name, model, tokenizer, max_length=512):
+        """
+        Wraps a PyTorch sequence classifier so that all variants expose the same
+        `logits(texts)` interface for evaluation and benchmarking
+        """
+        self.name = name
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def logits(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding="longest",
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            return self.model(**encoded).logits.float().numpy()
+
+
+class OnnxVariant:
+    def __init__(self, name, onnx_path, tokenizer, max_length=512, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.name = name
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def logits(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding="longest",
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {
+            k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names
+        }
+        return self.session.run(None, feeds)[0]
+
+
+class QuantizedClassifier(mlflow.pyfunc.PythonModel):
+    def __init__(self, max_length: int = 512) -> None:
+        """
+        MLflow pyfunc wrapper of a dynamically int8-quantized sequence classifier
+        and its tokenizer. The transformers flavour saves with save_pretrained,
+        which does not handle dynamically quantized layers, so the model is pickled
+        with torch and the tokenizer saved next to it.
+        `serving_utils.TransformersClassifier` loads either kind.
+
+        Predictions are [{"label": ..., "score": ...}] per input text, as from the
+        model server.
+        """
+        self.max_length = max_length
+
+    def load_context(self, context):
+        from transformers import AutoTokenizer
+
+        self.model = torch.load(context.artifacts["model"], weights_only=False).eval()
+        self.tokenizer = AutoTokenizer.from_pretrained(context.artifacts["tokenizer"])
+        self._variant = TorchVariant("int8", self.model, self.tokenizer, self.max_length)
+
+    def predict(self, context, model_input, params=None):
+        if hasattr(model_input, "columns"):
+            texts = model_input.iloc[:, 0].tolist()
+        else:
+            texts = list(model_input)
+        probs = torch.from_numpy(self._variant.logits(texts)).softmax(dim=-1)
+        scores, label_ids = probs.max(dim=-1)
+        id2label = self.model.config.id2label
+        return [
+            {"label": id2label[int(i)], "score": float(s)}
+            for i, s in zip(label_ids, scores)
+        ]
+
+
+def save_quantized_model(path, model, tokenizer, max_length=512, **kwargs):
+    """
+    Save a quantized classifier as a QuantizedClassifier pyfunc model, e.g. as the
+    `save_fn` of AsyncTracker.log_model
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, "model.pt")
+        torch.save(model, model_path)
+        tokenizer_dir = os.path.join(tmp_dir, "tokenizer")
+        tokenizer.save_pretrained(tokenizer_dir)
+        mlflow.pyfunc.save_model(
+            path,
+            python_model=QuantizedClassifier(max_length),
+            artifacts={"model": model_path, "tokenizer": tokenizer_dir},
+            **kwargs,
+        )
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamically quantize Linear layers to int8 weights (activations are quantized
+    on the fly), which is typically the bulk of BERT compute on CPU
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def export_onnx(model, tokenizer, onnx_path, opset=17):
+    """
+    Export a sequence classifier to ONNX with dynamic batch and sequence axes
+    """
+    model = model.eval()
+    sample = tokenizer(["sample text for export"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (dict(sample),),
+            onnx_path,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            # TorchScript exporter; dynamic_axes is not honoured by the dynamo one
+            dynamo=False,
+        )
+    return onnx_path
+
+
+def evaluate_accuracy(variant, texts, labels, batch_size=32):
+    """
+    Accuracy and predicted labels of a variant over texts
+    """
+    preds = []
+    for i in range(0, len(texts), batch_size):
+        preds.append(variant.logits(texts[i : i + batch_size]).argmax(axis=-1))
+    preds = np.concatenate(preds)
+    return float((preds == np.asarray(labels)).mean()), preds
+
+
+def benchmark_latency(variant, texts, batch_sizes=(1, 8, 32), n_repeats=20, warmup=3):
+    """
+    Median and p99 latency per batch, and samples/s, for each batch size
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        batch = (texts * (batch_size // max(len(texts), 1) + 1))[:batch_size]
+        for _ in range(warmup):
+            variant.logits(batch)
+
+        timings = []
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            variant.logits(batch)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        p50 = statistics.median(timings)
+        p99 = timings[min(len(timings) - 1, int(0.99 * len(timings)))]
+        results[batch_size] = {
+            "latency_p50_ms": 1000 * p50,
+            "latency_p99_ms": 1000 * p99,
+            "samples_per_s": batch_size / p50,
+        }
+    return results
+
+
+def export_and_benchmark(
+    model,
+    tokenizer,
+    eval_texts: list[str],
+    eval_labels: list[int],
+    tolerance: float = 0.01,
+    batch_sizes=(1, 8, 32),
+    max_length: int = 512,
+    output_dir: Optional[str] = None,
+    tracker=None,
+) -> dict:
+    """
+    Post-training step that builds int8-quantized and ONNX variants of a trained
+    classifier, checks their accuracy against the original on the eval split, and
+    benchmarks CPU latency and throughput.
+
+    Everything is logged to the tracker's run (or the active MLflow run): the
+    variants as models ("bert_model_int8" as a QuantizedClassifier pyfunc model with
+    its tokenizer, "bert_model_onnx"), per-variant metrics, a JSON report, and a
+    `fastest_acceptable_variant` tag that serving can use to pick an artifact.
+
+    Args:
+        model: Trained transformers sequence classification model.
+        tokenizer: Matching tokenizer.
+        eval_texts: Evaluation texts.
+        eval_labels: Evaluation labels (integer ids).
+        tolerance: Maximum allowed accuracy drop relative to the original model.
+        batch_sizes: Batch sizes to benchmark.
+        max_length: Truncation length.
+        output_dir: Folder for exported files; a temporary folder if None.
+        tracker: tracking_utils.AsyncTracker to log through; if None, one is opened
+            for the active MLflow run, if any.
+
+    Returns:
+        dict report with accuracy, agreement and latency per variant.
+    """
+    output_dir = output_dir or tempfile.mkdtemp(prefix="bioext_export_")
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.cpu().eval()
+
+    print("Quantizing model to int8...")
+    quantized = quantize_dynamic_int8(model)
+    print("Exporting model to ONNX...")
+    onnx_path = export_onnx(model, tokenizer, os.path.join(output_dir, "model.onnx"))
+
+    variants = [
+        TorchVariant("fp32", model, tokenizer, max_length),
+        TorchVariant("int8", quantized, tokenizer, max_length),
+        OnnxVariant("onnx", onnx_path, tokenizer, max_length, torch.get_num_threads()),
+    ]
+
+    report = {}
+    reference_preds = None
+    for variant in variants:
+        print(f"Evaluating {variant.name}...")
+        accuracy, preds = evaluate_accuracy(variant, eval_texts, eval_labels)
+        if reference_preds is None:
+            reference_preds, reference_accuracy = preds, accuracy
+
+        latency = benchmark_latency(
+            variant, eval_texts[: max(batch_sizes)], batch_sizes
+        )
+        report[variant.name] = {
+            "accuracy": accuracy,
+            "agreement_with_fp32": float((preds == reference_preds).mean()),
+            "accuracy_ok": accuracy >= reference_accuracy - tolerance,
+            "latency": latency,
+        }
+
+    # fastest acceptable variant by single-item latency
+    acceptable = [name for name, r in report.items() if r["accuracy_ok"]]
+    fastest = min(
+        acceptable,
+        key=lambda name: report[name]["latency"][batch_sizes[0]]["latency_p50_ms"],
+    )
+
+    log_args = (report, fastest, quantized, tokenizer, onnx_path, max_length)
+    if tracker is not None:
+        _log_report(tracker, *log_args)
+    elif mlflow.active_run():
+        from bioext.tracking_utils import AsyncTracker
+
+        with AsyncTracker(log_overhead=False) as run_tracker:
+            _log_report(run_tracker, *log_args)
+
+    print(json.dumps({name: r["accuracy"] for name, r in report.items()}, indent=2))
+    print(f"Fastest acceptable variant: {fastest}")
+    report["fastest_acceptable_variant"] = fastest
+    return report
+
+
+def _log_report(tracker, report, fastest, quantized, tokenizer, onnx_path, max_length):
+    import onnx
+
+    metrics = {}
+    for name, r in report.items():
+        metrics[f"{name}_accuracy"] = r["accuracy"]
+        metrics[f"{name}_agreement_with_fp32"] = r["agreement_with_fp32"]
+        for batch_size, stats in r["latency"].items():
+            for stat, value in stats.items():
+                metrics[f"{name}_bs{batch_size}_{stat}"] = value
+    tracker.log_metrics(metrics)
+    tracker.set_tag("fastest_acceptable_variant", fastest)
+
+    report_path = os.path.join(os.path.dirname(onnx_path), "export_benchmark.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    tracker.log_artifact(report_path)
+
+    tracker.log_model(
+        save_quantized_model,
+        "bert_model_int8",
+        model=quantized,
+        tokenizer=tokenizer,
+        max_length=max_length,
+    )
+    tracker.log_model(
+        mlflow.onnx.save_model, "bert_model_onnx", onnx_model=onnx.load(onnx_path)
+    )
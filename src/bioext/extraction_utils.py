@@ -0,0 +1,415 @@
+import json
+import math
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+# boundaries used when snapping chunk edges, strongest first
+_BREAK_PATTERNS = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+]
+
+
+class TokenEstimator:
+    def __init__(self, tokenizer=None, chars_per_token: float = 3.5) -> None:
+        """
+        Counts tokens for prompts and letters sent to the extraction model.
+
+        If a tokenizer is given (either a loaded HuggingFace tokenizer or a name/path
+        that can be passed to AutoTokenizer), exact counts are used. Otherwise a fast
+        character-based approximation is used, which errs on the side of overcounting
+        for clinical text (abbreviations and numbers tokenise poorly).
+
+        Args:
+            tokenizer: Optional tokenizer object, or name/path of the served model.
+            chars_per_token: Ratio used by the approximation when no tokenizer is set.
+        """
+        if isinstance(tokenizer, str):
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+
+        self.tokenizer = tokenizer
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """
+        Count tokens for a batch of texts, using the tokenizer batch API if available
+        """
+        if self.tokenizer is None:
+            return [math.ceil(len(t) / self.chars_per_token) for t in texts]
+
+        encoded = self.tokenizer(list(texts), add_special_tokens=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+@dataclass
+class ExtractionRequest:
+    doc_id: str
+    text: str
+    n_tokens: int
+    chunk_index: int = 0
+    n_chunks: int = 1
+
+    @property
+    def is_chunk(self):
+        return self.n_chunks > 1
+
+
+class RequestPlanner:
+    def __init__(
+        self,
+        system_prompt: str,
+        estimator: Optional[TokenEstimator] = None,
+        max_request_tokens: int = 8192,
+        max_output_tokens: int = 2048,
+        max_inflight_tokens: int = 65536,
+        chunk_overlap_tokens: int = 256,
+        bucket_edges: Iterable[int] = (512, 1024, 2048, 4096),
+        template_overhead_tokens: int = 32,
+    ) -> None:
+        """
+        Plans requests to an OpenAI-compatible extraction endpoint (e.g. vLLM).
+
+        Letters are measured against the shared system prompt, split into overlapping
+        chunks if the prompt + letter + expected output would exceed the model context,
+        then sorted and bucketed by length so that requests in flight at the same time
+        are of similar size. `run` dispatches the buckets while keeping the total number
+        of tokens in flight under `max_inflight_tokens`.
+
+        Args:
+            system_prompt: System prompt that is prepended to every request.
+            estimator: TokenEstimator; defaults to character based approximation.
+            max_request_tokens: Context budget per request (prompt + letter + output).
+            max_output_tokens: Tokens reserved for the model response.
+            max_inflight_tokens: Total token budget across concurrent requests.
+            chunk_overlap_tokens: Overlap between consecutive chunks of a long letter.
+            bucket_edges: Upper letter-token bounds of each length bucket.
+            template_overhead_tokens: Allowance for the chat template special tokens.
+        """
+        self.estimator = estimator or TokenEstimator()
+        self.system_prompt = system_prompt
+        self.max_request_tokens = max_request_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_inflight_tokens = max_inflight_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.bucket_edges = sorted(bucket_edges)
+
+        self.prompt_tokens = (
+            self.estimator.count(system_prompt) + template_overhead_tokens
+        )
+        self.max_letter_tokens = (
+            max_request_tokens - max_output_tokens - self.prompt_tokens
+        )
+        if self.max_letter_tokens <= chunk_overlap_tokens:
+            raise ValueError(
+                f"max_request_tokens={max_request_tokens} leaves no room for letters "
+                f"after a {self.prompt_tokens} token prompt and {max_output_tokens} "
+                "output tokens"
+            )
+        if self.request_cost(self.max_letter_tokens) > max_inflight_tokens:
+            raise ValueError("max_inflight_tokens must fit at least one full request")
+
+    def request_cost(self, n_tokens: int) -> int:
+        """
+        Tokens a single request holds in the KV cache while in flight
+        """
+        return self.prompt_tokens + n_tokens + self.max_output_tokens
+
+    def plan(self, letters) -> list[list[ExtractionRequest]]:
+        """
+        Measure, chunk and bucket letters.
+
+        Args:
+            letters: dict of {doc_id: text}, or iterable of (doc_id, text) tuples.
+
+        Returns:
+            List of buckets (shortest first), each a list of requests sorted by
+            descending length.
+        """
+        if isinstance(letters, dict):
+            letters = letters.items()
+        letters = list(letters)
+
+        counts = self.estimator.count_batch([text for _, text in letters])
+
+        plan_requests = []
+        for (doc_id, text), n_tokens in zip(letters, counts):
+            if n_tokens <= self.max_letter_tokens:
+                plan_requests.append(ExtractionRequest(doc_id, text, n_tokens))
+            else:
+                plan_requests.extend(self.chunk(doc_id, text, n_tokens))
+
+        buckets = [[] for _ in range(len(self.bucket_edges) + 1)]
+        for req in plan_requests:
+            idx = next(
+                (i for i, edge in enumerate(self.bucket_edges) if req.n_tokens <= edge),
+                len(self.bucket_edges),
+            )
+            buckets[idx].append(req)
+
+        for bucket in buckets:
+            bucket.sort(key=lambda r: r.n_tokens, reverse=True)
+
+        return [bucket for bucket in buckets if bucket]
+
+    def chunk(self, doc_id, text, n_tokens=None) -> list[ExtractionRequest]:
+        """
+        Split an oversize letter into overlapping chunks that each fit the request
+        budget. Chunk edges are snapped to paragraph, line or sentence boundaries.
+        """
+        if n_tokens is None:
+            n_tokens = self.estimator.count(text)
+
+        # work in characters, using the letter's own chars/token ratio
+        chars_per_token = max(len(text) / max(n_tokens, 1), 1.0)
+        target = int(self.max_letter_tokens * chars_per_token)
+        overlap = int(self.chunk_overlap_tokens * chars_per_token)
+
+        spans = []
+        start = 0
+        while start < len(text):
+            end = min(start + target, len(text))
+            if end < len(text):
+                end = _snap_to_break(text, start + overlap + 1, end)
+
+            chunk_tokens = self.estimator.count(text[start:end])
+            # shrink until chunk fits (approximation may undercount dense text)
+            while chunk_tokens > self.max_letter_tokens and end - start > overlap + 1:
+                end = start + overlap + 1 + (end - start - overlap - 1) * 9 // 10
+                end = _snap_to_break(text, start + overlap + 1, end)
+                chunk_tokens = self.estimator.count(text[start:end])
+
+            spans.append((start, end, chunk_tokens))
+            if end >= len(text):
+                break
+            start = _snap_to_break(text, end - overlap, end, forward=True)
+
+        return [
+            ExtractionRequest(doc_id, text[s:e], n, chunk_index=i, n_chunks=len(spans))
+            for i, (s, e, n) in enumerate(spans)
+        ]
+
+    def run(
+        self,
+        plan_buckets: list[list[ExtractionRequest]],
+        send_fn: Callable[[ExtractionRequest], str],
+        max_workers: int = 16,
+        schema: Optional[dict] = None,
+        progress_callback=None,
+    ) -> dict:
+        """
+        Dispatch planned requests in plan order through one worker pool, and merge
+        each document's results once all of its chunks have returned.
+
+        Args:
+            plan_buckets: Output of `plan`.
+            send_fn: Callable taking an ExtractionRequest and returning model output.
+            max_workers: Maximum number of concurrent HTTP requests.
+            schema: Optional extraction schema used to merge chunk outputs.
+            progress_callback: Called with 1 after each completed request.
+
+        Returns:
+            dict of {doc_id: extraction dict, or None if no response (or chunk
+            response) was a JSON object, e.g. a 'not related to cancer' answer}
+        """
+        budget = _TokenBudget(self.max_inflight_tokens)
+        outputs = {}
+        merged = {}
+
+        def _send(req):
+            cost = self.request_cost(req.n_tokens)
+            with budget.hold(cost):
+                result = send_fn(req)
+            if progress_callback:
+                progress_callback(1)
+            return req, result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # one queue across buckets: workers are taken in plan order, but a slow
+            # request no longer holds back the start of the next bucket
+            futures = [
+                pool.submit(_send, req) for bucket in plan_buckets for req in bucket
+            ]
+            for future in as_completed(futures):
+                req, result = future.result()
+                results = outputs.setdefault(req.doc_id, [])
+                results.append((req.chunk_index, result))
+                if len(results) == req.n_chunks:
+                    merged[req.doc_id] = self._merge(outputs.pop(req.doc_id), schema)
+        return merged
+
+    @staticmethod
+    def _merge(results, schema):
+        # single- and multi-chunk letters are parsed the same way, so callers
+        # always get a dict (or None)
+        results.sort(key=lambda r: r[0])
+        parsed = [p for p in (parse_model_json(r) for _, r in results) if p]
+        if not parsed:
+            return None
+        if len(parsed) == 1:
+            return parsed[0]
+        return merge_extractions(parsed, schema)
+
+
+class _TokenBudget:
+    """
+    Blocking counter that limits the number of tokens held by concurrent requests
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def hold(self, cost):
+        return _BudgetHold(self, min(cost, self.limit))
+
+    def acquire(self, cost):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight + cost <= self.limit)
+            self.in_flight += cost
+
+    def release(self, cost):
+        with self._cond:
+            self.in_flight -= cost
+            self._cond.notify_all()
+
+
+class _BudgetHold:
+    def __init__(self, budget, cost):
+        self.budget = budget
+        self.cost = cost
+
+    def __enter__(self):
+        self.budget.acquire(self.cost)
+
+    def __exit__(self, *exc):
+        self.budget.release(self.cost)
+
+
+def _snap_to_break(text, lo, hi, forward=False):
+    """
+    Move `hi` back (or, with forward=True, `lo` forward) to the strongest text
+    boundary within text[lo:hi]. Returns the unchanged position if none is found.
+    """
+    lo = max(lo, 0)
+    if hi <= lo:
+        return hi
+    window = text[lo:hi]
+    for pattern in _BREAK_PATTERNS:
+        matches = list(pattern.finditer(window))
+        if matches:
+            match = matches[0] if forward else matches[-1]
+            return lo + match.end()
+    return lo if forward else hi
+
+
+def parse_model_json(content):
+    """
+    Parse JSON returned by the model, tolerating markdown code fences.
+    Returns None if the content is not a JSON object (e.g. the 'not related to
+    cancer' response).
+    """
+    if isinstance(content, dict):
+        return content
+    if not isinstance(content, str):
+        return None
+
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("\n") + 1 :] if "\n" in text else text
+
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            parsed = json.loads(text[start : end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    return parsed if isinstance(parsed, dict) else None
+
+
+def schema_cardinality(schema: dict) -> dict:
+    """
+    Flatten the `schema_structure` of an extraction schema into a dict of
+    {dotted.field.path: "multiple" | "single"}.
+    """
+    structure = schema.get("schema_structure", schema)
+    rules = {}
+
+    def _walk(node, prefix):
+        for name, spec in node.items():
+            if not isinstance(spec, dict) or name in ("fields", "description"):
+                continue
+            path = f"{prefix}{name}"
+            multiple = spec.get("cardinality") == "multiple" or spec.get("repeatable")
+            rules[path] = "multiple" if multiple else "single"
+            # nested entities may sit inside "fields" or alongside it
+            _walk(spec.get("fields", {}), f"{path}.")
+            _walk(spec, f"{path}.")
+
+    _walk(structure, "")
+    return rules
+
+
+def merge_extractions(outputs: list, schema: Optional[dict] = None) -> dict:
+    """
+    Merge per-chunk JSON outputs for a single letter.
+
+    Fields with "multiple" cardinality (or that are lists) are concatenated in chunk
+    order with exact duplicates (from chunk overlaps) removed. Single-valued fields
+    keep the first non-empty value found. Chunks that did not return JSON are skipped.
+
+    Args:
+        outputs: list of model responses (str or dict), in chunk order.
+        schema: Optional extraction schema; if not given, cardinality is inferred
+            from the output structure.
+    """
+    rules = schema_cardinality(schema) if schema else {}
+    merged = {}
+    for output in outputs:
+        parsed = parse_model_json(output)
+        if parsed:
+            _merge_into(merged, parsed, rules, "")
+    return merged
+
+
+def _merge_into(target, source, rules, prefix):
+    for key, value in source.items():
+        path = f"{prefix}{key}"
+        if value in (None, "", [], {}):
+            continue
+
+        if rules.get(path) == "multiple" or isinstance(value, list):
+            items = value if isinstance(value, list) else [value]
+            existing = target.setdefault(key, [])
+            if not isinstance(existing, list):
+                existing = target[key] = [existing]
+            seen = {json.dumps(item, sort_keys=True) for item in existing}
+            for item in items:
+                marker = json.dumps(item, sort_keys=True)
+                if marker not in seen:
+                    seen.add(marker)
+                    existing.append(item)
+
+        elif isinstance(value, dict):
+            existing = target.setdefault(key, {})
+            if isinstance(existing, dict):
+                _merge_into(existing, value, rules, f"{path}.")
+
+        elif target.get(key) in (None, ""):
+            target[key] = value
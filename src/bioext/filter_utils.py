@@ -0,0 +1,323 @@
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from bioext import codec_utils
+from bioext.parallel_utils import map_batches
+
+try:
+    # C implementation of Aho-Corasick, used when installed
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+@dataclass
+class Match:
+    rule: str
+    start: int
+    end: int
+    text: str
+    negated: bool = False
+
+
+@dataclass
+class FilterResult:
+    doc_id: str
+    selected: bool
+    matches: list = field(default_factory=list)
+    counts: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            "doc_id": self.doc_id,
+            "selected": self.selected,
+            "counts": self.counts,
+            "matches": [m.__dict__ for m in self.matches],
+        }
+
+
+class _KeywordAutomaton:
+    """
+    Finds every occurrence of every keyword in one pass over the text.
+
+    Uses pyahocorasick if available. Otherwise keywords are compiled into a trie and
+    then into a single regex, scanned with a lookahead so that matches starting at
+    every position are found; shorter keywords that are prefixes of a longer match
+    are recovered by walking the trie along the matched text.
+    """
+
+    def __init__(self, keywords: dict):
+        # keywords: {lowercased keyword: [payload, ...]}
+        self.keywords = keywords
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, payloads in keywords.items():
+                self._automaton.add_word(keyword, (keyword, payloads))
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._trie = {}
+            for keyword in keywords:
+                node = self._trie
+                for char in keyword:
+                    node = node.setdefault(char, {})
+                node[""] = keyword
+            self._regex = re.compile(f"(?=({_trie_to_regex(self._trie)}))", re.DOTALL)
+
+    def iter(self, text_lower: str):
+        """
+        Yield (start, end, keyword, payloads) for every keyword occurrence
+        """
+        if not self.keywords:
+            return
+        if self._automaton is not None:
+            for end_idx, (keyword, payloads) in self._automaton.iter(text_lower):
+                start = end_idx - len(keyword) + 1
+                yield start, end_idx + 1, keyword, payloads
+            return
+
+        for m in self._regex.finditer(text_lower):
+            start = m.start()
+            node = self._trie
+            for i, char in enumerate(m.group(1)):
+                node = node[char]
+                if "" in node:
+                    keyword = node[""]
+                    yield start, start + i + 1, keyword, self.keywords[keyword]
+
+
+def _trie_to_regex(node):
+    """
+    Compile a character trie into a regex alternation with shared prefixes
+    """
+    branches = []
+    optional = "" in node
+    for char, child in sorted((k, v) for k, v in node.items() if k != ""):
+        branches.append(re.escape(char) + _trie_to_regex(child))
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    if optional:
+        return f"(?:{body})?"
+    return body
+
+
+class MultiPatternMatcher:
+    def __init__(
+        self,
+        rules: list[dict],
+        require: Optional[list] = None,
+        exclude: Optional[list] = None,
+        negation_window: int = 40,
+    ) -> None:
+        """
+        Compiles a set of keyword, regex and negation rules into a single-pass
+        matcher for local cohort filtering.
+
+        Each rule is a dict with:
+            name: rule name, used in counts and in require/exclude.
+            keywords: case-insensitive literals (substring match, like `*brca*`).
+            regex: case-insensitive regular expressions.
+            whole_word: only accept keyword matches on word boundaries.
+            negations: terms (e.g. "no", "negative for") that negate a match if they
+                occur as whole words up to `negation_window` characters before it in
+                the same sentence. Negated matches are reported but not counted.
+
+        All keywords and negation terms across all rules go into one Aho-Corasick
+        automaton, so keywords are found in a single scan regardless of the number
+        of rules. Each rule's regexes are combined into one pattern per rule, so a
+        regex match never hides an overlapping match of another rule.
+
+        Args:
+            rules: list of rule dicts.
+            require: Rule names that must all match for a document to be selected;
+                defaults to all rules.
+            exclude: Rule names that must not match for a document to be selected.
+            negation_window: Characters before a match searched for negation terms.
+        """
+        self.rules = rules
+        self.rule_names = [r["name"] for r in rules]
+        self.require = list(require) if require is not None else list(self.rule_names)
+        self.exclude = list(exclude or [])
+        self.negation_window = negation_window
+
+        unknown = set(self.require + self.exclude) - set(self.rule_names)
+        if unknown:
+            raise ValueError(f"Unknown rule names in require/exclude: {unknown}")
+
+        keywords = {}
+        self.whole_word = {}
+        self.negations = {}
+        self._regexes = []
+        for rule in rules:
+            name = rule["name"]
+            self.whole_word[name] = rule.get("whole_word", False)
+            for keyword in rule.get("keywords", []):
+                keywords.setdefault(keyword.lower(), []).append(("match", name))
+            for term in rule.get("negations", []):
+                keywords.setdefault(term.strip().lower(), []).append(
+                    ("negation", name)
+                )
+            self.negations[name] = bool(rule.get("negations"))
+            patterns = rule.get("regex", [])
+            if patterns:
+                try:
+                    regex = re.compile(
+                        "|".join(f"(?:{p})" for p in patterns), re.IGNORECASE
+                    )
+                except re.error as e:
+                    raise ValueError(f"Invalid regex in rule {name}: {e}") from e
+                self._regexes.append((name, regex))
+
+        self._automaton = _KeywordAutomaton(keywords)
+
+    @classmethod
+    def from_config(cls, filter_cfg: dict):
+        return cls(
+            rules=filter_cfg["rules"],
+            require=filter_cfg.get("require"),
+            exclude=filter_cfg.get("exclude"),
+            negation_window=filter_cfg.get("negation_window", 40),
+        )
+
+    def match(self, doc_id, text: str) -> FilterResult:
+        text_lower = text.lower()
+        if len(text_lower) != len(text):
+            # a few characters lowercase to two, which would shift match offsets
+            text_lower = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+        matches = []
+        negation_ends = {}
+
+        # longest keyword per rule and start position, e.g. "brca1" over "brca"
+        keyword_matches = {}
+        for start, end, keyword, payloads in self._automaton.iter(text_lower):
+            for kind, rule in payloads:
+                if kind == "negation":
+                    # "no" must not match inside e.g. "piano"
+                    if _on_word_boundary(text, start, end):
+                        negation_ends.setdefault(rule, []).append(end)
+                elif not self.whole_word[rule] or _on_word_boundary(text, start, end):
+                    previous = keyword_matches.get((rule, start))
+                    if previous is None or end > previous.end:
+                        keyword_matches[(rule, start)] = Match(
+                            rule, start, end, text[start:end]
+                        )
+        matches.extend(keyword_matches.values())
+
+        for rule, regex in self._regexes:
+            for m in regex.finditer(text):
+                matches.append(Match(rule, m.start(), m.end(), m.group()))
+
+        counts = Counter()
+        for m in matches:
+            if self.negations[m.rule]:
+                m.negated = self._is_negated(text, m, negation_ends.get(m.rule, []))
+            if not m.negated:
+                counts[m.rule] += 1
+
+        selected = all(counts[r] > 0 for r in self.require) and not any(
+            counts[r] > 0 for r in self.exclude
+        )
+        matches.sort(key=lambda m: m.start)
+        return FilterResult(doc_id, selected, matches, dict(counts))
+
+    def _is_negated(self, text, match, negation_ends):
+        window_start = match.start - self.negation_window
+        for end in negation_ends:
+            if window_start <= end <= match.start:
+                # do not look across sentence boundaries
+                between = text[end : match.start]
+                if not any(p in between for p in ".;\n"):
+                    return True
+        return False
+
+
+def _on_word_boundary(text, start, end):
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not (before.isalnum() or after.isalnum())
+
+
+# per-process matcher, built by the pool initializer
+_worker_matcher = None
+
+
+def _init_worker(filter_cfg):
+    global _worker_matcher
+    _worker_matcher = MultiPatternMatcher.from_config(filter_cfg)
+
+
+def _match_batch(batch):
+    return [_worker_matcher.match(doc_id, text) for doc_id, text in batch]
+
+
+def filter_documents(
+    documents: Iterable,
+    filter_cfg: dict,
+    n_jobs: Optional[int] = None,
+    batch_size: int = 500,
+):
+    """
+    Apply a filter config to (doc_id, text) pairs across a process pool.
+
+    Yields FilterResult objects in input order.
+    """
+    return map_batches(
+        documents,
+        _match_batch,
+        initializer=_init_worker,
+        initargs=(filter_cfg,),
+        n_jobs=n_jobs,
+        batch_size=batch_size,
+    )
+
+
+def iter_exported_docs(folder: str, content_field: str = "text"):
+    """
+    Yield (doc_id, text) from a folder of hits saved by `bulk_retrieve_documents`
+    """
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(".json"):
+            continue
+        hit = codec_utils.load(os.path.join(folder, file_name))
+        if content_field in hit.get("_source", {}):
+            yield hit["_id"], hit["_source"][content_field]
+
+
+def run_filter(
+    documents: Iterable,
+    filter_cfg: dict,
+    output_file: Optional[str] = None,
+    n_jobs: Optional[int] = None,
+) -> dict:
+    """
+    Filter documents, optionally writing selected results as JSON lines, and
+    return a summary with per-rule match counts
+    """
+    totals = Counter()
+    doc_counts = Counter()
+    n_docs = n_selected = 0
+
+    out = open(output_file, "wb") if output_file else None
+    try:
+        for result in filter_documents(documents, filter_cfg, n_jobs=n_jobs):
+            n_docs += 1
+            totals.update(result.counts)
+            doc_counts.update(result.counts.keys())
+            if result.selected:
+                n_selected += 1
+                if out:
+                    out.write(codec_utils.dumps(result.to_dict()) + b"\n")
+    finally:
+        if out:
+            out.close()
+
+    return {
+        "documents": n_docs,
+        "selected": n_selected,
+        "match_counts": dict(totals),
+        "document_counts": dict(doc_counts),
+    }
@@ -0,0 +1,261 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+import mlflow
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+
+from bioext.parallel_utils import chunked
+
+
+def stream_labelled_chunks(
+    doc_session,
+    project_id=None,
+    chunk_size: int = 1000,
+    label_fn: Optional[Callable[[list], Optional[str]]] = None,
+):
+    """
+    Stream labelled Doccano examples as (texts, labels) chunks.
+
+    Args:
+        doc_session: DoccanoSession.
+        project_id: Doccano project; defaults to the session's current project.
+        chunk_size: Examples per chunk.
+        label_fn: Maps the list of labels on an example to a single class, or None
+            to skip it. Defaults to the first label; unlabelled examples are skipped.
+    """
+    label_fn = label_fn or (lambda labels: labels[0] if labels else None)
+    samples = (
+        (text, label_fn(labels))
+        for text, labels in doc_session.get_labelled_samples(project_id)
+    )
+    for chunk in chunked((s for s in samples if s[1] is not None), chunk_size):
+        texts, labels = zip(*chunk)
+        yield list(texts), list(labels)
+
+
+def stream_es_chunks(
+    es_session,
+    index_name,
+    query,
+    content_field="text",
+    chunk_size: int = 1000,
+    slice_id=None,
+    n_slices=None,
+):
+    """
+    Stream documents from an Elasticsearch scroll (or one slice of it) as
+    (doc_ids, texts) chunks
+    """
+    hits = es_session.bulk_retrieve_documents(
+        index_name=index_name, query=query, slice_id=slice_id, n_slices=n_slices
+    )
+    hits = (h for h in hits if content_field in h["_source"])
+    for chunk in chunked(hits, chunk_size):
+        yield [h["_id"] for h in chunk], [h["_source"][content_field] for h in chunk]
+
+
+class StreamingTextClassifier:
+    def __init__(
+        self,
+        classes: list,
+        model: str = "sgd",
+        n_features: int = 2**20,
+        ngram_range: tuple = (1, 2),
+        n_jobs: Optional[int] = None,
+        min_texts_per_job: int = 500,
+        **model_params,
+    ) -> None:
+        """
+        Out-of-core text classifier for triage over large Elasticsearch exports.
+
+        Texts are vectorized with a stateless HashingVectorizer, so there is no
+        vocabulary to fit or hold in memory, and chunks are split across a process
+        pool for vectorization. The model is trained incrementally with
+        `partial_fit`, so memory use is bounded by the chunk size, not the corpus.
+
+        Args:
+            classes: All class labels (required up front by partial_fit).
+            model: "sgd" (logistic loss SGDClassifier) or "nb" (MultinomialNB).
+            n_features: Number of hashed features.
+            ngram_range: Word n-gram range for the vectorizer.
+            n_jobs: Vectorizer processes; defaults to the number of CPUs.
+            min_texts_per_job: Chunks smaller than this are vectorized in-process.
+            **model_params: Passed to the sklearn estimator.
+        """
+        self.classes = list(classes)
+        self.model_name = model
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.min_texts_per_job = min_texts_per_job
+
+        if model == "sgd":
+            params = {"loss": "log_loss", "alpha": 1e-6, "random_state": 42}
+            params.update(model_params)
+            self.model = SGDClassifier(**params)
+            alternate_sign = True
+        elif model == "nb":
+            params = {"alpha": 0.01}
+            params.update(model_params)
+            self.model = MultinomialNB(**params)
+            # naive Bayes needs non-negative feature values
+            alternate_sign = False
+        else:
+            raise ValueError("Argument model must be 'sgd' or 'nb'")
+
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=ngram_range,
+            alternate_sign=alternate_sign,
+            lowercase=True,
+        )
+        self._pool = None
+        self.n_seen = 0
+        self.history = []
+
+    @classmethod
+    def from_mlflow(cls, model_uri: str, n_jobs: Optional[int] = None):
+        """
+        Load a classifier previously logged with `log_to_mlflow`, e.g. for scoring
+        """
+        pipeline = mlflow.sklearn.load_model(model_uri)
+        model = pipeline.named_steps["model"]
+        clf = cls(
+            classes=model.classes_.tolist(),
+            model="nb" if isinstance(model, MultinomialNB) else "sgd",
+            n_jobs=n_jobs,
+        )
+        clf.model = model
+        clf.vectorizer = pipeline.named_steps["vectorizer"]
+        return clf
+
+    def vectorize(self, texts: list[str]) -> sp.csr_matrix:
+        n_splits = min(self.n_jobs, len(texts) // self.min_texts_per_job)
+        if n_splits <= 1:
+            return self.vectorizer.transform(texts)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.n_jobs)
+        bounds = np.linspace(0, len(texts), n_splits + 1, dtype=int)
+        parts = self._pool.map(
+            self.vectorizer.transform,
+            [texts[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])],
+        )
+        return sp.vstack(list(parts), format="csr")
+
+    def partial_fit(self, texts: list[str], labels: list):
+        X = self.vectorize(texts)
+        self.model.partial_fit(X, labels, classes=self.classes)
+        self.n_seen += len(texts)
+        return self
+
+    def fit_stream(self, chunks: Iterable, log_every: int = 1) -> dict:
+        """
+        Train on a stream of (texts, labels) chunks.
+
+        Uses progressive validation: each chunk is first scored with the current
+        model, then used for training, which gives a running estimate of
+        performance without holding out data in memory.
+
+        Returns:
+            dict of summary metrics across the stream.
+        """
+        start = time.perf_counter()
+        y_true, y_pred = [], []
+        for step, (texts, labels) in enumerate(chunks):
+            if self.n_seen > 0:
+                preds = self.model.predict(self.vectorize(texts))
+                y_true.extend(labels)
+                y_pred.extend(preds)
+                chunk_metrics = {
+                    "progressive_accuracy": accuracy_score(labels, preds),
+                    "progressive_f1_macro": f1_score(
+                        labels, preds, average="macro", zero_division=0
+                    ),
+                }
+                self.history.append(chunk_metrics)
+                if mlflow.active_run() and step % log_every == 0:
+                    mlflow.log_metrics(chunk_metrics, step=step)
+
+            self.partial_fit(texts, labels)
+            print(f"Trained on {self.n_seen} documents...")
+
+        summary = {
+            "n_train_documents": self.n_seen,
+            "train_time_s": time.perf_counter() - start,
+        }
+        if y_true:
+            summary["progressive_accuracy"] = accuracy_score(y_true, y_pred)
+            summary["progressive_f1_macro"] = f1_score(
+                y_true, y_pred, average="macro", zero_division=0
+            )
+        return summary
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        return self.model.predict_proba(self.vectorize(texts))
+
+    def score_stream(self, chunks: Iterable):
+        """
+        Score a stream of (doc_ids, texts) chunks, yielding (doc_id, label, score)
+        """
+        for doc_ids, texts in chunks:
+            probs = self.predict_proba(texts)
+            best = probs.argmax(axis=1)
+            labels = self.model.classes_[best].tolist()
+            scores = probs[np.arange(len(best)), best].tolist()
+            yield from zip(doc_ids, labels, scores)
+
+    def log_to_mlflow(self, summary: dict, artifact_path: str = "triage_model"):
+        """
+        Log parameters, summary metrics and the fitted vectorizer + model (as an
+        sklearn Pipeline, so it can be served or loaded with `from_mlflow`) to the
+        active run
+        """
+        mlflow.log_params(
+            {
+                "model": self.model_name,
+                "n_features": self.vectorizer.n_features,
+                "ngram_range": str(self.vectorizer.ngram_range),
+                "classes": ",".join(map(str, self.classes)),
+            }
+        )
+        mlflow.log_metrics(summary)
+        pipeline = Pipeline([("vectorizer", self.vectorizer), ("model", self.model)])
+        return mlflow.sklearn.log_model(pipeline, artifact_path)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def write_predictions(
+    es_session,
+    index_name: str,
+    predictions: Iterable,
+    field_prefix: str = "triage",
+    model_version: Optional[str] = None,
+    chunk_size: int = 500,
+) -> int:
+    """
+    Write (doc_id, label, score) predictions back onto the source documents as
+    <prefix>_label, <prefix>_score and <prefix>_model fields
+    """
+    updates = (
+        (
+            doc_id,
+            {
+                f"{field_prefix}_label": label,
+                f"{field_prefix}_score": score,
+                f"{field_prefix}_model": model_version,
+            },
+        )
+        for doc_id, label, score in predictions
+    )
+    return es_session.bulk_update_documents(index_name, updates, chunk_size=chunk_size)
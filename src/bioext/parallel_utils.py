@@ -0,0 +1,81 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+
+def chunked(iterable: Iterable, size: int):
+    """
+    Yield lists of up to `size` items
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def map_batches(
+    items: Iterable,
+    process_batch: Callable[[list], list],
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+    n_jobs: Optional[int] = None,
+    batch_size: int = 500,
+):
+    """
+    Apply `process_batch` to batches of items across a process pool, yielding its
+    results in input order.
+
+    Args:
+        items: Iterable of inputs, read lazily.
+        process_batch: Picklable function taking a list of items and returning a
+            list of results.
+        initializer: Called with `initargs` once per worker process (or once in
+            this process if n_jobs is 1), e.g. to compile a matcher once per worker.
+        n_jobs: Worker processes; defaults to the number of CPUs.
+        batch_size: Items per call to process_batch.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    batches = chunked(items, batch_size)
+
+    if n_jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for batch in batches:
+            yield from process_batch(batch)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_jobs, initializer=initializer, initargs=initargs
+    ) as pool:
+        # bounded read-ahead keeps memory flat for large exports
+        pending = []
+        for batch in batches:
+            pending.append(pool.submit(process_batch, batch))
+            if len(pending) >= 2 * n_jobs:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+@contextmanager
+def sqlite_connection(path: str, autocommit: bool = False):
+    """
+    Connection to a SQLite file shared between processes, closed on exit. Waits up
+    to a minute for locks held by other writers.
+
+    By default the block runs as one transaction, committed on success and rolled
+    back on error. With `autocommit`, callers manage transactions themselves (e.g.
+    with BEGIN IMMEDIATE).
+    """
+    kwargs = {"isolation_level": None} if autocommit else {}
+    conn = sqlite3.connect(path, timeout=60, **kwargs)
+    try:
+        if autocommit:
+            yield conn
+        else:
+            with conn:
+                yield conn
+    finally:
+        conn.close()
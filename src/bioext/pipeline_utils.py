@@ -0,0 +1,402 @@
+import argparse
+import ast
+import functools
+import hashlib
+import importlib
+import importlib.metadata
+import inspect
+import json
+import os
+import shutil
+import sys
+import textwrap
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: str
+    inputs: list = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    version: str = ""
+    max_age_hours: Optional[float] = None
+
+
+def _bioext_version():
+    try:
+        return importlib.metadata.version("bioext")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _bioext_imports(tree, top_level_only=False):
+    """
+    Names of the bioext modules imported in a parsed source tree
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    nodes = tree.body if top_level_only else ast.walk(tree)
+    modules = set()
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            # "from bioext import codec_utils" imports a submodule
+            names = [node.module] + [f"{node.module}.{a.name}" for a in node.names]
+        else:
+            continue
+        for name in names:
+            package, _, module = name.partition(".")
+            module = module.split(".")[0]
+            if package == "bioext" and os.path.exists(
+                os.path.join(package_dir, f"{module}.py")
+            ):
+                modules.add(module)
+    return modules
+
+
+@functools.lru_cache(maxsize=None)
+def _module_source(module: str):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(package_dir, f"{module}.py"), encoding="utf-8") as f:
+        return f.read()
+
+
+def _bioext_dependencies(fn) -> dict:
+    """
+    Sources of the bioext modules a stage function uses, as {module: sha256}: the
+    ones imported in its body or at the top of its module, and everything those
+    import in turn. Only these are fingerprinted, so editing an unrelated helper
+    (e.g. the Parquet sink) does not re-run the query or extraction stages.
+    """
+    tree = ast.parse(textwrap.dedent(inspect.getsource(fn)))
+    pending = _bioext_imports(tree)
+    module_file = inspect.getsourcefile(fn)
+    if module_file:
+        with open(module_file, encoding="utf-8") as f:
+            pending |= _bioext_imports(ast.parse(f.read()), top_level_only=True)
+
+    hashes = {}
+    while pending:
+        module = pending.pop()
+        if module in hashes:
+            continue
+        source = _module_source(module)
+        hashes[module] = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        pending |= _bioext_imports(ast.parse(source)) - hashes.keys()
+    return hashes
+
+
+def _resolve(fn_ref: str):
+    module_name, _, attr = fn_ref.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _init_worker(search_path):
+    if search_path and search_path not in sys.path:
+        sys.path.insert(0, search_path)
+
+
+def _run_stage(fn_ref, inputs, output_dir, params):
+    start = time.perf_counter()
+    _resolve(fn_ref)(inputs, output_dir, **params)
+    return time.perf_counter() - start
+
+
+def hash_directory(path: str) -> str:
+    """
+    Content hash of all files in a folder, independent of modification times
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+            with open(file_path, "rb") as f:
+                while block := f.read(1 << 20):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    def __init__(
+        self,
+        stages: list[Stage],
+        cache_dir: str,
+        max_workers: Optional[int] = None,
+        search_path: Optional[str] = None,
+    ) -> None:
+        """
+        Runs a graph of stages with cached, content-addressed outputs.
+
+        Each stage is a function `fn(inputs, output_dir, **params)`, referenced as
+        "module:function", that reads the output folders of its upstream stages
+        (`inputs`, a dict of {stage name: folder}) and writes into `output_dir`.
+
+        A stage's fingerprint covers its function source, params, `version`, the
+        bioext version, the sources of the bioext modules the stage imports, and the
+        content hash of every input, so editing a bioext helper re-runs only the
+        stages that use it. Bump a stage's `version` when other code it calls
+        changes. If an output with the same fingerprint exists,
+        the stage is skipped. Because inputs are identified by content, a
+        stage that re-runs but produces identical output (e.g. a query returning
+        the same documents) does not invalidate anything downstream, and changing
+        a downstream stage never re-runs the upstream ones.
+
+        Stages that read external state (e.g. an Elasticsearch query) can set
+        `max_age_hours`, after which their cached output is refreshed.
+
+        Independent stages run in parallel in a process pool. Outputs are written
+        to a temporary folder and renamed into place on success, so an interrupted
+        run never leaves a partial output that looks complete.
+
+        Args:
+            stages: Stages in any order; `inputs` name upstream stages.
+            cache_dir: Root folder for stage outputs.
+            max_workers: Maximum number of stages running at once.
+            search_path: Folder added to sys.path to import stage functions from.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.search_path = search_path
+        _init_worker(search_path)
+
+        for stage in stages:
+            for upstream in stage.inputs:
+                if upstream not in self.stages:
+                    raise ValueError(f"Stage {stage.name} has unknown input {upstream}")
+        self.order = self._topological_order()
+
+    @classmethod
+    def from_config(cls, config_path: str, max_workers: Optional[int] = None):
+        """
+        Build a pipeline from a JSON config:
+            {
+                "cache_dir": "outputs/.cache",
+                "max_workers": 4,
+                "stages": {
+                    "query": {"fn": "stages:es_export", "params": {...}},
+                    "extract": {"fn": "stages:llm_extract", "inputs": ["query"]}
+                }
+            }
+        Relative paths and stage modules resolve against the config's folder.
+        """
+        with open(config_path) as f:
+            config = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(config_path))
+        stages = [Stage(name=name, **spec) for name, spec in config["stages"].items()]
+        return cls(
+            stages,
+            cache_dir=os.path.join(base_dir, config.get("cache_dir", ".pipeline")),
+            max_workers=max_workers or config.get("max_workers"),
+            search_path=base_dir,
+        )
+
+    def _topological_order(self):
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for upstream in self.stages[name].inputs:
+                visit(upstream, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def _required(self, targets):
+        required = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in required:
+                required.add(name)
+                stack.extend(self.stages[name].inputs)
+        return required
+
+    def fingerprint(self, stage: Stage, input_hashes: dict) -> str:
+        fn = _resolve(stage.fn)
+        try:
+            source = inspect.getsource(fn)
+            dependencies = _bioext_dependencies(fn)
+        except (OSError, TypeError):
+            source, dependencies = stage.fn, {}
+        key = {
+            "fn": stage.fn,
+            "source": source,
+            "params": stage.params,
+            "version": stage.version,
+            "bioext": _bioext_version(),
+            "bioext_modules": dependencies,
+            "inputs": input_hashes,
+        }
+        encoded = json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def _stage_dir(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _manifest(self, name, fingerprint):
+        path = os.path.join(self._stage_dir(name), fingerprint, "_manifest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def output_path(self, name: str) -> Optional[str]:
+        """
+        Folder holding the most recent successful output of a stage
+        """
+        latest = os.path.join(self._stage_dir(name), "LATEST")
+        if not os.path.exists(latest):
+            return None
+        with open(latest) as f:
+            return os.path.join(self._stage_dir(name), f.read().strip())
+
+    def _is_fresh(self, stage, manifest):
+        if manifest is None:
+            return False
+        if stage.max_age_hours is None:
+            return True
+        return time.time() - manifest["finished_at"] < 3600 * stage.max_age_hours
+
+    def _finish(self, stage, fingerprint, tmp_dir, input_hashes, elapsed):
+        final_dir = os.path.join(self._stage_dir(stage.name), fingerprint)
+        output_hash = hash_directory(tmp_dir)
+        manifest = {
+            "stage": stage.name,
+            "fingerprint": fingerprint,
+            "params": stage.params,
+            "inputs": input_hashes,
+            "output_hash": output_hash,
+            "elapsed_s": elapsed,
+            "finished_at": time.time(),
+        }
+        with open(os.path.join(tmp_dir, "_manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        if os.path.exists(final_dir):
+            # an expired output being refreshed
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+        self._set_latest(stage.name, fingerprint)
+        return manifest
+
+    def _set_latest(self, name, fingerprint):
+        latest = os.path.join(self._stage_dir(name), "LATEST")
+        with open(latest + ".tmp", "w") as f:
+            f.write(fingerprint)
+        os.replace(latest + ".tmp", latest)
+
+    def run(self, targets: Optional[list] = None, force: tuple = ()) -> dict:
+        """
+        Run the stages needed for `targets` (default: all), skipping stages whose
+        cached output is still valid.
+
+        Args:
+            targets: Stage names to bring up to date, with their upstream stages.
+            force: Stage names to re-run even if cached.
+
+        Returns:
+            dict of {stage name: "cached" | "ran" | "failed" | "blocked"}.
+        """
+        required = self._required(targets or list(self.stages))
+        pending = [name for name in self.order if name in required]
+        status, output_hashes, running = {}, {}, {}
+
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.search_path,),
+        ) as pool:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    upstream = [status.get(u) for u in stage.inputs]
+                    if any(s in ("failed", "blocked") for s in upstream):
+                        status[name] = "blocked"
+                        pending.remove(name)
+                        print(f"[{name}] blocked by a failed upstream stage")
+                        continue
+                    if not all(s in ("cached", "ran") for s in upstream):
+                        continue
+
+                    pending.remove(name)
+                    input_hashes = {u: output_hashes[u] for u in stage.inputs}
+                    fingerprint = self.fingerprint(stage, input_hashes)
+                    manifest = self._manifest(name, fingerprint)
+                    if name not in force and self._is_fresh(stage, manifest):
+                        status[name] = "cached"
+                        output_hashes[name] = manifest["output_hash"]
+                        self._set_latest(name, fingerprint)
+                        print(f"[{name}] cached ({fingerprint})")
+                        continue
+
+                    tmp_dir = os.path.join(
+                        self._stage_dir(name), f".tmp-{fingerprint}-{os.getpid()}"
+                    )
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    os.makedirs(tmp_dir)
+                    inputs = {
+                        u: os.path.join(self._stage_dir(u), self._latest_name(u))
+                        for u in stage.inputs
+                    }
+                    print(f"[{name}] running ({fingerprint})")
+                    future = pool.submit(
+                        _run_stage, stage.fn, inputs, tmp_dir, stage.params
+                    )
+                    running[future] = (name, fingerprint, tmp_dir, input_hashes)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint, tmp_dir, input_hashes = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                    except Exception as e:
+                        status[name] = "failed"
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                        print(f"[{name}] failed: {e!r}")
+                        continue
+                    manifest = self._finish(
+                        self.stages[name], fingerprint, tmp_dir, input_hashes, elapsed
+                    )
+                    status[name] = "ran"
+                    output_hashes[name] = manifest["output_hash"]
+                    print(f"[{name}] done in {elapsed:.1f}s")
+
+        return status
+
+    def _latest_name(self, name):
+        with open(os.path.join(self._stage_dir(name), "LATEST")) as f:
+            return f.read().strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a bioext pipeline config")
+    parser.add_argument("config", help="Path to pipeline JSON config")
+    parser.add_argument(
+        "-t", "--targets", nargs="*", default=None, help="Stages to bring up to date"
+    )
+    parser.add_argument(
+        "-f", "--force", nargs="*", default=(), help="Stages to re-run even if cached"
+    )
+    parser.add_argument("-w", "--max_workers", type=int, default=None)
+    args = parser.parse_args()
+
+    pipeline = Pipeline.from_config(args.config, max_workers=args.max_workers)
+    status = pipeline.run(targets=args.targets, force=tuple(args.force))
+    print(json.dumps(status, indent=2))
+    if any(s in ("failed", "blocked") for s in status.values()):
+        sys.exit(1)
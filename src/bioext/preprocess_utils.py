@@ -0,0 +1,550 @@
+import json
+import math
+import re
+import unicodedata
+from bisect import bisect_right
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from bioext.parallel_utils import map_batches
+
+# lines dropped wherever they occur: letterhead, page furniture and routing
+DEFAULT_BOILERPLATE = [
+    r"page \d+(?: of \d+)?",
+    r"(?:strictly )?(?:private (?:and|&) )?confidential",
+    r"(?:tel|telephone|fax|switchboard|direct line|bleep)\b[^\n]*\d{3}[^\n]*",
+    r"e-?mail\s*:?\s*\S+@\S+",
+    r"(?:www\.|https?://)\S+",
+    r"(?:nhs|hospital|mrn|unit|patient) (?:no|number)\b[^\n]*",
+    r"(?:dictated|typed|transcribed|verified|authori[sz]ed)(?: by| on|:)[^\n]*",
+    r"(?:date )?(?:dictated|typed)\s*:[^\n]*",
+    r"(?:cc|copy to|copies to)\s*:[^\n]*",
+]
+
+# a sign-off on its own line starts the signature block, which runs to the end
+DEFAULT_SIGNOFFS = [
+    r"yours (?:sincerely|faithfully|truly)",
+    r"(?:kind|best|warm|with best|with kind)(?: regards| wishes)",
+    r"regards",
+]
+
+DEFAULT_SECTIONS = [
+    {
+        "name": "diagnosis",
+        "headings": [r"(?:primary |oncological )?diagnos[ie]s", r"impression"],
+    },
+    {
+        "name": "history",
+        "headings": [
+            r"history(?: of presenting complaint)?",
+            r"hpc",
+            r"background",
+            r"(?:oncology|oncological|cancer) history",
+            r"past (?:medical )?history",
+            r"pmh",
+        ],
+    },
+    {
+        "name": "investigations",
+        "headings": [
+            r"investigations?",
+            r"results?",
+            r"imaging",
+            r"histology",
+            r"(?:histo)?pathology",
+            r"bloods",
+        ],
+    },
+    {
+        "name": "treatment",
+        "headings": [
+            r"treatment(?: summary| history)?",
+            r"management",
+            r"current (?:treatment|medications?)",
+            r"medications?",
+            r"drug history",
+        ],
+    },
+    {"name": "examination", "headings": [r"(?:on )?examination", r"o/e"]},
+    {
+        "name": "social",
+        "headings": [r"social(?: history)?", r"family history", r"sh", r"fh"],
+    },
+    {
+        "name": "summary",
+        "headings": [
+            r"(?:clinical )?summary",
+            r"current situation",
+            r"(?:mdt|mdm)(?: outcome| discussion)?",
+            r"outcome",
+        ],
+    },
+    {
+        "name": "plan",
+        "headings": [r"plan", r"recommendations?", r"actions?", r"follow[ -]?up"],
+    },
+]
+
+PREAMBLE = "preamble"
+
+_NEWLINE = r"(?:\r\n|\r(?!\n)|\n)"
+_WHITESPACE = "[ \t\f\v\r\n\u00a0\u200b]"
+
+# UTF-8 text that was decoded as cp1252 somewhere upstream
+_MOJIBAKE = {
+    "â€™": "'",
+    "â€˜": "'",
+    "â€œ": '"',
+    "â€\u009d": '"',
+    "â€“": "-",
+    "â€”": "-",
+    "â€¦": "...",
+    "â€¢": "-",
+    "Â£": "£",
+    "Â°": "°",
+    "Âµ": "µ",
+    "Â\u00a0": " ",
+    "Ã©": "é",
+}
+
+_PUNCTUATION = {
+    "‘": "'",
+    "’": "'",
+    "‚": "'",
+    "‛": "'",
+    "“": '"',
+    "”": '"',
+    "„": '"',
+    "‟": '"',
+    "‐": "-",
+    "‑": "-",
+    "‒": "-",
+    "–": "-",
+    "—": "-",
+    "―": "-",
+    "−": "-",
+    "•": "-",
+    "…": "...",
+}
+
+_COMPAT = r"\u00bc-\u00be\u2150-\u218b\ufb00-\ufb06\uff01-\uff5e"
+_INVISIBLE = r"\u200b-\u200d\u2060\ufeff\u00ad"
+
+# one pass over each kept region finds every edit. The leading lookahead lets the
+# regex engine skip ordinary text without trying each branch at every position.
+_EDIT_RE = re.compile(
+    "(?=["
+    + re.escape("".join({k[0] for k in _MOJIBAKE} | set(_PUNCTUATION)))
+    + rf" \t\f\v\r\n\u00a0{_INVISIBLE}{_COMPAT}])(?:"
+    + "|".join(
+        [
+            # any whitespace run except a lone space or newline
+            rf"(?P<space>{_WHITESPACE}{{2,}}|[\t\f\v\r\u00a0])",
+            rf"(?P<invisible>[{_INVISIBLE}]+)",
+            "(?P<mojibake>"
+            + "|".join(re.escape(k) for k in sorted(_MOJIBAKE, key=len, reverse=True))
+            + ")",
+            "(?P<punctuation>[" + "".join(_PUNCTUATION) + "])",
+            # ligatures, fullwidth forms, roman numerals and vulgar fractions
+            rf"(?P<compat>[{_COMPAT}]+)",
+        ]
+    )
+    + ")"
+)
+
+
+def _replacement(m):
+    kind = m.lastgroup
+    if kind == "space":
+        run = m.group().replace("\u200b", "")
+        if not run:
+            return ""
+        n_lines = run.count("\n") + run.count("\r") - run.count("\r\n")
+        return " " if n_lines == 0 else "\n" if n_lines == 1 else "\n\n"
+    if kind == "invisible":
+        return ""
+    if kind == "mojibake":
+        return _MOJIBAKE[m.group()]
+    if kind == "punctuation":
+        return _PUNCTUATION[m.group()]
+    return unicodedata.normalize("NFKC", m.group())
+
+
+@dataclass
+class Section:
+    name: str
+    heading: str
+    start: int
+    end: int
+    orig_start: int
+    orig_end: int
+
+
+@dataclass
+class PreprocessResult:
+    doc_id: str
+    text: str
+    original_length: int
+    sections: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    # (clean_start, clean_end, orig_start, orig_end) runs covering `text`
+    offsets: list = field(default_factory=list)
+
+    def to_original(self, start: int, end: int) -> tuple[int, int]:
+        """
+        Map a span of the cleaned text to the matching span of the original text
+        """
+        if end <= start:
+            pos = self._to_original(start, is_end=False)
+            return pos, pos
+        return self._to_original(start, False), self._to_original(end, True)
+
+    def _to_original(self, pos, is_end):
+        if not self.offsets:
+            return 0
+        if is_end:
+            pos -= 1
+        i = max(bisect_right(self.offsets, (pos, math.inf)) - 1, 0)
+        clean_start, clean_end, orig_start, orig_end = self.offsets[i]
+        if pos >= clean_end:
+            return orig_end
+        if clean_end - clean_start == orig_end - orig_start:
+            return orig_start + pos - clean_start + int(is_end)
+        # a replaced run (e.g. collapsed whitespace) maps as a whole
+        return orig_end if is_end else orig_start
+
+    def section_text(self, *names: str) -> str:
+        """
+        Text of the named sections, in document order
+        """
+        return "\n\n".join(
+            self.text[s.start : s.end].strip() for s in self.sections if s.name in names
+        )
+
+    def to_dict(self):
+        return {
+            "doc_id": self.doc_id,
+            "text": self.text,
+            "original_length": self.original_length,
+            "sections": [s.__dict__ for s in self.sections],
+            "removed": self.removed,
+            "offsets": self.offsets,
+        }
+
+
+class TextPreprocessor:
+    def __init__(
+        self,
+        boilerplate: Optional[list] = None,
+        signoffs: Optional[list] = None,
+        sections: Optional[list] = None,
+        max_signature_chars: int = 600,
+    ) -> None:
+        """
+        Cleans and segments clinical letters before annotation or extraction.
+
+        Boilerplate lines (letterhead, page numbers, contact details, routing) and
+        the signature block after the last sign-off are removed, whitespace is
+        collapsed, and common encoding damage (mojibake, smart punctuation,
+        ligatures, invisible characters) is normalised. The cleaned text is then
+        split into sections at heading lines such as "Diagnosis:" or "Plan".
+
+        All patterns are compiled once into combined regexes, and normalisation is
+        a single pass over the text. The result records which runs of the cleaned
+        text came from which runs of the original, so that offsets of sections,
+        annotations or extracted spans can be mapped back with `to_original`.
+
+        Args:
+            boilerplate: Case-insensitive regexes matching whole lines to drop.
+            signoffs: Case-insensitive regexes matching a sign-off line. Everything
+                from the last sign-off to the end is dropped, if it is shorter than
+                `max_signature_chars`.
+            sections: list of {"name", "headings"} dicts, where headings are
+                case-insensitive regexes. A heading must start a line and be
+                followed by a colon, a dash or the end of the line.
+            max_signature_chars: Longest tail that is treated as a signature block.
+        """
+        self.boilerplate = DEFAULT_BOILERPLATE if boilerplate is None else boilerplate
+        self.signoffs = DEFAULT_SIGNOFFS if signoffs is None else signoffs
+        self.sections = DEFAULT_SECTIONS if sections is None else sections
+        self.max_signature_chars = max_signature_chars
+
+        self._boilerplate_re = self._line_regex(self.boilerplate)
+        self._signoff_re = self._line_regex(self.signoffs, r",?")
+
+        heading_parts = []
+        self._heading_groups = {}
+        for section in self.sections:
+            for pattern in section["headings"]:
+                # validate each pattern on its own for a clearer error message
+                re.compile(pattern)
+                group = f"h{len(self._heading_groups)}"
+                self._heading_groups[group] = section["name"]
+                heading_parts.append(f"(?P<{group}>{pattern})")
+        self._heading_re = (
+            re.compile(
+                rf"^[ \t]*(?:\d+[.)][ \t]*)?(?:{'|'.join(heading_parts)})"
+                r"[ \t]*(?::|-(?=[ \t])|$)",
+                re.IGNORECASE | re.MULTILINE,
+            )
+            if heading_parts
+            else None
+        )
+
+    @staticmethod
+    def _line_regex(patterns, suffix=""):
+        if not patterns:
+            return None
+        for pattern in patterns:
+            re.compile(pattern)
+        return re.compile(
+            rf"^[ \t]*(?:{'|'.join(patterns)}){suffix}[ \t]*(?:{_NEWLINE}|$)",
+            re.IGNORECASE | re.MULTILINE,
+        )
+
+    @classmethod
+    def from_config(cls, preprocess_cfg: Optional[dict] = None):
+        preprocess_cfg = preprocess_cfg or {}
+        return cls(
+            boilerplate=preprocess_cfg.get("boilerplate"),
+            signoffs=preprocess_cfg.get("signoffs"),
+            sections=preprocess_cfg.get("sections"),
+            max_signature_chars=preprocess_cfg.get("max_signature_chars", 600),
+        )
+
+    def _removed_spans(self, text):
+        spans = []
+        if self._boilerplate_re is not None:
+            spans.extend(
+                ("boilerplate", m.start(), m.end())
+                for m in self._boilerplate_re.finditer(text)
+            )
+        if self._signoff_re is not None:
+            last = None
+            for last in self._signoff_re.finditer(text):
+                pass
+            if last is not None and len(text) - last.start() <= self.max_signature_chars:
+                spans.append(("signature", last.start(), len(text)))
+
+        merged = []
+        for kind, start, end in sorted(spans, key=lambda s: s[1]):
+            # take the blank lines after a removed line with it
+            while end < len(text) and text[end].isspace():
+                end += 1
+            if merged and start <= merged[-1][2]:
+                merged[-1][2] = max(merged[-1][2], end)
+            else:
+                merged.append([kind, start, end])
+        return [tuple(span) for span in merged]
+
+    def process(self, doc_id, text: str) -> PreprocessResult:
+        removed = self._removed_spans(text)
+
+        # pieces of cleaned text: (clean_text, orig_start, orig_end)
+        pieces = []
+        pos = 0
+        for _, start, end in removed + [(None, len(text), len(text))]:
+            last = pos
+            for m in _EDIT_RE.finditer(text, pos, start):
+                replacement = _replacement(m)
+                if replacement == m.group():
+                    continue
+                if m.start() > last:
+                    pieces.append((text[last : m.start()], last, m.start()))
+                pieces.append((replacement, m.start(), m.end()))
+                last = m.end()
+            if start > last:
+                pieces.append((text[last:start], last, start))
+            pos = max(pos, end)
+
+        pieces = _strip_pieces([p for p in pieces if p[0]])
+
+        offsets = []
+        chunks = []
+        clean_pos = 0
+        for piece, orig_start, orig_end in pieces:
+            clean_end = clean_pos + len(piece)
+            previous = offsets[-1] if offsets else None
+            if (
+                previous is not None
+                and previous[3] == orig_start
+                and previous[1] - previous[0] == previous[3] - previous[2]
+                and len(piece) == orig_end - orig_start
+            ):
+                # extend a run of one-to-one characters
+                offsets[-1] = (previous[0], clean_end, previous[2], orig_end)
+            else:
+                offsets.append((clean_pos, clean_end, orig_start, orig_end))
+            chunks.append(piece)
+            clean_pos = clean_end
+
+        result = PreprocessResult(
+            doc_id=doc_id,
+            text="".join(chunks),
+            original_length=len(text),
+            removed=[list(span) for span in removed],
+            offsets=offsets,
+        )
+        result.sections = self._segment(result)
+        return result
+
+    def _segment(self, result):
+        text = result.text
+        headings = []
+        if self._heading_re is not None:
+            headings = [
+                (m.start(), self._heading_groups[m.lastgroup], m.group().strip())
+                for m in self._heading_re.finditer(text)
+            ]
+        if not headings or text[: headings[0][0]].strip():
+            headings.insert(0, (0, PREAMBLE, ""))
+
+        sections = []
+        for i, (start, name, heading) in enumerate(headings):
+            end = headings[i + 1][0] if i + 1 < len(headings) else len(text)
+            # trailing whitespace belongs to the gap, not the section
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end <= start:
+                continue
+            orig_start, orig_end = result.to_original(start, end)
+            sections.append(Section(name, heading, start, end, orig_start, orig_end))
+        return sections
+
+
+def _strip_pieces(pieces):
+    """
+    Drop leading and trailing whitespace from a list of cleaned pieces
+    """
+    while pieces and not pieces[0][0].strip():
+        pieces.pop(0)
+    while pieces and not pieces[-1][0].strip():
+        pieces.pop()
+    if not pieces:
+        return pieces
+
+    # replaced pieces are either whitespace or have none at their edges
+    piece, orig_start, orig_end = pieces[0]
+    trimmed = len(piece) - len(piece.lstrip())
+    if trimmed:
+        pieces[0] = (piece[trimmed:], orig_start + trimmed, orig_end)
+    piece, orig_start, orig_end = pieces[-1]
+    trimmed = len(piece) - len(piece.rstrip())
+    if trimmed:
+        pieces[-1] = (piece[: len(piece) - trimmed], orig_start, orig_end - trimmed)
+    return pieces
+
+
+# per-process preprocessor, built by the pool initializer
+_worker_preprocessor = None
+
+
+def _init_worker(preprocess_cfg):
+    global _worker_preprocessor
+    _worker_preprocessor = TextPreprocessor.from_config(preprocess_cfg)
+
+
+def _process_batch(batch):
+    return [_worker_preprocessor.process(doc_id, text) for doc_id, text in batch]
+
+
+def preprocess_documents(
+    documents: Iterable,
+    preprocess_cfg: Optional[dict] = None,
+    n_jobs: Optional[int] = None,
+    batch_size: int = 500,
+):
+    """
+    Clean and segment (doc_id, text) pairs across a process pool.
+
+    Yields PreprocessResult objects in input order.
+    """
+    return map_batches(
+        documents,
+        _process_batch,
+        initializer=_init_worker,
+        initargs=(preprocess_cfg,),
+        n_jobs=n_jobs,
+        batch_size=batch_size,
+    )
+
+
+def run_preprocess(
+    documents: Iterable,
+    preprocess_cfg: Optional[dict] = None,
+    output_file: Optional[str] = None,
+    n_jobs: Optional[int] = None,
+    estimator=None,
+    batch_size: int = 500,
+) -> dict:
+    """
+    Preprocess documents, optionally writing results as JSON lines, and return a
+    summary of the characters and tokens removed and the sections found.
+
+    Args:
+        documents: Iterable of (doc_id, text) pairs.
+        preprocess_cfg: Config passed to TextPreprocessor.from_config.
+        output_file: JSON lines file for PreprocessResult.to_dict() records.
+        n_jobs: Worker processes; defaults to the number of CPUs.
+        estimator: extraction_utils.TokenEstimator used to count tokens before and
+            after preprocessing; defaults to the character based approximation.
+        batch_size: Documents per worker batch.
+    """
+    if estimator is None:
+        from bioext.extraction_utils import TokenEstimator
+
+        estimator = TokenEstimator()
+
+    # originals are only held for batches still in the pool's read-ahead
+    originals = deque()
+
+    def _tap(docs):
+        for doc_id, text in docs:
+            originals.append(text)
+            yield doc_id, text
+
+    n_docs = chars_in = chars_out = tokens_in = tokens_out = 0
+    section_counts = Counter()
+    removed_counts = Counter()
+    before, after = [], []
+
+    def _count():
+        nonlocal tokens_in, tokens_out
+        tokens_in += sum(estimator.count_batch(before))
+        tokens_out += sum(estimator.count_batch(after))
+        before.clear()
+        after.clear()
+
+    out = open(output_file, "w") if output_file else None
+    try:
+        for result in preprocess_documents(
+            _tap(documents), preprocess_cfg, n_jobs=n_jobs, batch_size=batch_size
+        ):
+            original = originals.popleft()
+            n_docs += 1
+            chars_in += len(original)
+            chars_out += len(result.text)
+            section_counts.update({s.name for s in result.sections})
+            removed_counts.update(kind for kind, _, _ in result.removed)
+            before.append(original)
+            after.append(result.text)
+            if len(before) >= batch_size:
+                _count()
+            if out:
+                out.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+        _count()
+    finally:
+        if out:
+            out.close()
+
+    return {
+        "documents": n_docs,
+        "chars_in": chars_in,
+        "chars_out": chars_out,
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "token_reduction": 1 - tokens_out / tokens_in if tokens_in else 0.0,
+        "document_counts": dict(section_counts),
+        "removed_counts": dict(removed_counts),
+    }
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+from bioext import codec_utils
+
+DEFAULT_PROMPT_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+SCHEMA_PLACEHOLDER = "{{schema}}"
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    version: str
+    system_prompt: str
+    schema: Optional[dict] = None
+    prompt_hash: str = field(init=False)
+
+    def __post_init__(self):
+        digest = hashlib.sha256(self.system_prompt.encode("utf-8")).hexdigest()
+        object.__setattr__(self, "prompt_hash", digest)
+
+    @property
+    def short_hash(self):
+        return self.prompt_hash[:12]
+
+    def build_messages(self, user_content: str) -> list[dict]:
+        """
+        Chat messages with the static system prompt first, so that every request
+        shares a byte-identical prefix that the server can reuse from its prefix cache
+        """
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def build_payload(self, user_content: str, model: str = "model", **params) -> dict:
+        """
+        OpenAI-compatible chat completion payload. Extra keyword arguments (e.g.
+        temperature, max_tokens) are added after the messages.
+        """
+        payload = {"model": model, "messages": self.build_messages(user_content)}
+        payload.update(params)
+        return payload
+
+    def encode_payload(self, user_content: str, model: str = "model", **params):
+        """
+        Serialised request body. Uses a fixed separator style so the encoded prefix is
+        identical across calls and scripts.
+        """
+        payload = self.build_payload(user_content, model=model, **params)
+        return codec_utils.dumps(payload)
+
+    def provenance(self) -> dict:
+        """
+        Metadata to store alongside extraction outputs
+        """
+        return {
+            "prompt_name": self.name,
+            "prompt_version": self.version,
+            "prompt_hash": self.prompt_hash,
+        }
+
+
+class PromptRegistry:
+    def __init__(self, root: Optional[str] = None) -> None:
+        """
+        File-backed registry of versioned system prompts and extraction schemas.
+
+        Prompts are stored as <root>/<name>/<version>/system_prompt.txt with an optional
+        schema.json. A `{{schema}}` placeholder in the prompt text is replaced by the
+        compact JSON form of the schema when the prompt is loaded, so the schema only
+        needs to be maintained in one place.
+
+        Args:
+            root: Directory containing prompts; defaults to prompts shipped with bioext.
+        """
+        self.root = root or DEFAULT_PROMPT_DIR
+        self._cache = {}
+
+    def list_prompts(self) -> dict:
+        """
+        Returns dict of {prompt name: [versions, oldest first]}
+        """
+        prompts = {}
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                prompts[name] = sorted(os.listdir(path), key=_version_key)
+        return prompts
+
+    def get(self, name: str, version: Optional[str] = None) -> Prompt:
+        """
+        Load a prompt by name, defaulting to its latest version
+        """
+        if version is None:
+            versions = self.list_prompts().get(name)
+            if not versions:
+                raise KeyError(f"No prompt named {name} in {self.root}")
+            version = versions[-1]
+
+        if (name, version) not in self._cache:
+            self._cache[(name, version)] = self._load(name, version)
+        return self._cache[(name, version)]
+
+    def register(
+        self, name: str, version: str, system_prompt: str, schema: Optional[dict] = None
+    ) -> Prompt:
+        """
+        Save a new prompt version. Existing versions are never overwritten, so that
+        a prompt hash always refers to the same text.
+        """
+        path = os.path.join(self.root, name, version)
+        if os.path.exists(path):
+            raise FileExistsError(f"Prompt {name} version {version} already exists")
+
+        os.makedirs(path)
+        with open(os.path.join(path, "system_prompt.txt"), "w", newline="\n") as f:
+            f.write(system_prompt)
+        if schema is not None:
+            with open(os.path.join(path, "schema.json"), "w") as f:
+                json.dump(schema, f, indent=2, ensure_ascii=False)
+                f.write("\n")
+
+        return self.get(name, version)
+
+    def _load(self, name, version):
+        path = os.path.join(self.root, name, version)
+        with open(os.path.join(path, "system_prompt.txt"), "r", newline="") as f:
+            # normalise line endings so checkouts on any OS give the same bytes
+            template = f.read().replace("\r\n", "\n")
+
+        schema = None
+        schema_path = os.path.join(path, "schema.json")
+        if os.path.exists(schema_path):
+            with open(schema_path, "r") as f:
+                schema = json.load(f)
+
+        system_prompt = template
+        if SCHEMA_PLACEHOLDER in template:
+            if schema is None:
+                raise ValueError(f"Prompt {name}/{version} expects a schema.json")
+            compact = json.dumps(schema, ensure_ascii=False, separators=(",", ":"))
+            system_prompt = template.replace(SCHEMA_PLACEHOLDER, compact)
+
+        return Prompt(name, version, system_prompt, schema)
+
+
+def _version_key(version):
+    return [int(p) if p.isdigit() else p for p in version.replace("-", ".").split(".")]
@@ -0,0 +1,335 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from bioext.parallel_utils import sqlite_connection
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    job TEXT NOT NULL,
+    unit_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated REAL,
+    PRIMARY KEY (job, unit_id)
+);
+CREATE INDEX IF NOT EXISTS units_status ON units (job, status, lease_expires);
+"""
+
+
+@dataclass
+class WorkUnit:
+    job: str
+    unit_id: str
+    payload: dict
+    lease_token: str
+    attempts: int
+
+
+class WorkQueue:
+    def __init__(
+        self, path: str, lease_seconds: float = 600, max_attempts: int = 3
+    ) -> None:
+        """
+        Work queue for sharding a job across worker processes on any number of
+        nodes, backed by a single SQLite file on local or shared storage.
+
+        A job is split into units (e.g. Elasticsearch slices, ID ranges or export
+        shards). Workers claim a unit under a time-limited lease and extend it with
+        heartbeats while working. If a worker crashes, its lease expires and the
+        unit is claimed by another worker. Completing a unit requires the current
+        lease token, so a unit is committed exactly once even if a slow worker
+        finishes after its lease was taken over; processing itself should
+        therefore be idempotent (e.g. upserts keyed on document ID).
+
+        Claims run in an immediate transaction, so SQLite's file lock serialises
+        them. The default rollback journal is used rather than WAL, which does not
+        work on network filesystems.
+
+        Args:
+            path: SQLite database file; created if missing.
+            lease_seconds: How long a claim lasts without a heartbeat.
+            max_attempts: Claims per unit before it is marked as failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # transactions are opened explicitly, see _transaction
+        return sqlite_connection(self.path, autocommit=True)
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add_units(self, job: str, units: Iterable) -> int:
+        """
+        Add (unit_id, payload) pairs to a job. Units that already exist are left
+        untouched, so partitioning a job twice is harmless.
+
+        Returns:
+            Number of units added.
+        """
+        now = time.time()
+        rows = [(job, str(uid), json.dumps(payload), now) for uid, payload in units]
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO units (job, unit_id, payload, updated) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def claim(self, job: str, worker: str) -> Optional[WorkUnit]:
+        """
+        Lease the next pending unit, or a unit whose lease has expired
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT unit_id, payload, attempts FROM units WHERE job = ? AND "
+                    "(status = 'pending' OR "
+                    "(status = 'leased' AND lease_expires < ?)) "
+                    "ORDER BY attempts, rowid LIMIT 1",
+                    (job, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                unit_id, payload, attempts = row
+                if attempts < self.max_attempts:
+                    break
+                # the lease expired on the final attempt: give up on the unit
+                conn.execute(
+                    "UPDATE units SET status = 'failed', lease_token = NULL, "
+                    "error = ?, updated = ? WHERE job = ? AND unit_id = ?",
+                    ("lease expired on final attempt", now, job, unit_id),
+                )
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE units SET status = 'leased', worker = ?, lease_token = ?, "
+                "lease_expires = ?, attempts = attempts + 1, updated = ? "
+                "WHERE job = ? AND unit_id = ?",
+                (worker, token, now + self.lease_seconds, now, job, unit_id),
+            )
+        return WorkUnit(job, unit_id, json.loads(payload), token, attempts + 1)
+
+    def _update_leased(self, unit: WorkUnit, assignments: str, values: tuple) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE units SET {assignments}, updated = ? WHERE job = ? AND "
+                "unit_id = ? AND status = 'leased' AND lease_token = ?",
+                (*values, time.time(), unit.job, unit.unit_id, unit.lease_token),
+            )
+            return cursor.rowcount == 1
+
+    def heartbeat(self, unit: WorkUnit) -> bool:
+        """
+        Extend a lease. Returns False if the lease was lost to another worker.
+        """
+        expires = time.time() + self.lease_seconds
+        return self._update_leased(unit, "lease_expires = ?", (expires,))
+
+    def complete(self, unit: WorkUnit, result=None) -> bool:
+        """
+        Commit a unit as done. Returns False, and commits nothing, if the lease
+        was lost to another worker.
+        """
+        return self._update_leased(
+            unit,
+            "status = 'done', lease_token = NULL, result = ?",
+            (json.dumps(result),),
+        )
+
+    def fail(self, unit: WorkUnit, error: str) -> bool:
+        """
+        Release a unit after an error: it is retried by any worker until
+        max_attempts is reached, then marked as failed
+        """
+        status = "failed" if unit.attempts >= self.max_attempts else "pending"
+        return self._update_leased(
+            unit, "status = ?, lease_token = NULL, error = ?", (status, error)
+        )
+
+    def reset_failed(self, job: str) -> int:
+        """
+        Return failed units to the queue with their attempts reset
+        """
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE units SET status = 'pending', attempts = 0 "
+                "WHERE job = ? AND status = 'failed'",
+                (job,),
+            ).rowcount
+
+    def status(self, job: str) -> dict:
+        """
+        Number of units per status, with expired leases counted as pending
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT CASE WHEN status = 'leased' AND lease_expires < ? "
+                "THEN 'pending' ELSE status END AS s, COUNT(*) FROM units "
+                "WHERE job = ? GROUP BY s",
+                (time.time(), job),
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self, job: str) -> dict:
+        """
+        Results of completed units, by unit ID
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT unit_id, result FROM units WHERE job = ? AND status = 'done'",
+                (job,),
+            ).fetchall()
+        return {unit_id: json.loads(result) for unit_id, result in rows}
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue: WorkQueue, unit: WorkUnit, interval: float):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.unit = unit
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.unit):
+                    self.lost.set()
+                    return
+            except sqlite3.OperationalError as e:
+                # transient lock contention; the lease has slack for a retry
+                print(f"Heartbeat for {self.unit.unit_id} failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_worker(
+    queue: WorkQueue,
+    job: str,
+    process_fn: Callable[[dict], object],
+    worker: Optional[str] = None,
+    poll_seconds: float = 10,
+    wait_for_leased: bool = True,
+) -> dict:
+    """
+    Claim and process units of a job until none are left.
+
+    `process_fn` receives the unit payload and returns a JSON-serialisable
+    result, which is committed with the unit. A heartbeat thread extends the
+    lease at a third of the lease time while `process_fn` runs. Exceptions
+    release the unit for a retry.
+
+    Args:
+        queue: WorkQueue holding the job.
+        job: Job name.
+        process_fn: Function processing one unit payload.
+        worker: Worker name recorded on claims; defaults to host:pid.
+        poll_seconds: Wait between checks while other workers hold leases.
+        wait_for_leased: Keep polling while units are leased by other workers,
+            so that units from crashed workers are picked up when their leases
+            expire. If False, exit as soon as nothing is claimable.
+
+    Returns:
+        dict counting units completed, failed and lost by this worker.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    counts = {"completed": 0, "failed": 0, "lost": 0}
+    while True:
+        unit = queue.claim(job, worker)
+        if unit is None:
+            if wait_for_leased and queue.status(job)["leased"] > 0:
+                time.sleep(poll_seconds)
+                continue
+            break
+
+        print(f"[{worker}] Processing {job}/{unit.unit_id} (attempt {unit.attempts})")
+        heartbeat = _Heartbeat(queue, unit, queue.lease_seconds / 3)
+        heartbeat.start()
+        try:
+            result = process_fn(unit.payload)
+        except Exception as e:
+            heartbeat.stop()
+            queue.fail(unit, repr(e))
+            counts["failed"] += 1
+            print(f"[{worker}] Unit {unit.unit_id} failed: {e!r}")
+            continue
+        heartbeat.stop()
+
+        if queue.complete(unit, result):
+            counts["completed"] += 1
+        else:
+            counts["lost"] += 1
+            print(f"[{worker}] Lease on {unit.unit_id} was lost; result discarded")
+
+    print(f"[{worker}] Finished: {counts}")
+    return counts
+
+
+def slice_units(n_slices: int, **payload):
+    """
+    Units for an Elasticsearch sliced scroll, one per slice
+    """
+    for slice_id in range(n_slices):
+        yield f"slice-{slice_id:04d}", {
+            **payload,
+            "slice_id": slice_id,
+            "n_slices": n_slices,
+        }
+
+
+def range_units(ids: list, size: int, **payload):
+    """
+    Units covering consecutive runs of `size` IDs
+    """
+    for start in range(0, len(ids), size):
+        yield f"ids-{start:09d}", {**payload, "ids": ids[start : start + size]}
+
+
+def shard_units(folder: str, n_shards: int, suffix: str = ".json", **payload):
+    """
+    Units splitting the files in an export folder into `n_shards` shards, by a
+    stable hash of the file name
+    """
+    shards = [[] for _ in range(n_shards)]
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(suffix):
+            shards[zlib.crc32(file_name.encode()) % n_shards].append(file_name)
+    for shard_id, files in enumerate(shards):
+        yield f"shard-{shard_id:04d}", {**payload, "folder": folder, "files": files}
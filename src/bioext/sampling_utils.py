@@ -0,0 +1,363 @@
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from bioext.parallel_utils import chunked, sqlite_connection
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    model_version TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    probs BLOB NOT NULL,
+    updated REAL,
+    PRIMARY KEY (model_version, doc_id)
+);
+CREATE TABLE IF NOT EXISTS selected (
+    doc_id TEXT PRIMARY KEY,
+    strategy TEXT,
+    model_version TEXT,
+    uncertainty REAL,
+    selected_at REAL
+);
+"""
+
+# SQLite's default limit on host parameters in one statement is 999
+_MAX_PARAMS = 900
+
+
+class ScoreCache:
+    def __init__(self, path: str) -> None:
+        """
+        Class probabilities per (model version, document ID), and the documents
+        already selected for annotation, in a SQLite file. Scores are only valid
+        for the model version that produced them, so a new model starts a fresh
+        set of scores while the old ones stay available.
+
+        Args:
+            path: SQLite database file; created if missing.
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite_connection(self.path)
+
+    def get_many(self, model_version: str, doc_ids: list) -> dict:
+        """
+        Cached probabilities for the given documents, as {doc_id: array}
+        """
+        found = {}
+        with self._connect() as conn:
+            for chunk in chunked(doc_ids, _MAX_PARAMS):
+                rows = conn.execute(
+                    "SELECT doc_id, probs FROM scores WHERE model_version = ? "
+                    f"AND doc_id IN ({','.join('?' * len(chunk))})",
+                    [model_version, *chunk],
+                )
+                for doc_id, probs in rows:
+                    found[doc_id] = np.frombuffer(probs, dtype=np.float32)
+        return found
+
+    def put_many(self, model_version: str, doc_ids: list, probs: np.ndarray):
+        now = time.time()
+        probs = np.asarray(probs, dtype=np.float32)
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                (
+                    (model_version, doc_id, row.tobytes(), now)
+                    for doc_id, row in zip(doc_ids, probs)
+                ),
+            )
+
+    def selected_ids(self) -> set:
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT doc_id FROM selected")}
+
+    def mark_selected(
+        self, records: Iterable, strategy: str, model_version: Optional[str] = None
+    ):
+        """
+        Record (doc_id, uncertainty) pairs sent for annotation, so later rounds
+        skip them
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO selected VALUES (?, ?, ?, ?, ?)",
+                (
+                    (doc_id, strategy, model_version, score, now)
+                    for doc_id, score in records
+                ),
+            )
+
+
+def resolve_model_uri(model_uri: str):
+    """
+    Pin a registered-model URI to a concrete version, so scores are cached against
+    the model that produced them. "models:/<name>/latest", stage URIs such as
+    "models:/<name>/Production" and "models:/<name>@alias" resolve through the
+    registry; other URIs (e.g. runs:/<run_id>/triage_model) identify their model
+    already.
+
+    Returns:
+        (pinned model URI, model version string for the score cache).
+    """
+    if not model_uri.startswith("models:/"):
+        return model_uri, model_uri
+
+    from mlflow import MlflowClient
+
+    client = MlflowClient()
+    name = model_uri[len("models:/") :]
+    if "@" in name:
+        name, alias = name.split("@", 1)
+        version = client.get_model_version_by_alias(name, alias).version
+    else:
+        name, _, version = name.partition("/")
+        if version in ("", "latest"):
+            versions = client.search_model_versions(f"name='{name}'")
+            if not versions:
+                raise ValueError(f"No versions registered for model {name}")
+            version = max(int(v.version) for v in versions)
+        elif not version.isdigit():
+            # a stage name; its model changes whenever a version is promoted
+            versions = client.get_latest_versions(name, [version])
+            if not versions:
+                raise ValueError(f"No version of model {name} in stage {version}")
+            version = max(int(v.version) for v in versions)
+    return f"models:/{name}/{version}", f"{name}/{version}"
+
+
+def uncertainty_scores(probs: np.ndarray, measure: str = "margin") -> np.ndarray:
+    """
+    Uncertainty of each row of class probabilities, from 0 (confident) to 1.
+
+    Args:
+        probs: (n_docs, n_classes) probabilities.
+        measure: "margin" (gap between the top two classes), "entropy" or
+            "least_confident" (1 - top probability).
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    if measure == "margin":
+        if probs.shape[1] < 2:
+            return np.zeros(len(probs))
+        top2 = np.partition(probs, -2, axis=1)[:, -2:]
+        return 1.0 - (top2[:, 1] - top2[:, 0])
+    if measure == "entropy":
+        logs = np.log(np.clip(probs, 1e-12, 1.0))
+        entropy = -(probs * logs).sum(axis=1) / np.log(max(probs.shape[1], 2))
+        return np.maximum(entropy, 0.0)
+    if measure == "least_confident":
+        return 1.0 - probs.max(axis=1)
+    raise ValueError(f"Unknown uncertainty measure: {measure}")
+
+
+def select_uncertain(uncertainty: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k most uncertain documents, most uncertain first
+    """
+    k = min(k, len(uncertainty))
+    if k == 0:
+        return np.array([], dtype=int)
+    top = np.argpartition(-uncertainty, k - 1)[:k]
+    return top[np.argsort(-uncertainty[top], kind="stable")]
+
+
+def select_stratified(
+    probs: np.ndarray, uncertainty: np.ndarray, k: int, n_bins: int = 4
+) -> np.ndarray:
+    """
+    Indices of k documents spread over strata of (predicted class, uncertainty
+    quantile), so a batch covers every predicted class, including rare ones, and
+    not only the decision boundary. Strata are visited round-robin, most
+    uncertain stratum first, taking the most uncertain remaining document from
+    each.
+    """
+    k = min(k, len(uncertainty))
+    predicted = probs.argmax(axis=1)
+    edges = np.quantile(uncertainty, np.linspace(0, 1, n_bins + 1)[1:-1])
+    bins = np.searchsorted(edges, uncertainty, side="right")
+
+    strata = []
+    for key in np.unique(predicted * n_bins + bins):
+        members = np.flatnonzero(predicted * n_bins + bins == key)
+        members = members[np.argsort(-uncertainty[members], kind="stable")]
+        strata.append(members)
+    strata.sort(key=lambda m: -uncertainty[m].mean())
+
+    selected, depth = [], 0
+    while len(selected) < k:
+        for members in strata:
+            if depth < len(members):
+                selected.append(members[depth])
+                if len(selected) == k:
+                    break
+        depth += 1
+    return np.array(selected, dtype=int)
+
+
+class UncertaintySampler:
+    def __init__(
+        self,
+        classifier,
+        model_version: str,
+        cache: ScoreCache,
+        batch_size: int = 1000,
+        measure: str = "margin",
+    ) -> None:
+        """
+        Chooses documents to annotate by model uncertainty instead of uniformly.
+
+        The candidate pool is scored in batches with `classifier.predict_proba`
+        (vectorized, e.g. a StreamingTextClassifier), and probabilities are cached
+        per document ID and model version. Later rounds with the same model only
+        score documents new to the pool, and only fetch the text of those;
+        retraining and registering a new model version triggers a fresh scoring.
+
+        Args:
+            classifier: Object with `predict_proba(texts) -> (n, n_classes) array`.
+            model_version: Identifies the model in the score cache.
+            cache: ScoreCache for scores and already-selected documents.
+            batch_size: Documents fetched and scored per batch.
+            measure: Uncertainty measure, see `uncertainty_scores`.
+        """
+        self.classifier = classifier
+        self.model_version = model_version
+        self.cache = cache
+        self.batch_size = batch_size
+        self.measure = measure
+        self.stats = {"cached": 0, "scored": 0, "missing": 0}
+
+    @classmethod
+    def from_mlflow(cls, model_uri: str, cache_path: str, **kwargs):
+        """
+        Sampler using a triage model logged by StreamingTextClassifier, e.g.
+        "models:/brca-triage/latest" for the latest registered version
+        """
+        from bioext.linear_utils import StreamingTextClassifier
+
+        pinned_uri, model_version = resolve_model_uri(model_uri)
+        print(f"Scoring with model {model_version}")
+        classifier = StreamingTextClassifier.from_mlflow(pinned_uri)
+        return cls(classifier, model_version, ScoreCache(cache_path), **kwargs)
+
+    def score(self, doc_ids: list, fetch_texts: Callable[[list], dict]):
+        """
+        Class probabilities for the pool, from the cache where possible.
+
+        Args:
+            doc_ids: Candidate document IDs.
+            fetch_texts: Returns {doc_id: text} for a batch of IDs; only called
+                for documents without cached scores.
+
+        Returns:
+            (doc_ids, probs) for the documents that could be scored.
+        """
+        scores = self.cache.get_many(self.model_version, doc_ids)
+        missing = [doc_id for doc_id in doc_ids if doc_id not in scores]
+        self.stats["cached"] += len(scores)
+        print(f"{len(scores)} cached scores, scoring {len(missing)} documents...")
+
+        for batch in chunked(missing, self.batch_size):
+            texts = fetch_texts(batch)
+            batch_ids = [doc_id for doc_id in batch if doc_id in texts]
+            self.stats["missing"] += len(batch) - len(batch_ids)
+            if not batch_ids:
+                continue
+            probs = self.classifier.predict_proba([texts[i] for i in batch_ids])
+            self.cache.put_many(self.model_version, batch_ids, probs)
+            scores.update(zip(batch_ids, np.asarray(probs, dtype=np.float32)))
+            self.stats["scored"] += len(batch_ids)
+
+        scored_ids = [doc_id for doc_id in doc_ids if doc_id in scores]
+        if not scored_ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return scored_ids, np.stack([scores[doc_id] for doc_id in scored_ids])
+
+    def select(
+        self,
+        doc_ids: list,
+        probs: np.ndarray,
+        size: int,
+        strategy: str = "uncertainty",
+        explore_fraction: float = 0.1,
+        random_state: Optional[int] = None,
+    ) -> list:
+        """
+        Choose `size` documents from a scored pool.
+
+        A share of `explore_fraction` is drawn uniformly from the rest of the
+        pool, so the labelled set still reflects the overall distribution and
+        the model's blind spots get found.
+
+        Returns:
+            list of (doc_id, uncertainty), in selection order.
+        """
+        if strategy not in ("uncertainty", "stratified"):
+            raise ValueError(f"Unknown strategy: {strategy}")
+        size = min(size, len(doc_ids))
+        if size == 0:
+            return []
+
+        uncertainty = uncertainty_scores(probs, self.measure)
+        n_explore = int(round(size * explore_fraction))
+        if strategy == "uncertainty":
+            chosen = select_uncertain(uncertainty, size - n_explore)
+        else:
+            chosen = select_stratified(probs, uncertainty, size - n_explore)
+
+        if n_explore:
+            rng = np.random.default_rng(random_state)
+            rest = np.setdiff1d(np.arange(len(doc_ids)), chosen)
+            chosen = np.concatenate(
+                [chosen, rng.choice(rest, min(n_explore, len(rest)), replace=False)]
+            )
+        return [(doc_ids[i], float(uncertainty[i])) for i in chosen]
+
+
+def select_for_annotation(
+    es_session,
+    index_name: str,
+    query: dict,
+    content_field: str,
+    size: int,
+    sampler: UncertaintySampler,
+    strategy: str = "uncertainty",
+    explore_fraction: float = 0.1,
+    random_state: Optional[int] = None,
+) -> list:
+    """
+    Select documents matching a query for annotation with an UncertaintySampler.
+    Documents selected in earlier rounds are left out of the pool. Record the
+    documents actually uploaded with `sampler.cache.mark_selected`.
+
+    Returns:
+        list of (doc_id, uncertainty).
+    """
+    already_selected = sampler.cache.selected_ids()
+    pool = [
+        hit.id
+        for hit in es_session.iter_hits(index_name, query=query, fields=[])
+        if hit.id not in already_selected
+    ]
+    print(f"Candidate pool: {len(pool)} documents ({len(already_selected)} excluded)")
+
+    def fetch_texts(doc_ids):
+        hits = es_session.get_documents_by_ids(index_name, doc_ids, [content_field])
+        return {h.id: h.source[content_field] for h in hits if content_field in h.source}
+
+    doc_ids, probs = sampler.score(pool, fetch_texts)
+    return sampler.select(
+        doc_ids,
+        probs,
+        size,
+        strategy=strategy,
+        explore_fraction=explore_fraction,
+        random_state=random_state,
+    )
@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class TransformersClassifier:
+    def __init__(
+        self, model_uri: str, max_length: int = 512, num_threads: Optional[int] = None
+    ) -> None:
+        """
+        Text classifier loaded from an MLflow-logged transformers model, e.g.
+        "models:/bert-brca/Production" or "runs:/<run_id>/bert_model", or from the
+        int8 variant logged by `export_utils.export_and_benchmark`
+        ("runs:/<run_id>/bert_model_int8").
+
+        Args:
+            model_uri: MLflow model URI (registry, run or artifact store path).
+            max_length: Truncation length.
+            num_threads: torch intra-op threads used by each forward pass.
+        """
+        import mlflow
+        import torch
+
+        self.torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        print(f"Loading model from {model_uri}...")
+        flavors = mlflow.models.get_model_info(model_uri).flavors
+        if "transformers" in flavors:
+            components = mlflow.transformers.load_model(
+                model_uri, return_type="components"
+            )
+            self.model = components["model"].eval()
+            self.tokenizer = components["tokenizer"]
+        else:
+            # pyfunc wrapper holding a quantized model and its tokenizer
+            wrapper = mlflow.pyfunc.load_model(model_uri).unwrap_python_model()
+            self.model, self.tokenizer = wrapper.model, wrapper.tokenizer
+        self.max_length = max_length
+        self.id2label = self.model.config.id2label
+
+    def __call__(self, texts: list[str]) -> list[dict]:
+        # pad to the longest text in this batch only
+        encoded = self.tokenizer(
+            texts,
+            padding="longest",
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        with self.torch.inference_mode():
+            probs = self.model(**encoded).logits.softmax(dim=-1)
+
+        scores, label_ids = probs.max(dim=-1)
+        return [
+            {"label": self.id2label[int(i)], "score": float(s)}
+            for i, s in zip(label_ids, scores)
+        ]
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        predict_fn: Callable[[list], list],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10,
+        n_workers: Optional[int] = None,
+        history: int = 1000,
+    ) -> None:
+        """
+        Gathers concurrent single-item requests into micro-batches.
+
+        A collector thread waits for the first queued item, then keeps collecting
+        until the batch is full or `max_wait_ms` has passed, and hands the batch to a
+        worker pool.
+
+        Args:
+            predict_fn: Callable taking a list of inputs and returning a list of
+                outputs in the same order.
+            max_batch_size: Maximum number of items per call to predict_fn.
+            max_wait_ms: Maximum time the first item in a batch waits for others.
+            n_workers: Number of batches run concurrently. Defaults to 1; with
+                torch models, prefer few workers each with several threads.
+            history: Number of recent batch sizes kept in `batch_sizes`; totals
+                over the batcher's lifetime are in `n_batches` and `n_items`.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pool = ThreadPoolExecutor(max_workers=n_workers or 1)
+
+        self.batch_sizes = deque(maxlen=history)
+        self.n_batches = 0
+        self.n_items = 0
+        self._queue = queue.Queue()
+        # submit and close both hold it, so no item is queued after the sentinel
+        self._lock = threading.Lock()
+        self._closed = False
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((item, future))
+        return future
+
+    def predict(self, items: list) -> list:
+        """
+        Submit several items and wait for all results
+        """
+        futures = [self.submit(item) for item in items]
+        return [f.result() for f in futures]
+
+    def close(self):
+        """
+        Stop accepting items, wait for the queued ones to be predicted and shut down
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._collector.join()
+        self.pool.shutdown(wait=True)
+
+    def _collect(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+
+            self.batch_sizes.append(len(batch))
+            self.n_batches += 1
+            self.n_items += len(batch)
+            self.pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            outputs = list(self.predict_fn([item for item, _ in batch]))
+            if len(outputs) != len(batch):
+                # zip would leave the unmatched futures waiting forever
+                raise ValueError(
+                    f"predict_fn returned {len(outputs)} outputs for "
+                    f"{len(batch)} inputs"
+                )
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+
+def _parse_inputs(body):
+    """
+    Accept the MLflow scoring formats used by `mlflow models serve`
+    """
+    if "inputs" in body:
+        inputs = body["inputs"]
+    elif "instances" in body:
+        inputs = body["instances"]
+    elif "dataframe_split" in body:
+        inputs = [row[0] for row in body["dataframe_split"]["data"]]
+    elif "dataframe_records" in body:
+        inputs = [next(iter(row.values())) for row in body["dataframe_records"]]
+    else:
+        raise ValueError("Expected one of inputs, instances, dataframe_split/records")
+    return [inputs] if isinstance(inputs, str) else list(inputs)
+
+
+class BatchingHTTPServer(ThreadingHTTPServer):
+    # a deep listen backlog, so bursts of concurrent clients are not reset
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_handler(batcher: MicroBatcher):
+    class _Handler(BaseHTTPRequestHandler):
+        # keep-alive avoids a TCP handshake per request
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path in ("/ping", "/health"):
+                self._reply(200, {"status": "ok"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/invocations":
+                return self._reply(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                inputs = _parse_inputs(body)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {"error": str(e)})
+            try:
+                predictions = batcher.predict(inputs)
+            except Exception as e:
+                return self._reply(500, {"error": str(e)})
+            self._reply(200, {"predictions": predictions})
+
+    return _Handler
+
+
+def serve(
+    model_uri: str,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    max_batch_size: int = 32,
+    max_wait_ms: float = 10,
+    n_workers: Optional[int] = None,
+    max_length: int = 512,
+):
+    """
+    Serve an MLflow-logged transformers classifier over HTTP with micro-batching.
+
+    Exposes /invocations (MLflow scoring format) and /ping. Available cores are split
+    between `n_workers` concurrent batches, each using cores // n_workers torch
+    threads.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        n_cores = len(os.sched_getaffinity(0))
+    else:
+        n_cores = os.cpu_count() or 1
+    n_workers = n_workers or max(1, n_cores // 4)
+    threads_per_worker = max(1, n_cores // n_workers)
+
+    classifier = TransformersClassifier(
+        model_uri, max_length=max_length, num_threads=threads_per_worker
+    )
+    batcher = MicroBatcher(
+        classifier,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        n_workers=n_workers,
+    )
+
+    server = BatchingHTTPServer((host, port), make_handler(batcher))
+    print(
+        f"Serving {model_uri} on http://{host}:{port} "
+        f"({n_workers} workers x {threads_per_worker} threads, "
+        f"batch <= {max_batch_size}, wait <= {max_wait_ms}ms)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching model server")
+    parser.add_argument("-m", "--model_uri", required=True, help="MLflow model URI")
+    parser.add_argument("-H", "--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("--max_batch_size", type=int, default=32)
+    parser.add_argument("--max_wait_ms", type=float, default=10)
+    parser.add_argument("--n_workers", type=int, default=None)
+    parser.add_argument("--max_length", type=int, default=512)
+    args = parser.parse_args()
+
+    serve(
+        args.model_uri,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        n_workers=args.n_workers,
+        max_length=args.max_length,
+    )
@@ -0,0 +1,391 @@
+import os
+import shutil
+import zlib
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from bioext.extraction_utils import schema_cardinality
+
+DOCUMENTS_TABLE = "documents"
+ID_FIELD = "source_id"
+
+# fields that are numeric in the extraction schema; everything else is text
+_INTEGER_FIELDS = {"year", "month"}
+
+
+def generate_mapping(schema: Optional[dict] = None) -> dict:
+    """
+    Generate an Elasticsearch mapping for extraction outputs.
+
+    Repeated entities (cardinality "multiple" or repeatable) are mapped as nested
+    objects so that e.g. a timeline event's type and year can be queried together.
+    Free-text fields are indexed as text with a keyword sub-field for aggregations.
+
+    Args:
+        schema: Extraction schema (as stored in the prompt registry). If not given,
+            only the metadata fields are mapped and the rest is dynamic.
+    """
+    text_field = {
+        "type": "text",
+        "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+    }
+
+    def _properties(fields, nested_spec):
+        props = {}
+        for name, spec in fields.items():
+            if isinstance(spec, dict):
+                continue
+            props[name] = {"type": "integer"} if name in _INTEGER_FIELDS else text_field
+        for name, spec in nested_spec.items():
+            props[name] = _entity_mapping(spec)
+        return props
+
+    def _entity_mapping(spec):
+        fields = spec.get("fields", {})
+        nested_spec = {
+            k: v
+            for k, v in list(spec.items()) + list(fields.items())
+            if isinstance(v, dict) and k != "fields"
+        }
+        mapping = {"properties": _properties(fields, nested_spec)}
+        if spec.get("cardinality") == "multiple" or spec.get("repeatable"):
+            mapping["type"] = "nested"
+        return mapping
+
+    properties = {
+        ID_FIELD: {"type": "keyword"},
+        "prompt_name": {"type": "keyword"},
+        "prompt_version": {"type": "keyword"},
+        "prompt_hash": {"type": "keyword"},
+        "model": {"type": "keyword"},
+        "staged_at": {"type": "date"},
+    }
+    if schema:
+        structure = schema.get("schema_structure", schema)
+        for name, spec in structure.items():
+            properties[name] = _entity_mapping(spec)
+
+    return {"properties": properties}
+
+
+def flatten_extractions(records: list[dict], schema: Optional[dict] = None) -> dict:
+    """
+    Flatten staged extraction records into column-oriented tables.
+
+    Single-valued fields become columns of the `documents` table (one row per source
+    document, nested names joined with "_"). Each repeated entity type becomes its own
+    table with one row per item, keyed by source_id and item_index (numbered per
+    document). Items repeated inside another item also have a parent_index column,
+    the item_index of the row they belong to.
+
+    Args:
+        records: list of dicts, each containing source_id, metadata and extraction.
+        schema: Optional extraction schema, used to decide which fields repeat.
+
+    Returns:
+        dict of {table name: _ColumnBuffer}; use `.to_arrow()` for an Arrow table
+    """
+    rules = schema_cardinality(schema) if schema else {}
+    tables = {}
+
+    for record in records:
+        doc_row = {}
+        _flatten_into(record, "", record[ID_FIELD], rules, doc_row, tables)
+        tables.setdefault(DOCUMENTS_TABLE, _ColumnBuffer()).append(doc_row)
+
+    return tables
+
+
+def _flatten_into(
+    obj, prefix, source_id, rules, row, tables, parent_index=None, counters=None
+):
+    # item_index counts the items of a table per document, so (source_id,
+    # item_index) identifies a row and nested items join back via parent_index
+    counters = {} if counters is None else counters
+    for key, value in obj.items():
+        path = f"{prefix}{key}"
+        if rules.get(path) == "multiple" or isinstance(value, list):
+            items = value if isinstance(value, list) else [value]
+            for item in items:
+                index = counters.get(key, 0)
+                counters[key] = index + 1
+                item_row = {ID_FIELD: source_id, "item_index": index}
+                if parent_index is not None:
+                    item_row["parent_index"] = parent_index
+                if isinstance(item, dict):
+                    _flatten_into(
+                        item, "", source_id, {}, item_row, tables, index, counters
+                    )
+                else:
+                    item_row["value"] = item
+                tables.setdefault(key, _ColumnBuffer()).append(item_row)
+        elif isinstance(value, dict):
+            _flatten_into(
+                value, f"{path}.", source_id, rules, row, tables, parent_index, counters
+            )
+        else:
+            row[path.replace(".", "_")] = value
+
+
+class _ColumnBuffer:
+    """
+    Column-oriented row buffer; columns seen for the first time are backfilled
+    with nulls so that all columns stay the same length
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = {}
+
+    def append(self, row):
+        for column, value in row.items():
+            if column not in self.columns:
+                self.columns[column] = [None] * self.n_rows
+            self.columns[column].append(value)
+        self.n_rows += 1
+        for values in self.columns.values():
+            if len(values) < self.n_rows:
+                values.append(None)
+
+    def to_arrow(self) -> pa.Table:
+        """
+        Convert to an Arrow table, building one array per column
+        """
+        arrays = []
+        for values in self.columns.values():
+            try:
+                array = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # mixed types from the model (e.g. year given as "2023" and 2023)
+                array = pa.array([None if v is None else str(v) for v in values])
+            if pa.types.is_null(array.type):
+                array = array.cast(pa.string())
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, names=list(self.columns))
+
+
+class ExtractionSink:
+    def __init__(
+        self,
+        es_session=None,
+        index_name: Optional[str] = None,
+        parquet_dir: Optional[str] = None,
+        schema: Optional[dict] = None,
+        batch_size: int = 500,
+        n_partitions: int = 16,
+    ) -> None:
+        """
+        Stages NLP extraction outputs into an Elasticsearch index and/or a set of
+        partitioned Parquet tables.
+
+        Writes are idempotent per source document ID: Elasticsearch documents use the
+        source ID as _id, and Parquet partitions replace any existing rows for the
+        source IDs in a batch. Re-running extraction over the same documents
+        therefore upserts rather than duplicates.
+
+        Args:
+            es_session: ElasticsearchSession to index into; skipped if None.
+            index_name: Output index name, created with a generated mapping if missing.
+            parquet_dir: Root folder for Parquet tables; skipped if None.
+            schema: Extraction schema, used for the mapping and for flattening.
+            batch_size: Number of records written per batch.
+            n_partitions: Number of hash partitions per Parquet table.
+        """
+        if es_session is not None and not index_name:
+            raise ValueError("index_name is required when staging to Elasticsearch")
+        if es_session is None and parquet_dir is None:
+            raise ValueError("Provide at least one of es_session or parquet_dir")
+
+        self.es_session = es_session
+        self.index_name = index_name
+        self.parquet_dir = parquet_dir
+        self.schema = schema
+        self.batch_size = batch_size
+        self.n_partitions = n_partitions
+
+        if es_session is not None:
+            es_session.create_index(
+                index_name=index_name,
+                mappings=generate_mapping(schema),
+                overwrite=False,
+            )
+
+    def write(self, results: Iterable, metadata: Optional[dict] = None) -> int:
+        """
+        Stage extraction results in batches.
+
+        Each batch is written to Parquet as new staging files, and each touched
+        partition is compacted once at the end of the call, so staging many
+        batches reads and rewrites every partition once rather than once per batch.
+
+        Args:
+            results: dict of {source_id: extraction}, or iterable of
+                (source_id, extraction) tuples. Non-dict extractions (e.g. refusals
+                for non-cancer letters) are staged with metadata only.
+            metadata: Fields added to every record, e.g. Prompt.provenance().
+
+        Returns:
+            Number of records staged.
+        """
+        if isinstance(results, dict):
+            results = results.items()
+        results = iter(results)
+
+        staged_at = datetime.now(timezone.utc).isoformat()
+        n_written = 0
+        # partition -> [(batch number, source IDs in the batch)]
+        pending = {}
+        if self.parquet_dir is not None:
+            # left behind by an interrupted write; never compacted
+            shutil.rmtree(self._staging_dir(), ignore_errors=True)
+
+        batch_number = 0
+        while batch := list(islice(results, self.batch_size)):
+            records = []
+            for source_id, extraction in batch:
+                record = {ID_FIELD: str(source_id), "staged_at": staged_at}
+                record.update(metadata or {})
+                if isinstance(extraction, dict):
+                    record.update(extraction)
+                records.append(record)
+
+            if self.es_session is not None:
+                self.es_session.bulk_upsert_documents(
+                    self.index_name, records, id_field=ID_FIELD
+                )
+            if self.parquet_dir is not None:
+                self._write_batch(records, batch_number, pending)
+
+            batch_number += 1
+            n_written += len(records)
+            print(f"Staged {n_written} extraction records...")
+
+        if self.parquet_dir is not None and pending:
+            self._compact(pending)
+        return n_written
+
+    def _partition(self, source_id):
+        return zlib.crc32(source_id.encode("utf-8")) % self.n_partitions
+
+    def _staging_dir(self):
+        # "_"-prefixed folders are skipped by Parquet dataset readers
+        return os.path.join(self.parquet_dir, "_staging")
+
+    def _write_batch(self, records, batch_number, pending):
+        partitions = {}
+        for record in records:
+            partitions.setdefault(self._partition(record[ID_FIELD]), []).append(record)
+
+        for partition, part_records in partitions.items():
+            pending.setdefault(partition, []).append(
+                (batch_number, [r[ID_FIELD] for r in part_records])
+            )
+            tables = flatten_extractions(part_records, self.schema)
+            for table_name, buffer in tables.items():
+                folder = os.path.join(
+                    self._staging_dir(), table_name, f"partition={partition}"
+                )
+                os.makedirs(folder, exist_ok=True)
+                pq.write_table(
+                    buffer.to_arrow(),
+                    os.path.join(folder, f"batch-{batch_number:06d}.parquet"),
+                )
+
+    def _existing_tables(self):
+        tables = set()
+        for root in (self.parquet_dir, self._staging_dir()):
+            if os.path.isdir(root):
+                tables.update(
+                    name
+                    for name in os.listdir(root)
+                    if not name.startswith("_")
+                    and os.path.isdir(os.path.join(root, name))
+                )
+        return sorted(tables)
+
+    def _compact(self, pending):
+        # tables missing from a batch must still drop stale rows for its IDs
+        for table_name in self._existing_tables():
+            for partition, batches in pending.items():
+                self._compact_partition(table_name, partition, batches)
+        shutil.rmtree(self._staging_dir(), ignore_errors=True)
+
+    def _compact_partition(self, table_name, partition, batches):
+        partition_dir = f"partition={partition}"
+        folder = os.path.join(self.parquet_dir, table_name, partition_dir)
+        staging = os.path.join(self._staging_dir(), table_name, partition_dir)
+        path = os.path.join(folder, "part-0.parquet")
+
+        tables = []
+        if os.path.exists(path):
+            tables.append(pq.read_table(path, partitioning=None))
+        for batch_number, source_ids in batches:
+            # later batches replace earlier rows for the same source IDs
+            value_set = pa.array(source_ids, type=pa.string())
+            tables = [
+                t.filter(pc.invert(pc.is_in(t[ID_FIELD], value_set=value_set)))
+                for t in tables
+            ]
+            batch_path = os.path.join(staging, f"batch-{batch_number:06d}.parquet")
+            if os.path.exists(batch_path):
+                tables.append(pq.read_table(batch_path, partitioning=None))
+        if not tables:
+            return
+
+        table = _concat_tables(tables)
+        os.makedirs(folder, exist_ok=True)
+        # write then rename, so a crash never leaves a half-written partition
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _unified_type(types):
+    concrete = {t for t in types if not pa.types.is_null(t)}
+    if not concrete:
+        return pa.string()
+    if len(concrete) == 1:
+        return concrete.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in concrete):
+        return pa.float64()
+    # e.g. a field given as a number in one batch and as text in another
+    return pa.string()
+
+
+def _cast_column(column, target):
+    if column.type == target:
+        return column
+    try:
+        return column.cast(target)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        values = column.to_pylist()
+        return pa.array([None if v is None else str(v) for v in values], type=target)
+
+
+def _concat_tables(tables: list) -> pa.Table:
+    """
+    Concatenate tables whose columns may differ or disagree on type, casting each
+    to one schema first: missing columns are filled with nulls, mixed numeric
+    columns become float64 and any other conflict becomes string.
+    """
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            types.setdefault(field.name, []).append(field.type)
+    schema = pa.schema([pa.field(name, _unified_type(t)) for name, t in types.items()])
+
+    conformed = []
+    for table in tables:
+        columns = [
+            _cast_column(table[field.name], field.type)
+            if field.name in table.column_names
+            else pa.nulls(len(table), field.type)
+            for field in schema
+        ]
+        conformed.append(pa.Table.from_arrays(columns, schema=schema))
+    return pa.concat_tables(conformed)
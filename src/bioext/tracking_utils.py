@@ -0,0 +1,359 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import mlflow
+from mlflow.entities import Metric, Param, RunTag
+
+# MLflow REST limits for a single log_batch call
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_TAGS_PER_BATCH = 100
+MAX_PARAM_LENGTH = 500
+
+
+class AsyncTracker:
+    def __init__(
+        self,
+        run_id: Optional[str] = None,
+        flush_interval: float = 5.0,
+        max_buffered_metrics: int = 5000,
+        upload_workers: int = 4,
+        multipart_chunk_mb: Optional[int] = 100,
+        max_retries: int = 3,
+        log_overhead: bool = True,
+        client=None,
+    ) -> None:
+        """
+        Non-blocking MLflow tracking for a run.
+
+        Params, metrics and tags are appended to an in-memory buffer, which a
+        background thread sends with `log_batch` every `flush_interval` seconds (or
+        sooner once `max_buffered_metrics` are waiting), so per-step logging costs
+        the training loop a list append rather than a tracking-server round trip.
+        Timestamps are taken when a value is logged, not when it is sent.
+
+        Artifacts are uploaded by a thread pool, one file per task, so a model
+        directory uploads its files concurrently. With `multipart_chunk_mb`, large
+        files go through the tracking server's proxied multipart upload (the
+        deployment serves artifacts from MinIO via `--serve-artifacts`), and their
+        parts are uploaded concurrently as well.
+
+        `close` (also called on leaving a `with` block, including on an exception,
+        and at interpreter exit) sends everything still buffered and waits for
+        uploads. Failed batches are retried with backoff and then dropped with a
+        warning, so tracking problems never stop training. With `log_overhead`,
+        the time the caller spent in tracking calls and waiting on close is logged
+        to the run as `tracking_*` metrics.
+
+        Args:
+            run_id: Run to log to; defaults to the active run.
+            flush_interval: Seconds between background flushes.
+            max_buffered_metrics: Buffered metric values that trigger an early flush.
+            upload_workers: Concurrent artifact uploads.
+            multipart_chunk_mb: Part size for proxied multipart uploads; None leaves
+                the MLflow defaults.
+            max_retries: Attempts per batch or upload before giving up.
+            log_overhead: Log the tracker's own overhead to the run on close.
+            client: MlflowClient; defaults to one for the current tracking URI.
+        """
+        if run_id is None:
+            active = mlflow.active_run()
+            if active is None:
+                raise ValueError("No run_id given and no active MLflow run")
+            run_id = active.info.run_id
+
+        if multipart_chunk_mb is not None:
+            os.environ.setdefault("MLFLOW_ENABLE_PROXY_MULTIPART_UPLOAD", "true")
+            os.environ.setdefault(
+                "MLFLOW_MULTIPART_UPLOAD_CHUNK_SIZE", str(multipart_chunk_mb << 20)
+            )
+
+        self.run_id = run_id
+        self.client = client or mlflow.MlflowClient()
+        self.flush_interval = flush_interval
+        self.max_buffered_metrics = max_buffered_metrics
+        self.max_retries = max_retries
+        self.log_overhead = log_overhead
+
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._params = {}
+        self._tags = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+
+        self._uploads = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="mlflow-upload"
+        )
+
+        self.stats = {
+            "caller_seconds": 0.0,
+            "flush_seconds": 0.0,
+            "upload_seconds": 0.0,
+            "close_wait_seconds": 0.0,
+            "batches": 0,
+            "metrics": 0,
+            "uploads": 0,
+            "failed_batches": 0,
+            "failed_uploads": 0,
+        }
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="mlflow-flush", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def log_metric(self, key: str, value: float, step: Optional[int] = None):
+        start = time.perf_counter()
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._metrics.append((key, float(value), timestamp, step or 0))
+            n_buffered = len(self._metrics)
+        if n_buffered >= self.max_buffered_metrics:
+            self._wake.set()
+        self.stats["caller_seconds"] += time.perf_counter() - start
+
+    def log_metrics(self, metrics: dict, step: Optional[int] = None):
+        start = time.perf_counter()
+        timestamp = int(time.time() * 1000)
+        values = [(k, float(v), timestamp, step or 0) for k, v in metrics.items()]
+        with self._lock:
+            self._metrics.extend(values)
+            n_buffered = len(self._metrics)
+        if n_buffered >= self.max_buffered_metrics:
+            self._wake.set()
+        self.stats["caller_seconds"] += time.perf_counter() - start
+
+    def log_param(self, key: str, value):
+        self.log_params({key: value})
+
+    def log_params(self, params: dict):
+        start = time.perf_counter()
+        with self._lock:
+            for key, value in params.items():
+                self._params[key] = str(value)[:MAX_PARAM_LENGTH]
+        self.stats["caller_seconds"] += time.perf_counter() - start
+
+    def set_tag(self, key: str, value):
+        self.set_tags({key: value})
+
+    def set_tags(self, tags: dict):
+        start = time.perf_counter()
+        with self._lock:
+            for key, value in tags.items():
+                self._tags[key] = str(value)
+        self.stats["caller_seconds"] += time.perf_counter() - start
+
+    def log_artifact(self, local_path: str, artifact_path: Optional[str] = None):
+        """
+        Upload a file in the background. Returns a Future.
+        """
+        start = time.perf_counter()
+        future = self._uploads.submit(self._upload, local_path, artifact_path)
+        self.stats["caller_seconds"] += time.perf_counter() - start
+        return future
+
+    def log_artifacts(self, local_dir: str, artifact_path: Optional[str] = None):
+        """
+        Upload the files in a folder in the background, concurrently. Returns a
+        list of Futures.
+        """
+        futures = []
+        for root, _, files in os.walk(local_dir):
+            rel_dir = os.path.relpath(root, local_dir)
+            parts = [p for p in (artifact_path, rel_dir) if p and p != "."]
+            for file_name in files:
+                futures.append(
+                    self.log_artifact(
+                        os.path.join(root, file_name),
+                        "/".join(parts) if parts else None,
+                    )
+                )
+        return futures
+
+    def log_model(self, save_fn: Callable, artifact_path: str, **kwargs):
+        """
+        Save a model locally with an MLflow flavour's `save_model` (e.g.
+        `mlflow.sklearn.save_model`) and upload it in the background. The model is
+        serialised before returning, so training can carry on and change it; it can
+        then be loaded from `runs:/<run_id>/<artifact_path>`.
+
+        Args:
+            save_fn: Flavour `save_model` function, called with `path=` and kwargs.
+            artifact_path: Run-relative folder for the model.
+            kwargs: Passed to `save_fn`, e.g. sk_model=..., signature=...
+
+        Returns:
+            list of Futures, one per uploaded file.
+        """
+        tmp_dir = tempfile.mkdtemp(prefix="bioext_model_")
+        local_path = os.path.join(tmp_dir, os.path.basename(artifact_path))
+        save_fn(path=local_path, **kwargs)
+        futures = self.log_artifacts(local_path, artifact_path)
+
+        # remove the local copy once every file is uploaded
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        for future in futures:
+            future.add_done_callback(_done)
+        if not futures:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return futures
+
+    def _upload(self, local_path, artifact_path):
+        start = time.perf_counter()
+        outcome = "failed_uploads"
+        try:
+            self._retry(
+                lambda: self.client.log_artifact(self.run_id, local_path, artifact_path),
+                f"upload of {local_path}",
+            )
+            outcome = "uploads"
+        finally:
+            # uploads finish on several threads
+            with self._lock:
+                self.stats[outcome] += 1
+                self.stats["upload_seconds"] += time.perf_counter() - start
+
+    def _retry(self, fn, description):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"MLflow {description} failed after {attempt} attempts: {e}")
+                    raise
+                time.sleep(min(2**attempt, 30))
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Send everything buffered so far. Called by the background thread; safe to
+        call directly.
+        """
+        with self._lock:
+            metrics, self._metrics = self._metrics, []
+            params, self._params = list(self._params.items()), {}
+            tags, self._tags = list(self._tags.items()), {}
+        if not (metrics or params or tags):
+            return
+
+        start = time.perf_counter()
+        # params and tags go in their own batches, so a rejected param (e.g. one
+        # changing a value already logged) does not drop the metrics with it
+        for i in range(0, len(params), MAX_PARAMS_TAGS_PER_BATCH):
+            batch = params[i : i + MAX_PARAMS_TAGS_PER_BATCH]
+            self._send_batch(params=[Param(k, v) for k, v in batch])
+        for i in range(0, len(tags), MAX_PARAMS_TAGS_PER_BATCH):
+            batch = tags[i : i + MAX_PARAMS_TAGS_PER_BATCH]
+            self._send_batch(tags=[RunTag(k, v) for k, v in batch])
+        for i in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+            batch = [Metric(*m) for m in metrics[i : i + MAX_METRICS_PER_BATCH]]
+            self._send_batch(metrics=batch)
+        with self._lock:
+            self.stats["flush_seconds"] += time.perf_counter() - start
+
+    def _send_batch(self, metrics=(), params=(), tags=()):
+        try:
+            self._retry(
+                lambda: self.client.log_batch(
+                    self.run_id,
+                    metrics=list(metrics),
+                    params=list(params),
+                    tags=list(tags),
+                ),
+                "log_batch",
+            )
+        except Exception:
+            with self._lock:
+                self.stats["failed_batches"] += 1
+            return
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["metrics"] += len(metrics)
+
+    def close(self):
+        """
+        Flush buffered values, wait for uploads and stop the background thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+
+        start = time.perf_counter()
+        self._stop.set()
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        self._uploads.shutdown(wait=True)
+        self.stats["close_wait_seconds"] = time.perf_counter() - start
+
+        if self.log_overhead:
+            self.log_metrics(
+                {
+                    "tracking_caller_seconds": self.stats["caller_seconds"],
+                    "tracking_close_wait_seconds": self.stats["close_wait_seconds"],
+                    "tracking_background_seconds": self.stats["flush_seconds"]
+                    + self.stats["upload_seconds"],
+                    "tracking_failed_batches": self.stats["failed_batches"],
+                    "tracking_failed_uploads": self.stats["failed_uploads"],
+                }
+            )
+            self.flush()
+        print(
+            f"MLflow tracking: {self.stats['metrics']} metric values in "
+            f"{self.stats['batches']} batches, {self.stats['uploads']} uploads; "
+            f"{self.stats['caller_seconds'] * 1000:.1f} ms spent in the caller, "
+            f"{self.stats['close_wait_seconds']:.1f}s waiting on close"
+        )
+
+
+def trainer_callback(tracker: AsyncTracker):
+    """
+    Hugging Face Trainer callback that logs training arguments and every logging
+    step through an AsyncTracker. Use with `report_to="none"` so the built-in,
+    synchronous MLflow callback is not also active.
+    """
+    from transformers import TrainerCallback
+
+    class AsyncTrackerCallback(TrainerCallback):
+        def on_train_begin(self, args, state, control, **kwargs):
+            if state.is_world_process_zero:
+                tracker.log_params(args.to_dict())
+
+        def on_log(self, args, state, control, logs=None, **kwargs):
+            if state.is_world_process_zero and logs:
+                numeric = {
+                    k: v
+                    for k, v in logs.items()
+                    if isinstance(v, (int, float)) and not isinstance(v, bool)
+                }
+                tracker.log_metrics(numeric, step=state.global_step)
+
+    return AsyncTrackerCallback()
@@ -0,0 +1,141 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+from typing import Optional
+
+import transformers
+from datasets import load_from_disk
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.getenv("BIOEXT_CACHE_DIR", os.path.expanduser("~/.cache/bioext")), "tokenized"
+)
+# written last into a cache folder; folders without it are partial
+_COMPLETE_MARKER = "_COMPLETE"
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Identify a tokenizer by name, class, transformers version and (for fast
+    tokenizers) a hash of its full serialised state, so that a re-trained or edited
+    vocabulary under the same name is not mistaken for the cached one
+    """
+    parts = [
+        tokenizer.name_or_path,
+        type(tokenizer).__name__,
+        transformers.__version__,
+    ]
+    if getattr(tokenizer, "is_fast", False):
+        parts.append(
+            hashlib.sha256(tokenizer.backend_tokenizer.to_str().encode()).hexdigest()
+        )
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+def dataset_fingerprint(dataset, batch_size: int = 10_000) -> str:
+    """
+    Hash of a dataset's features and rows, in order. Reading the rows is much cheaper
+    than tokenizing them, and unlike a path or in-memory fingerprint the hash is the
+    same in every process for the same data.
+    """
+    digest = hashlib.sha256(repr(dataset.features).encode())
+    for batch in dataset.iter(batch_size=batch_size):
+        digest.update(json.dumps(batch, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _remove_stale(cache_path):
+    """
+    Remove leftovers of interrupted runs: temporary folders of processes that are no
+    longer running, and a cache folder without a completion marker
+    """
+    for tmp_path in glob.glob(f"{glob.escape(cache_path)}.tmp-*"):
+        pid = tmp_path.rsplit("-", 1)[-1]
+        try:
+            os.kill(int(pid), 0)
+        except (ValueError, ProcessLookupError):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        except PermissionError:
+            # a live process owned by another user
+            pass
+    if os.path.isdir(cache_path) and not os.path.exists(
+        os.path.join(cache_path, _COMPLETE_MARKER)
+    ):
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+
+def tokenize_dataset(
+    dataset,
+    tokenizer,
+    max_length: int = 512,
+    text_column: str = "text",
+    cache_dir: Optional[str] = None,
+    num_proc: Optional[int] = None,
+    batch_size: int = 1000,
+):
+    """
+    Tokenize a HuggingFace dataset, reusing a previous result if available.
+
+    Results are stored as Arrow files under `cache_dir`, keyed by a hash of the
+    dataset contents, the tokenizer fingerprint and max_length, and are loaded back
+    memory mapped, so repeated runs (e.g. hyperparameter sweeps) skip tokenization
+    entirely.
+    Examples are not padded; use a padding data collator at training time.
+
+    Args:
+        dataset: datasets.Dataset with a text column.
+        tokenizer: HuggingFace tokenizer, ideally a fast tokenizer.
+        max_length: Truncation length.
+        text_column: Name of the column to tokenize.
+        cache_dir: Cache location; defaults to $BIOEXT_CACHE_DIR/tokenized.
+        num_proc: Number of worker processes; defaults to the number of CPUs.
+        batch_size: Examples per call to the tokenizer batch API.
+
+    Returns:
+        (tokenized dataset, cache hit as bool)
+    """
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    cache_key = hashlib.sha256(
+        f"{dataset_fingerprint(dataset)}|{tokenizer_fingerprint(tokenizer)}|"
+        f"{max_length}|{text_column}".encode()
+    ).hexdigest()[:24]
+    cache_path = os.path.join(cache_dir, cache_key)
+    marker = os.path.join(cache_path, _COMPLETE_MARKER)
+
+    if os.path.exists(marker):
+        print(f"Loading tokenized dataset from cache: {cache_path}")
+        return load_from_disk(cache_path), True
+    _remove_stale(cache_path)
+
+    # workers each run the Rust tokenizer; avoid nested thread pools after fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    num_proc = num_proc or os.cpu_count() or 1
+    # every worker needs at least one example; small splits still use several
+    num_proc = max(1, min(num_proc, len(dataset)))
+
+    print(f"Tokenizing {len(dataset)} examples with {num_proc} process(es)...")
+    tokenized = dataset.map(
+        lambda batch: tokenizer(
+            batch[text_column], truncation=True, max_length=max_length
+        ),
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc,
+        desc="Tokenizing",
+    )
+
+    # save to a temporary folder first and mark it complete, so an interrupted run
+    # never leaves a cache that looks usable
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    tokenized.save_to_disk(tmp_path)
+    open(os.path.join(tmp_path, _COMPLETE_MARKER), "w").close()
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(marker):
+            raise
+        # another process populated the cache concurrently
+
+    return load_from_disk(cache_path), False
@@ -0,0 +1,444 @@
+import hashlib
+import inspect
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.getenv("BIOEXT_CACHE_DIR", os.path.expanduser("~/.cache/bioext")), "tuning"
+)
+
+
+def data_fingerprint(X, y=None) -> str:
+    """
+    Content hash of a dataset (numpy arrays, pandas frames/series or lists),
+    including shapes, dtypes and column names
+    """
+    digest = hashlib.sha256()
+    for data in (X, y):
+        if data is None:
+            continue
+        if hasattr(data, "columns"):
+            digest.update(json.dumps([str(c) for c in data.columns]).encode())
+        array = np.ascontiguousarray(
+            data.to_numpy() if hasattr(data, "to_numpy") else np.asarray(data)
+        )
+        digest.update(f"{array.shape}{array.dtype}".encode())
+        if array.dtype == object:
+            digest.update(json.dumps(array.tolist(), default=str).encode())
+        else:
+            digest.update(array.data)
+    return digest.hexdigest()[:16]
+
+
+def _estimator_key(estimator) -> dict:
+    """
+    Flat, JSON-serialisable description of an estimator and all nested params
+    """
+    params = {}
+    for name, value in estimator.get_params(deep=True).items():
+        if hasattr(value, "get_params"):
+            # nested estimators are covered by their own "name__param" entries
+            value = type(value).__name__
+        elif isinstance(value, (list, tuple)) and any(
+            hasattr(v, "get_params") or isinstance(v, tuple) for v in value
+        ):
+            # e.g. Pipeline.steps
+            value = [str(v[0]) if isinstance(v, tuple) else str(v) for v in value]
+        params[name] = value
+    return {"class": type(estimator).__name__, "params": params}
+
+
+def _scoring_key(scoring) -> Optional[str]:
+    """
+    Stable description of a scoring argument, or None if it has none (e.g. a
+    callable object whose repr is its memory address), in which case folds are not
+    cached. Functions are identified by module, qualified name and source.
+    """
+    if scoring is None or isinstance(scoring, str):
+        return str(scoring)
+    if inspect.isfunction(scoring) or inspect.ismethod(scoring):
+        try:
+            source = inspect.getsource(scoring)
+        except (OSError, TypeError):
+            return None
+        return f"{scoring.__module__}.{scoring.__qualname__}\n{source}"
+    key = repr(scoring)
+    # e.g. make_scorer(f1_score, average=macro) is stable; default reprs are not
+    return None if " at 0x" in key else key
+
+
+def _min_stratified_resources(y_permuted, n_splits) -> int:
+    """
+    Smallest prefix of the permuted labels with `n_splits` examples of every class
+    (or all of a class, if it has fewer), so every rung can be stratified
+    """
+    floor = 0
+    for label in np.unique(y_permuted):
+        positions = np.flatnonzero(y_permuted == label)
+        floor = max(floor, int(positions[min(n_splits, len(positions)) - 1]) + 1)
+    return floor
+
+
+def _index(data, idx):
+    return data.iloc[idx] if hasattr(data, "iloc") else data[idx]
+
+
+def _fit_and_score(estimator, X, y, train_idx, test_idx, scorer):
+    start = time.perf_counter()
+    try:
+        estimator.fit(_index(X, train_idx), _index(y, train_idx))
+        fit_time = time.perf_counter() - start
+        score = float(scorer(estimator, _index(X, test_idx), _index(y, test_idx)))
+        error = None
+    except Exception as e:
+        # a failing candidate is scored as nan rather than stopping the search
+        fit_time = time.perf_counter() - start
+        score, error = float("nan"), repr(e)
+    return {"score": score, "fit_time": fit_time, "error": error}
+
+
+class FoldCache:
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        """
+        On-disk memo of cross-validation fold results, one small JSON file per fold,
+        keyed by data fingerprint, estimator params, train/test indices, scoring and
+        scikit-learn version
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, data_fp, estimator, train_idx, test_idx, scoring) -> Optional[str]:
+        """
+        Cache key of a fold, or None if the scoring cannot be identified across
+        processes (see `_scoring_key`)
+        """
+        scoring_key = _scoring_key(scoring)
+        if scoring_key is None:
+            return None
+        digest = hashlib.sha256()
+        header = {
+            "data": data_fp,
+            "estimator": _estimator_key(estimator),
+            "scoring": scoring_key,
+            "sklearn": sklearn.__version__,
+        }
+        digest.update(json.dumps(header, sort_keys=True, default=repr).encode())
+        digest.update(np.ascontiguousarray(train_idx, dtype=np.int64).data)
+        digest.update(b"|")
+        digest.update(np.ascontiguousarray(test_idx, dtype=np.int64).data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key) -> Optional[dict]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, result: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+
+class _TrialLogger:
+    """
+    Logs trials as nested MLflow child runs of a parent run from a small thread
+    pool, with one create_run, one log_batch and one set_terminated call per trial
+    """
+
+    def __init__(self, parent_run_id, experiment_id, max_workers=8):
+        from mlflow import MlflowClient
+
+        self.client = MlflowClient()
+        self.parent_run_id = parent_run_id
+        self.experiment_id = experiment_id
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+
+    def log(self, trials: list):
+        self._futures.extend(self._pool.submit(self._log_trial, t) for t in trials)
+
+    def _log_trial(self, trial):
+        from mlflow.entities import Metric, Param, RunTag
+
+        run = self.client.create_run(
+            self.experiment_id,
+            run_name=f"trial-{trial['candidate']:03d}-round-{trial['round']}",
+            tags={"mlflow.parentRunId": self.parent_run_id},
+        )
+        timestamp = int(time.time() * 1000)
+        params = {
+            **{k: str(v)[:500] for k, v in trial["params"].items()},
+            "n_resources": trial["n_resources"],
+            "round": trial["round"],
+        }
+        metrics = [
+            Metric("mean_test_score", trial["mean_test_score"], timestamp, 0),
+            Metric("std_test_score", trial["std_test_score"], timestamp, 0),
+            Metric("mean_fit_time", trial["mean_fit_time"], timestamp, 0),
+        ]
+        metrics += [
+            Metric("fold_test_score", score, timestamp, fold)
+            for fold, score in enumerate(trial["fold_scores"])
+        ]
+        self.client.log_batch(
+            run.info.run_id,
+            metrics=[m for m in metrics if not math.isnan(m.value)],
+            params=[Param(k, str(v)) for k, v in params.items()],
+            tags=[RunTag("cached_folds", str(trial["n_cached_folds"]))],
+        )
+        self.client.set_terminated(run.info.run_id)
+
+    def close(self):
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to log trial to MLflow: {e}")
+        self._pool.shutdown()
+
+
+class HyperparameterSearch:
+    def __init__(
+        self,
+        estimator,
+        param_grid,
+        scoring=None,
+        cv=5,
+        search: str = "halving",
+        factor: int = 3,
+        min_resources: Optional[int] = None,
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
+        cache_dir: Optional[str] = None,
+        refit: bool = True,
+        random_state: int = 0,
+    ) -> None:
+        """
+        Cross-validated hyperparameter search with parallel fits, on-disk fold
+        memoization and MLflow child runs per trial.
+
+        With search="grid", every candidate is scored on all of the data. With
+        search="halving" (successive halving), all candidates are first scored on
+        a small random subsample, and only the best 1/`factor` go on to the next
+        round, which uses `factor` times more samples, until the last round uses
+        all of the data. This spends most of the compute on promising candidates.
+
+        Each (candidate, fold) fit runs as a joblib task across `n_jobs` workers.
+        Fold results are cached on disk, keyed by the data fingerprint, the full
+        estimator params and the exact train/test indices, so repeating a search,
+        or extending its grid, only fits configurations and folds not seen before.
+
+        Args:
+            estimator: scikit-learn estimator or Pipeline.
+            param_grid: dict, or list of dicts, of param name -> values.
+            scoring: scikit-learn scoring name or callable; defaults to the
+                estimator's score method.
+            cv: Number of folds or a CV splitter. Integer folds are shuffled with
+                `random_state`, so the folds (and cache keys) are stable.
+            search: "halving" or "grid".
+            factor: Fraction of candidates (1/factor) kept per halving round.
+            min_resources: Samples used in the first halving round; defaults to
+                1/factor**3 of the data. For classifiers, rounds are enlarged if
+                needed to hold `cv` examples of every class.
+            n_jobs: Parallel fits (-1 for all cores).
+            backend: joblib backend, e.g. "loky", "threading" or a registered
+                Dask/Ray backend.
+            cache_dir: Fold cache folder; defaults to $BIOEXT_CACHE_DIR/tuning.
+            refit: Refit the best candidate on all of the data.
+            random_state: Seed for subsampling and fold shuffling.
+        """
+        if search not in ("grid", "halving"):
+            raise ValueError(f"Unknown search: {search}")
+        self.estimator = estimator
+        self.candidates = list(ParameterGrid(param_grid))
+        self.scoring = scoring
+        self.cv = cv
+        self.search = search
+        self.factor = factor
+        self.min_resources = min_resources
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.cache = FoldCache(cache_dir)
+        self.refit = refit
+        self.random_state = random_state
+
+    def _splitter(self, y):
+        if isinstance(self.cv, int):
+            from sklearn.model_selection import KFold, StratifiedKFold
+
+            splitter = StratifiedKFold if is_classifier(self.estimator) else KFold
+            return splitter(self.cv, shuffle=True, random_state=self.random_state)
+        return check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+
+    def _schedule(self, n_samples, n_splits, floor=0):
+        """
+        (n_candidates, n_resources) for each round. The sample sizes depend only
+        on the data, not on the number of candidates, so an extended grid reuses
+        the cached folds of the original one. No round uses fewer than `floor`
+        samples.
+        """
+        if self.search == "grid":
+            return [(len(self.candidates), n_samples)]
+        min_resources = self.min_resources or max(
+            math.ceil(n_samples / self.factor**3), 10 * n_splits
+        )
+        min_resources = max(min_resources, floor)
+        schedule = []
+        n_candidates = len(self.candidates)
+        n_resources = min(min_resources, n_samples)
+        while n_candidates > 1 and n_resources < n_samples:
+            schedule.append((n_candidates, n_resources))
+            n_candidates = math.ceil(n_candidates / self.factor)
+            n_resources *= self.factor
+        schedule.append((n_candidates, n_samples))
+        return schedule
+
+    def fit(self, X, y, log_to_mlflow: bool = True):
+        """
+        Run the search. If an MLflow run is active and `log_to_mlflow` is set,
+        every trial is logged as a child run of it.
+
+        Sets best_params_, best_score_, best_estimator_ (if refit), cv_results_
+        (one dict per trial) and stats (fits run vs. served from the cache).
+        """
+        scorer = check_scoring(self.estimator, scoring=self.scoring)
+        data_fp = data_fingerprint(X, y)
+        n_samples = len(y)
+        splitter = self._splitter(y)
+        permutation = np.random.default_rng(self.random_state).permutation(n_samples)
+
+        logger = None
+        if log_to_mlflow:
+            import mlflow
+
+            active = mlflow.active_run()
+            if active is not None:
+                logger = _TrialLogger(active.info.run_id, active.info.experiment_id)
+
+        self.cv_results_ = []
+        self.stats = {"fits": 0, "cached_fits": 0, "fit_seconds": 0.0}
+        candidates = list(range(len(self.candidates)))
+        n_splits = splitter.get_n_splits()
+        floor = 0
+        if is_classifier(self.estimator):
+            # with imbalanced labels a small rung may hold too few of a class to
+            # stratify its folds
+            floor = _min_stratified_resources(np.asarray(y)[permutation], n_splits)
+        schedule = self._schedule(n_samples, n_splits, floor)
+        start = time.perf_counter()
+        try:
+            for round_idx, (n_candidates, n_resources) in enumerate(schedule):
+                candidates = candidates[:n_candidates]
+                # subsamples are nested, so later rounds reuse earlier indices
+                subset = np.sort(permutation[:n_resources])
+                folds = [
+                    (subset[train], subset[test])
+                    for train, test in splitter.split(
+                        _index(X, subset), _index(y, subset)
+                    )
+                ]
+                trials = self._evaluate(
+                    candidates, folds, X, y, scorer, data_fp, round_idx, n_resources
+                )
+                self.cv_results_.extend(trials)
+                if logger is not None:
+                    logger.log(trials)
+                print(
+                    f"Round {round_idx}: {len(candidates)} candidates on "
+                    f"{n_resources} samples, best {trials[0]['mean_test_score']:.4f}"
+                )
+                candidates = [t["candidate"] for t in trials]
+        finally:
+            if logger is not None:
+                logger.close()
+        self.stats["search_seconds"] = time.perf_counter() - start
+
+        final_round = self.cv_results_[-len(candidates) :]
+        best = final_round[0]
+        self.best_index_ = best["candidate"]
+        self.best_params_ = best["params"]
+        self.best_score_ = best["mean_test_score"]
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_)
+            self.best_estimator_.fit(X, y)
+        print(
+            f"Search finished: {self.stats['fits']} fits run, "
+            f"{self.stats['cached_fits']} served from cache"
+        )
+        return self
+
+    def _evaluate(self, candidates, folds, X, y, scorer, data_fp, round_idx, n_res):
+        """
+        Score candidates on folds, running only the fits missing from the cache.
+        Returns trials sorted by mean test score, best first.
+        """
+        results = {}
+        tasks = []
+        for c in candidates:
+            estimator = clone(self.estimator).set_params(**self.candidates[c])
+            for k, (train_idx, test_idx) in enumerate(folds):
+                key = self.cache.key(
+                    data_fp, estimator, train_idx, test_idx, self.scoring
+                )
+                cached = self.cache.get(key) if key is not None else None
+                if cached is not None:
+                    results[(c, k)] = {**cached, "cached": True}
+                else:
+                    tasks.append((c, k, key, clone(estimator), train_idx, test_idx))
+
+        if tasks:
+            outputs = joblib.Parallel(n_jobs=self.n_jobs, backend=self.backend)(
+                joblib.delayed(_fit_and_score)(est, X, y, train_idx, test_idx, scorer)
+                for _, _, _, est, train_idx, test_idx in tasks
+            )
+            for (c, k, key, *_), output in zip(tasks, outputs):
+                results[(c, k)] = {**output, "cached": False}
+                if output["error"] is None and key is not None:
+                    self.cache.put(key, output)
+                self.stats["fit_seconds"] += output["fit_time"]
+        self.stats["fits"] += len(tasks)
+        self.stats["cached_fits"] += len(results) - len(tasks)
+
+        trials = []
+        for c in candidates:
+            fold_results = [results[(c, k)] for k in range(len(folds))]
+            scores = np.array([r["score"] for r in fold_results])
+            trials.append(
+                {
+                    "candidate": c,
+                    "params": self.candidates[c],
+                    "round": round_idx,
+                    "n_resources": n_res,
+                    "fold_scores": scores.tolist(),
+                    "mean_test_score": float(np.mean(scores)),
+                    "std_test_score": float(np.std(scores)),
+                    "mean_fit_time": float(np.mean([r["fit_time"] for r in fold_results])),
+                    "n_cached_folds": sum(r["cached"] for r in fold_results),
+                    "errors": [r["error"] for r in fold_results if r["error"]],
+                }
+            )
+        # nan scores (failed fits) sort last
+        trials.sort(
+            key=lambda t: np.nan_to_num(t["mean_test_score"], nan=-np.inf),
+            reverse=True,
+        )
+        return trials
@@ -0,0 +1,24 @@
+# matching behaviour of the local cohort filter
+# run with: pytest tests/test_filter
+
+from bioext.filter_utils import MultiPatternMatcher
+
+
+def test_overlapping_regex_rules_all_match():
+    matcher = MultiPatternMatcher(
+        [
+            {"name": "gene", "regex": ["brca[12]"]},
+            {"name": "brca2", "regex": ["brca2 variant"]},
+        ]
+    )
+    result = matcher.match("doc", "BRCA2 variant found")
+    assert result.counts == {"gene": 1, "brca2": 1}
+    assert result.selected
+
+
+def test_negation_terms_match_whole_words_only():
+    matcher = MultiPatternMatcher(
+        [{"name": "breast", "keywords": ["breast"], "negations": ["no", "not"]}]
+    )
+    assert matcher.match("doc", "Piano breast lesion").counts == {"breast": 1}
+    assert matcher.match("doc", "No breast lesion").counts == {}
@@ -0,0 +1,115 @@
+# import-time budget for bioext and the local_synth_brca CLI
+# run with: pytest tests/test_import_time
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+CLI_PATH = os.path.join(REPO_ROOT, "projects", "local_synth_brca", "main.py")
+
+# budgets for the imports themselves (interpreter start-up is excluded), in ms
+BIOEXT_BUDGET_MS = float(os.getenv("BIOEXT_IMPORT_BUDGET_MS", 50))
+CLI_HELP_BUDGET_MS = float(os.getenv("BIOEXT_CLI_IMPORT_BUDGET_MS", 150))
+
+HEAVY_MODULES = [
+    "elasticsearch",
+    "elastic_transport",
+    "doccano_client",
+    "yaml",
+    "mlflow",
+    "numpy",
+    "sklearn",
+    "torch",
+    "transformers",
+]
+
+
+def _run(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(REPO_ROOT, "src"), env.get("PYTHONPATH", "")]
+    )
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+
+
+def _import_time_ms(stderr, exclude=()):
+    """
+    Total cumulative import time of top-level imports in -X importtime output
+    """
+    total_us = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented under the import that triggered them
+        if not name.startswith("  ") and name.strip() not in exclude:
+            total_us += int(cumulative)
+    return total_us / 1000
+
+
+def _startup_modules():
+    """
+    Modules imported by a bare interpreter, not attributable to our code
+    """
+    result = _run(["-c", "pass"])
+    return {line.split("|")[2].strip() for line in result.stderr.splitlines()[1:]}
+
+
+def test_import_bioext_is_cheap():
+    code = (
+        "import json, sys, bioext; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    result = _run(["-c", code])
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    assert loaded == [], f"`import bioext` loaded heavy modules: {loaded}"
+
+    elapsed = _import_time_ms(result.stderr, exclude=_startup_modules() | {"json"})
+    assert elapsed < BIOEXT_BUDGET_MS, f"`import bioext` took {elapsed:.1f} ms"
+
+
+def test_lazy_attribute_loads_only_its_submodule():
+    code = (
+        "import json, sys, bioext; bioext.PromptRegistry; bioext.filter_utils; "
+        "print(json.dumps(sorted(m for m in sys.modules if m.startswith('bioext'))))"
+    )
+    loaded = json.loads(_run(["-c", code]).stdout.strip().splitlines()[-1])
+    # codec_utils is the shared JSON layer both of them serialise through, and
+    # parallel_utils runs filter_utils' process pool
+    assert loaded == [
+        "bioext",
+        "bioext.codec_utils",
+        "bioext.filter_utils",
+        "bioext.parallel_utils",
+        "bioext.prompt_utils",
+    ]
+
+
+def test_cli_help_skips_clients():
+    pytest.importorskip("dotenv")
+    code = (
+        "import json, runpy, sys; sys.argv = ['main.py', '--help']\n"
+        "try:\n"
+        f"    runpy.run_path({CLI_PATH!r}, run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    result = _run(["-c", code])
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    assert loaded == [], f"`main.py --help` loaded heavy modules: {loaded}"
+
+    elapsed = _import_time_ms(
+        result.stderr, exclude=_startup_modules() | {"json", "runpy"}
+    )
+    assert elapsed < CLI_HELP_BUDGET_MS, f"`main.py --help` took {elapsed:.1f} ms"
@@ -10,10 +10,13 @@ from dotenv import load_dotenv
 from mlflow.models import infer_signature
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import f1_score, precision_score, recall_score
-from sklearn.model_selection import GridSearchCV, train_test_split
+from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 
+from bioext.tracking_utils import AsyncTracker
+from bioext.tuning_utils import HyperparameterSearch
+
 load_dotenv(override=True)
 
 
@@ -66,27 +69,44 @@ def mlflow_logistic_regression():
         "classifier__solver": ["liblinear", "saga"],
         "classifier__max_iter": [10, 100, 1000],
     }
-    grid_search = GridSearchCV(pipeline, param_grid, cv=5, scoring="f1")
+    # successive halving over a process pool; folds already fitted by an earlier
+    # run of this script are read from the on-disk cache
+    search = HyperparameterSearch(
+        pipeline, param_grid, cv=5, scoring="f1", search="halving", n_jobs=-1
+    )
 
-    with mlflow.start_run() as run:
-        grid_search.fit(X_train, y_train)
+    with mlflow.start_run() as run, AsyncTracker(run.info.run_id) as tracker:
+        # each trial is logged as a child run of this run
+        search.fit(X_train, y_train)
 
-        mlflow.log_params(grid_search.best_params_)
+        tracker.log_params(search.best_params_)
+        tracker.log_metrics(
+            {
+                "cv_f1": search.best_score_,
+                "search_fits": search.stats["fits"],
+                "search_cached_fits": search.stats["cached_fits"],
+            }
+        )
 
-        best_model = grid_search.best_estimator_
+        best_model = search.best_estimator_
 
         y_pred = best_model.predict(X_test)
         precision = precision_score(y_test, y_pred)
         recall = recall_score(y_test, y_pred)
         f1 = f1_score(y_test, y_pred)
 
-        mlflow.log_metric("precision", precision)
-        mlflow.log_metric("recall", recall)
-        mlflow.log_metric("f1_score", f1)
+        tracker.log_metrics(
+            {"precision": precision, "recall": recall, "f1_score": f1}
+        )
 
-        # log metadata and model
+        # log metadata and model; the upload runs in the background
         signature = infer_signature(X_test, y_pred)
-        mlflow.sklearn.log_model(best_model, "tuned_model", signature=signature)
+        tracker.log_model(
+            mlflow.sklearn.save_model,
+            "tuned_model",
+            sk_model=best_model,
+            signature=signature,
+        )
 
     print(f"MLflow run completed. Run ID: {run.info.run_id}")
     print(f"Precision: {precision:.2f}")